@@ -0,0 +1,8 @@
+"""
+Benchmarks for the TimeTracker API
+
+They run on top of the in-memory Cosmos DB, so no Azure account is needed.
+Run them from the root of the project, e.g.
+
+    python -m benchmarks.cosmos_db_benchmark --entries 1000 10000
+"""
@@ -0,0 +1,121 @@
+"""
+Cost of the collision detection of a time entry as the entries of its owner
+grow, with the overlap query on the epoch fields against the `BETWEEN`
+query on the ISO strings it replaced
+
+    python -m benchmarks.collision_benchmark --entries 100 1000 10000
+"""
+import argparse
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.utils import generate_time_entries, measure
+from time_tracker_api import create_app
+
+
+def between_interception_query(
+    start_date: str, end_date: str, owner_id: str, tenant_id: str
+):
+    return (
+        """
+        SELECT * FROM c
+        WHERE (((c.start_date BETWEEN @start_date AND @end_date)
+              OR (c.end_date BETWEEN @start_date AND @end_date))
+              OR ((@start_date BETWEEN c.start_date AND c.end_date)
+              OR (@end_date BETWEEN c.start_date AND c.end_date)))
+              AND c.start_date!= @end_date
+              AND c.end_date!= @start_date
+        AND c.owner_id = @owner_id AND c.tenant_id = @tenant_id
+        AND (NOT IS_DEFINED(c.deleted) OR c.deleted = null)
+        ORDER BY c.start_date DESC
+        """,
+        [
+            {"name": "@start_date", "value": start_date},
+            {"name": "@end_date", "value": end_date},
+            {"name": "@owner_id", "value": owner_id},
+            {"name": "@tenant_id", "value": tenant_id},
+        ],
+    )
+
+
+def request_charge(container, query_str: str, params: list, tenant_id: str):
+    charges = []
+    list(
+        container.query_items(
+            query=query_str,
+            parameters=params,
+            partition_key=tenant_id,
+            response_hook=lambda headers, _: charges.append(
+                float(headers['x-ms-request-charge'])
+            ),
+        )
+    )
+    return sum(charges)
+
+
+def run(amount: int, repetitions: int):
+    from commons.data_access_layer.cosmos_db import cosmos_helper
+    from time_tracker_api.time_entries.time_entries_model import (
+        container_definition,
+    )
+    from time_tracker_api.time_entries.time_entries_namespace import (
+        time_entries_dao,
+    )
+
+    cosmos_helper.create_container_if_not_exists(container_definition)
+    repository = time_entries_dao.repository
+    container = repository.container
+    tenant_id, owner_id = str(uuid.uuid4()), str(uuid.uuid4())
+    for time_entry in generate_time_entries(
+        amount, tenant_id, [owner_id], ['project'], ['activity']
+    ):
+        repository.add_timestamps(time_entry)
+        container.create_item(body=time_entry)
+
+    # A new entry of the last hour, that collides with the latest ones
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    start_date = (now - timedelta(hours=3)).isoformat()
+    end_date = now.isoformat()
+
+    queries = {
+        'BETWEEN on ISO strings': between_interception_query(
+            start_date, end_date, owner_id, tenant_id
+        ),
+        'overlap on epoch fields': repository.create_sql_interception_query(
+            start_date, end_date, owner_id, tenant_id
+        ),
+    }
+    print("\n{} time entries of the owner".format(amount))
+    for name, (query_str, params) in queries.items():
+        measure(
+            'collision detection ({})'.format(name),
+            lambda: list(
+                container.query_items(
+                    query=query_str, parameters=params, partition_key=tenant_id
+                )
+            ),
+            repetitions,
+        )
+        print(
+            "{:<55} RU={:>9.2f}".format(
+                '', request_charge(container, query_str, params, tenant_id)
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--entries', type=int, nargs='+', default=[100, 1000, 10000]
+    )
+    parser.add_argument('--repetitions', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app('time_tracker_api.config.TestConfig')
+    with app.app_context():
+        for amount in args.entries:
+            run(amount, args.repetitions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Throughput and latency of the time entry reads as the data grows
+
+    python -m benchmarks.cosmos_db_benchmark --entries 1000 10000 100000
+"""
+import argparse
+import uuid
+
+import jwt
+
+from benchmarks.utils import generate_time_entries, measure
+from commons.data_access_layer.database import EventContext
+from time_tracker_api import create_app
+from utils.azure_users import AzureUser, azure_directory
+from utils.time import current_datetime_str
+
+
+def seed(tenant_id: str, amount: int, users: int, projects: int) -> dict:
+    from commons.data_access_layer.cosmos_db import cosmos_helper
+    from time_tracker_api.activities.activities_model import (
+        container_definition as activity_definition,
+    )
+    from time_tracker_api.customers.customers_model import (
+        container_definition as customer_definition,
+    )
+    from time_tracker_api.projects.projects_model import (
+        container_definition as project_definition,
+    )
+    from time_tracker_api.time_entries.time_entries_model import (
+        container_definition as time_entry_definition,
+    )
+    from time_tracker_api.time_entries.time_entries_repository import (
+        TimeEntryCosmosDBRepository,
+    )
+
+    def container(definition: dict):
+        cosmos_helper.create_container_if_not_exists(definition)
+        return cosmos_helper.db.get_container_client(definition['id'])
+
+    customer_ids = [str(uuid.uuid4()) for _ in range(max(projects // 10, 1))]
+    for i, customer_id in enumerate(customer_ids):
+        container(customer_definition).create_item(
+            body={
+                'id': customer_id,
+                'name': 'Customer %s' % i,
+                'tenant_id': tenant_id,
+            }
+        )
+
+    project_ids = [str(uuid.uuid4()) for _ in range(projects)]
+    for i, project_id in enumerate(project_ids):
+        container(project_definition).create_item(
+            body={
+                'id': project_id,
+                'name': 'Project %s' % i,
+                'customer_id': customer_ids[i % len(customer_ids)],
+                'tenant_id': tenant_id,
+            }
+        )
+
+    activity_ids = [str(uuid.uuid4()) for _ in range(20)]
+    for i, activity_id in enumerate(activity_ids):
+        container(activity_definition).create_item(
+            body={
+                'id': activity_id,
+                'name': 'Activity %s' % i,
+                'tenant_id': tenant_id,
+            }
+        )
+
+    owner_ids = [str(uuid.uuid4()) for _ in range(users)]
+    time_entries_container = container(time_entry_definition)
+    for time_entry in generate_time_entries(
+        amount, tenant_id, owner_ids, project_ids, activity_ids
+    ):
+        TimeEntryCosmosDBRepository.add_timestamps(time_entry)
+        time_entries_container.create_item(body=time_entry)
+
+    return {'owner_ids': owner_ids, 'project_ids': project_ids}
+
+
+def run(app, amount: int, users: int, projects: int, repetitions: int):
+    from time_tracker_api.time_entries.time_entries_dao import (
+        TimeEntriesCosmosDBDao,
+        records_total_cache,
+    )
+    from time_tracker_api.time_entries.time_entries_namespace import (
+        time_entries_dao,
+    )
+    from utils import worked_time
+
+    tenant_id = str(uuid.uuid4())
+    seeded = seed(tenant_id, amount, users, projects)
+    owner_id = seeded['owner_ids'][0]
+    event_context = EventContext(
+        'time_entry', 'read-many', user_id=owner_id, tenant_id=tenant_id
+    )
+    repository = time_entries_dao.repository
+    date_range = TimeEntriesCosmosDBDao.handle_date_filter_args({})
+
+    print(
+        "\n{} time entries, {} users, {} projects".format(
+            amount, users, projects
+        )
+    )
+    measure(
+        'find_all_entries (owner, current month)',
+        lambda: repository.find_all_entries(
+            event_context,
+            conditions={'owner_id': owner_id},
+            date_range=dict(date_range),
+        ),
+        repetitions,
+    )
+    measure(
+        'find_all_entries (tenant, current month)',
+        lambda: repository.find_all_entries(
+            event_context, date_range=dict(date_range)
+        ),
+        repetitions,
+    )
+    measure(
+        'find_all_entries (owner, summary range)',
+        lambda: repository.find_all_entries(
+            event_context,
+            conditions={'owner_id': owner_id},
+            date_range=worked_time.date_range(),
+        ),
+        repetitions,
+    )
+    measure(
+        'find_interception_with_date_range (owner)',
+        lambda: repository.find_interception_with_date_range(
+            start_date=date_range['start_date'],
+            end_date=current_datetime_str(),
+            owner_id=owner_id,
+            tenant_id=tenant_id,
+        ),
+        repetitions,
+    )
+
+    token = jwt.encode(
+        {
+            'iss': 'https://ioetec.b2clogin.com/%s/v2.0/' % tenant_id,
+            'oid': owner_id,
+        },
+        key='benchmark',
+    ).decode('UTF-8')
+    with app.test_request_context(
+        headers={'Authorization': 'Bearer %s' % token}
+    ):
+        measure(
+            'get_lastest_entries_by_project',
+            lambda: time_entries_dao.get_lastest_entries_by_project(
+                conditions={}
+            ),
+            repetitions,
+        )
+
+        # The owners are found in the cache of the directory, so Azure AD is
+        # not called
+        azure_directory.cache_users(
+            [
+                AzureUser(id, 'User', 'user@ioet.com', [])
+                for id in seeded['owner_ids']
+            ]
+        )
+
+        def first_page():
+            records_total_cache.clear()
+            return time_entries_dao.get_all_paginated({'length': 50})
+
+        measure('get_all_paginated (first page)', first_page, repetitions)
+        measure(
+            'get_all_paginated (page flip)',
+            lambda: time_entries_dao.get_all_paginated({'length': 50}),
+            repetitions,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--entries', type=int, nargs='+', default=[1000, 10000, 100000]
+    )
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--projects', type=int, default=100)
+    parser.add_argument('--repetitions', type=int, default=10)
+    args = parser.parse_args()
+
+    app = create_app('time_tracker_api.config.TestConfig')
+    for amount in args.entries:
+        run(app, amount, args.users, args.projects, args.repetitions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Hash joins of `utils.extend_model` against the nested loops they replaced
+
+    python -m benchmarks.extend_model_benchmark --entries 1000 9999
+"""
+import argparse
+import uuid
+
+from benchmarks.utils import generate_time_entries, measure
+from time_tracker_api.activities.activities_model import ActivityCosmosDBModel
+from time_tracker_api.customers.customers_model import CustomerCosmosDBModel
+from time_tracker_api.projects.projects_model import ProjectCosmosDBModel
+from time_tracker_api.time_entries.time_entries_model import (
+    TimeEntryCosmosDBModel,
+)
+from utils.azure_users import AzureUser
+from utils.extend_model import (
+    add_complementary_info_to_time_entries,
+    add_customer_name_to_projects,
+)
+
+
+def nested_loops_customer_name(projects, customers):
+    for project in projects:
+        for customer in customers:
+            if project.customer_id == customer.id:
+                setattr(project, 'customer_name', customer.name)
+
+
+def nested_loops_complementary_info(time_entries, projects, activities, users):
+    for time_entry in time_entries:
+        for project in projects:
+            if time_entry.project_id == project.id:
+                name = (
+                    project.name + " (archived)"
+                    if project.is_deleted()
+                    else project.name
+                )
+                setattr(time_entry, 'project_name', name)
+                setattr(time_entry, 'customer_id', project.customer_id)
+                setattr(time_entry, 'customer_name', project.customer_name)
+    for time_entry in time_entries:
+        for activity in activities:
+            if time_entry.activity_id == activity.id:
+                name = (
+                    activity.name + " (archived)"
+                    if activity.is_deleted()
+                    else activity.name
+                )
+                setattr(time_entry, 'activity_name', name)
+    for time_entry in time_entries:
+        for user in users:
+            if time_entry.owner_id == user.id:
+                setattr(time_entry, 'owner_email', user.email)
+
+
+def generate_models(amount: int, users: int, projects: int) -> dict:
+    tenant_id = str(uuid.uuid4())
+    customers = [
+        CustomerCosmosDBModel({'id': str(uuid.uuid4()), 'name': 'C%s' % i})
+        for i in range(max(projects // 10, 1))
+    ]
+    projects = [
+        ProjectCosmosDBModel(
+            {
+                'id': str(uuid.uuid4()),
+                'name': 'Project %s' % i,
+                'customer_id': customers[i % len(customers)].id,
+                'deleted': str(uuid.uuid4()) if i % 20 == 0 else None,
+            }
+        )
+        for i in range(projects)
+    ]
+    activities = [
+        ActivityCosmosDBModel({'id': str(uuid.uuid4()), 'name': 'A%s' % i})
+        for i in range(20)
+    ]
+    users = [
+        AzureUser(str(uuid.uuid4()), 'User %s' % i, 'u%s@ioet.com' % i, [])
+        for i in range(users)
+    ]
+    time_entries = [
+        TimeEntryCosmosDBModel(time_entry)
+        for time_entry in generate_time_entries(
+            amount,
+            tenant_id,
+            [user.id for user in users[:50]],
+            [project.id for project in projects],
+            [activity.id for activity in activities],
+        )
+    ]
+    return {
+        'customers': customers,
+        'projects': projects,
+        'activities': activities,
+        'users': users,
+        'time_entries': time_entries,
+    }
+
+
+def run(amount: int, users: int, projects: int, repetitions: int):
+    models = generate_models(amount, users, projects)
+    customers = models['customers']
+    projects_list = models['projects']
+    time_entries = models['time_entries']
+    lookups = (projects_list, models['activities'], models['users'])
+
+    print(
+        "\n{} time entries, {} users, {} projects".format(
+            amount, users, projects
+        )
+    )
+    measure(
+        'customer name (nested loops)',
+        lambda: nested_loops_customer_name(projects_list, customers),
+        repetitions,
+    )
+    measure(
+        'customer name (hash join)',
+        lambda: add_customer_name_to_projects(projects_list, customers),
+        repetitions,
+    )
+    measure(
+        'time entries complementary info (nested loops)',
+        lambda: nested_loops_complementary_info(time_entries, *lookups),
+        repetitions,
+    )
+    measure(
+        'time entries complementary info (hash join)',
+        lambda: add_complementary_info_to_time_entries(time_entries, *lookups),
+        repetitions,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, nargs='+', default=[1000, 9999])
+    parser.add_argument('--users', type=int, default=3000)
+    parser.add_argument('--projects', type=int, default=500)
+    parser.add_argument('--repetitions', type=int, default=3)
+    args = parser.parse_args()
+
+    for amount in args.entries:
+        run(amount, args.users, args.projects, args.repetitions)
+
+
+if __name__ == '__main__':
+    main()
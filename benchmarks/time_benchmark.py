@@ -0,0 +1,123 @@
+"""
+Parsing of the dates of the time entries with `utils.time.str_to_datetime`
+against the dateutil parsing it replaced, and its effect on the summary of
+the worked time
+
+    python -m benchmarks.time_benchmark --entries 1000 10000
+"""
+import argparse
+import uuid
+
+from benchmarks.utils import generate_time_entries, measure
+from time_tracker_api.time_entries.time_entries_model import (
+    TimeEntryCosmosDBModel,
+)
+from utils import time as time_utils
+from utils import worked_time
+
+
+def dateutil_str_to_datetime(value: str):
+    def to_utc(date):
+        from pytz import timezone
+
+        _tz = timezone('UTC')
+        localized = _tz.localize(date)
+        return localized
+
+    from dateutil.parser import isoparse
+
+    no_timezone_info = isoparse(value).tzinfo is None
+    if no_timezone_info:
+        return to_utc(isoparse(value))
+    else:
+        return isoparse(value)
+
+
+def parse_dates(time_entries, parse):
+    for time_entry in time_entries:
+        parse(time_entry['start_date'])
+        parse(time_entry['end_date'])
+
+
+def run(amount: int, repetitions: int):
+    fast_str_to_datetime = time_utils.str_to_datetime
+    time_entries = generate_time_entries(
+        amount, str(uuid.uuid4()), [str(uuid.uuid4())], ['p'], ['a']
+    )
+    # The dates as the clients send them, in UTC with a `Z`
+    utc_time_entries = [
+        {
+            'start_date': time_entry['start_date'].replace('+00:00', 'Z'),
+            'end_date': time_entry['end_date'].replace('+00:00', 'Z'),
+        }
+        for time_entry in time_entries
+    ]
+    models = [TimeEntryCosmosDBModel(t) for t in time_entries]
+
+    def cold(function):
+        def run_cold():
+            fast_str_to_datetime.cache_clear()
+            function()
+
+        return run_cold
+
+    print("\n{} time entries".format(amount))
+    measure(
+        'parse dates (dateutil)',
+        lambda: parse_dates(time_entries, dateutil_str_to_datetime),
+        repetitions,
+    )
+    measure(
+        'parse dates (fromisoformat, cold cache)',
+        cold(lambda: parse_dates(time_entries, fast_str_to_datetime)),
+        repetitions,
+    )
+    measure(
+        'parse dates with Z (fromisoformat, cold cache)',
+        cold(lambda: parse_dates(utc_time_entries, fast_str_to_datetime)),
+        repetitions,
+    )
+    measure(
+        'parse dates (fromisoformat, warm cache)',
+        lambda: parse_dates(time_entries, fast_str_to_datetime),
+        repetitions,
+    )
+    dates = [fast_str_to_datetime(t['start_date']) for t in time_entries]
+    measure(
+        'format dates (datetime_str)',
+        lambda: [time_utils.datetime_str(date) for date in dates],
+        repetitions,
+    )
+
+    # The summary parses the dates through the module attribute
+    summary_parser = worked_time.str_to_datetime
+    try:
+        worked_time.str_to_datetime = dateutil_str_to_datetime
+        measure(
+            'worked time summary (dateutil)',
+            lambda: worked_time.summary(models, None),
+            repetitions,
+        )
+    finally:
+        worked_time.str_to_datetime = summary_parser
+    measure(
+        'worked time summary (fromisoformat, cold cache)',
+        cold(lambda: worked_time.summary(models, None)),
+        repetitions,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--entries', type=int, nargs='+', default=[1000, 10000]
+    )
+    parser.add_argument('--repetitions', type=int, default=10)
+    args = parser.parse_args()
+
+    for amount in args.entries:
+        run(amount, args.repetitions)
+
+
+if __name__ == '__main__':
+    main()
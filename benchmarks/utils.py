@@ -0,0 +1,95 @@
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+# The Azure AD client is never called by the benchmarks, but its settings are
+# validated when its module is imported
+for ms_variable in (
+    'MS_CLIENT_ID',
+    'MS_AUTHORITY',
+    'MS_SECRET',
+    'MS_SCOPE',
+    'MS_ENDPOINT',
+):
+    os.environ.setdefault(ms_variable, 'benchmark')
+os.environ.setdefault('DATABASE_NAME', 'benchmark')
+os.environ['COSMOS_DATABASE_URI'] = 'memory://'
+
+
+def measure(
+    name: str,
+    function: Callable,
+    repetitions: int = 20,
+    setup: Callable = None,
+) -> dict:
+    """
+    Run `function` several times and print its latency percentiles
+    :param name: Label of the measurement
+    :param function: Callable to benchmark, without arguments unless there
+        is a `setup`
+    :param repetitions: Number of times the callable is executed
+    :param setup: Callable run before every execution, out of the measured
+        time, whose result is passed to `function`
+    :return (dict): Latencies in milliseconds
+    """
+    latencies = []
+    for _ in range(repetitions):
+        arguments = (setup(),) if setup else ()
+        start = time.perf_counter()
+        function(*arguments)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    result = {
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(0.95 * (len(latencies) - 1))],
+        'mean': statistics.mean(latencies),
+    }
+    print(
+        "{:<55} p50={p50:>9.3f}ms p95={p95:>9.3f}ms mean={mean:>9.3f}ms".format(
+            name, **result
+        )
+    )
+    return result
+
+
+def generate_time_entries(
+    amount: int,
+    tenant_id: str,
+    owner_ids: list,
+    project_ids: list,
+    activity_ids: list,
+    seed: int = 0,
+) -> list:
+    """
+    Generate non overlapping time entries for every owner that end now and
+    go back in time
+    """
+    randomizer = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    cursors = {owner_id: now for owner_id in owner_ids}
+    time_entries = []
+    for i in range(amount):
+        owner_id = owner_ids[i % len(owner_ids)]
+        end_date = cursors[owner_id] - timedelta(
+            minutes=randomizer.randint(5, 120)
+        )
+        start_date = end_date - timedelta(minutes=randomizer.randint(15, 240))
+        cursors[owner_id] = start_date
+        time_entries.append(
+            {
+                'id': 'time-entry-%08d' % i,
+                'tenant_id': tenant_id,
+                'owner_id': owner_id,
+                'project_id': randomizer.choice(project_ids),
+                'activity_id': randomizer.choice(activity_ids),
+                'description': 'Synthetic time entry %s' % i,
+                'technologies': ['python'],
+                'start_date': start_date.isoformat(),
+                'end_date': end_date.isoformat(),
+            }
+        )
+    return time_entries
@@ -0,0 +1,120 @@
+"""
+Columnar summary of `utils.worked_time` against the per-entry computation
+it replaced, which parsed every date several times and copied every entry
+for each of the day, week and month
+
+    python -m benchmarks.worked_time_benchmark --entries 1000 10000 100000
+"""
+import argparse
+import uuid
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.utils import generate_time_entries, measure
+from time_tracker_api.time_entries.time_entries_model import (
+    TimeEntryCosmosDBModel,
+)
+from utils.time import datetime_str, str_to_datetime
+from utils.worked_time import (
+    DEFAULT_TIME_OFFSET,
+    DayDateRange,
+    MonthDateRange,
+    WeekDateRange,
+    seconds_summary,
+    summary,
+)
+
+
+def per_entry_worked_time(time_entries, dr):
+    start, end = dr.start(), dr.end()
+    in_range_time_entries = []
+    for t in time_entries:
+        te_start, te_end = (
+            str_to_datetime(t.start_date),
+            str_to_datetime(t.end_date),
+        )
+        if start <= te_start <= end or start <= te_end <= end:
+            in_range_time_entries.append(deepcopy(t))
+    for t in in_range_time_entries:
+        te_start, te_end = (
+            str_to_datetime(t.start_date),
+            str_to_datetime(t.end_date),
+        )
+        if te_start < start:
+            t.start_date = datetime_str(start)
+        if end < te_end:
+            t.end_date = datetime_str(end)
+    total_time = sum(
+        (t.elapsed_time for t in in_range_time_entries), timedelta()
+    )
+    return seconds_summary(total_time.total_seconds())
+
+
+def per_entry_summary(time_entries, time_offset):
+    tz = timezone(timedelta(minutes=-(time_offset or DEFAULT_TIME_OFFSET)))
+    end = datetime.now(tz)
+    for t in time_entries:
+        if t.end_date is None:
+            t.end_date = datetime_str(end)
+    for t in time_entries:
+        t.start_date = datetime_str(
+            str_to_datetime(t.start_date).astimezone(tz)
+        )
+        t.end_date = datetime_str(str_to_datetime(t.end_date).astimezone(tz))
+    return {
+        'day': per_entry_worked_time(time_entries, DayDateRange(tz)),
+        'week': per_entry_worked_time(time_entries, WeekDateRange(tz)),
+        'month': per_entry_worked_time(time_entries, MonthDateRange(tz)),
+    }
+
+
+def run(amount: int, repetitions: int):
+    time_entries = [
+        TimeEntryCosmosDBModel(time_entry)
+        for time_entry in generate_time_entries(
+            amount,
+            str(uuid.uuid4()),
+            [str(uuid.uuid4())],
+            ['project'],
+            ['activity'],
+        )
+    ]
+    assert summary(time_entries, None) == per_entry_summary(
+        deepcopy(time_entries), None
+    )
+
+    def fresh_time_entries():
+        # The per-entry summary changes the dates of the entries, and the
+        # parsed dates are cached, so every round starts from scratch
+        str_to_datetime.cache_clear()
+        return deepcopy(time_entries)
+
+    print("\n{} time entries".format(amount))
+    measure(
+        'summary (per entry)',
+        lambda entries: per_entry_summary(entries, None),
+        repetitions,
+        setup=fresh_time_entries,
+    )
+    measure(
+        'summary (columnar)',
+        lambda entries: summary(entries, None),
+        repetitions,
+        setup=fresh_time_entries,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--entries', type=int, nargs='+', default=[1000, 10000, 100000]
+    )
+    parser.add_argument('--repetitions', type=int, default=5)
+    args = parser.parse_args()
+
+    for amount in args.entries:
+        run(amount, args.repetitions)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,32 @@
+import base64
+import binascii
 import dataclasses
+import json
 import logging
-from typing import Callable, List
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, Optional, Tuple
 
 import azure.cosmos.cosmos_client as cosmos_client
 import azure.cosmos.exceptions as exceptions
 import flask
+from azure.core import MatchConditions
 from azure.cosmos import ContainerProxy, PartitionKey
 from flask import Flask
+from flask_restplus._http import HTTPStatus
 from werkzeug.exceptions import HTTPException
 
+from commons.data_access_layer import cosmos_db_metrics
+from commons.data_access_layer.cosmos_db_metrics import (
+    CallTags,
+    InstrumentedContainerProxy,
+)
 from commons.data_access_layer.database import CRUDDao, EventContext
+from commons.data_access_layer.in_memory_cosmos_db import (
+    IN_MEMORY_DATABASE_URI,
+    InMemoryCosmosClient,
+)
 
 
 class CosmosDBFacade:
@@ -24,7 +41,14 @@ class CosmosDBFacade:
     @classmethod
     def from_flask_config(cls, app: Flask):
         db_uri = app.config.get('COSMOS_DATABASE_URI')
-        if db_uri is None:
+        if db_uri == IN_MEMORY_DATABASE_URI:
+            app.logger.warn(
+                "Using the in-memory Cosmos DB. Data will be lost on exit."
+            )
+            client = InMemoryCosmosClient(
+                default_partition_key=PartitionKey(path='/tenant_id')
+            )
+        elif db_uri is None:
             app.logger.warn(
                 "COSMOS_DATABASE_URI was not found. Looking for alternative variables."
             )
@@ -69,6 +93,19 @@ class CosmosDBFacade:
 
 cosmos_helper: CosmosDBFacade = None
 
+# Items per request to Cosmos DB when the results are streamed
+STREAM_PAGE_SIZE = 100
+
+# Limits of the bulk operations. Cosmos DB accepts up to 100 operations
+# per transactional batch
+BULK_BATCH_SIZE = 100
+BULK_MAX_CONCURRENCY = 4
+BULK_MAX_RETRIES = 5
+TOO_MANY_REQUESTS = 429
+
+# Times an update is applied again when the item changed after it was read
+PARTIAL_UPDATE_MAX_RETRIES = 3
+
 
 class CosmosDBModel:
     def __init__(self, data):
@@ -83,6 +120,19 @@ class CosmosDBModel:
         return False
 
 
+@dataclasses.dataclass
+class BulkOperationResult:
+    id: str
+    partition_key_value: Any
+    status_code: int
+    item: Any = None
+    error: str = None
+
+    @property
+    def succeeded(self) -> bool:
+        return 200 <= self.status_code < 300
+
+
 def partition_key_attribute(pk: PartitionKey) -> str:
     return pk.path.strip('/')
 
@@ -102,7 +152,7 @@ class CosmosDBRepository:
             raise ValueError("The cosmos_db module has not been initialized!")
         self.mapper = mapper
         self.order_fields = order_fields if order_fields else []
-        self.container: ContainerProxy = (
+        self.container: ContainerProxy = InstrumentedContainerProxy(
             self.cosmos_helper.db.get_container_client(container_id)
         )
         self.partition_key_attribute = partition_key_attribute
@@ -198,7 +248,11 @@ class CosmosDBRepository:
         self.on_create(data, event_context)
         function_mapper = self.get_mapper_or_dict(mapper)
         self.attach_context(data, event_context)
-        return function_mapper(self.container.create_item(body=data))
+        return function_mapper(
+            self.container.create_item(
+                body=data, tags=self.call_tags('create', event_context)
+            )
+        )
 
     def on_create(self, new_item_data: dict, event_context: EventContext):
         if new_item_data.get('id') is None:
@@ -210,6 +264,144 @@ class CosmosDBRepository:
 
         self.replace_empty_value_per_none(new_item_data)
 
+    def bulk_create(
+        self,
+        items: List[dict],
+        event_context: EventContext,
+        max_concurrency: int = BULK_MAX_CONCURRENCY,
+        mapper: Callable = None,
+    ) -> List[BulkOperationResult]:
+        """
+        Creates the items with transactional batches, one per partition key
+        and up to 100 items each, instead of a request per item. The results
+        keep the order of the items. When an item fails, the rest of its
+        batch is sent again without it, so only the failed items are left
+        out.
+        """
+        return self.bulk_write(
+            'create', items, event_context, max_concurrency, mapper
+        )
+
+    def bulk_upsert(
+        self,
+        items: List[dict],
+        event_context: EventContext,
+        max_concurrency: int = BULK_MAX_CONCURRENCY,
+        mapper: Callable = None,
+    ) -> List[BulkOperationResult]:
+        """
+        Like `bulk_create`, but the existing items are replaced
+        """
+        return self.bulk_write(
+            'upsert', items, event_context, max_concurrency, mapper
+        )
+
+    def bulk_write(
+        self,
+        operation_type: str,
+        items: List[dict],
+        event_context: EventContext,
+        max_concurrency: int,
+        mapper: Callable = None,
+    ) -> List[BulkOperationResult]:
+        partitions = OrderedDict()
+        for index, item in enumerate(items):
+            self.on_bulk_write(item, event_context)
+            self.attach_context(item, event_context)
+            partition_key_value = item[self.partition_key_attribute]
+            partitions.setdefault(partition_key_value, []).append(index)
+
+        batches = [
+            (partition_key_value, indexes[i : i + BULK_BATCH_SIZE])
+            for partition_key_value, indexes in partitions.items()
+            for i in range(0, len(indexes), BULK_BATCH_SIZE)
+        ]
+        results = [None] * len(items)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            for batch_results in executor.map(
+                cosmos_db_metrics.in_current_request(
+                    lambda batch: self.execute_batch(
+                        operation_type,
+                        items,
+                        *batch,
+                        tags=self.call_tags('bulk_write', event_context),
+                    )
+                ),
+                batches,
+            ):
+                for index, result in batch_results.items():
+                    results[index] = result
+
+        function_mapper = self.get_mapper_or_dict(mapper)
+        for result in results:
+            if result.item is not None:
+                result.item = function_mapper(result.item)
+        return results
+
+    def execute_batch(
+        self,
+        operation_type: str,
+        items: List[dict],
+        partition_key_value,
+        indexes: List[int],
+        tags: CallTags = None,
+    ) -> dict:
+        results = {}
+        pending = list(indexes)
+        retries = 0
+        while pending:
+            operations = [(operation_type, (items[i],)) for i in pending]
+            try:
+                responses = self.container.execute_item_batch(
+                    operations, partition_key=partition_key_value, tags=tags
+                )
+            except exceptions.CosmosBatchOperationError as e:
+                failed_index = pending.pop(e.error_index)
+                results[failed_index] = BulkOperationResult(
+                    items[failed_index]['id'],
+                    partition_key_value,
+                    int(e.operation_responses[e.error_index]['statusCode']),
+                    error=str(e.http_error_message),
+                )
+                continue
+            except exceptions.CosmosHttpResponseError as e:
+                if (
+                    e.status_code == TOO_MANY_REQUESTS
+                    and retries < BULK_MAX_RETRIES
+                ):
+                    retries += 1
+                    time.sleep(retry_after_seconds(e, retries))
+                    continue
+                for index in pending:
+                    results[index] = BulkOperationResult(
+                        items[index]['id'],
+                        partition_key_value,
+                        e.status_code,
+                        error=e.message,
+                    )
+                break
+
+            for index, response in zip(pending, responses):
+                results[index] = BulkOperationResult(
+                    items[index]['id'],
+                    partition_key_value,
+                    int(response['statusCode']),
+                    item=response.get('resourceBody'),
+                )
+            break
+        return results
+
+    def on_bulk_write(self, item_data: dict, event_context: EventContext):
+        if item_data.get('id') is None:
+            item_data['id'] = generate_uuid4()
+
+        if item_data.get(self.partition_key_attribute) is None:
+            item_data[
+                self.partition_key_attribute
+            ] = self.find_partition_key_value(event_context)
+
+        self.replace_empty_value_per_none(item_data)
+
     def find(
         self,
         id: str,
@@ -218,10 +410,63 @@ class CosmosDBRepository:
         mapper: Callable = None,
     ):
         partition_key_value = self.find_partition_key_value(event_context)
-        found_item = self.container.read_item(id, partition_key_value)
+        found_item = self.container.read_item(
+            id, partition_key_value, tags=self.call_tags('find', event_context)
+        )
         function_mapper = self.get_mapper_or_dict(mapper)
         return function_mapper(self.check_visibility(found_item, visible_only))
 
+    def create_sql_find_query(
+        self,
+        conditions: dict,
+        custom_sql_conditions: List[str],
+        visible_only: bool,
+        page_clause: str = '',
+    ) -> str:
+        return """
+            SELECT * FROM c
+            WHERE c.{partition_key_attribute}=@partition_key_value
+            {conditions_clause}
+            {visibility_condition}
+            {custom_sql_conditions_clause}
+            {order_clause}
+            {page_clause}
+            """.format(
+            partition_key_attribute=self.partition_key_attribute,
+            visibility_condition=self.create_sql_condition_for_visibility(
+                visible_only
+            ),
+            conditions_clause=self.create_sql_where_conditions(conditions),
+            custom_sql_conditions_clause=self.create_custom_sql_conditions(
+                custom_sql_conditions
+            ),
+            order_clause=self.create_sql_order_clause(),
+            page_clause=page_clause,
+        )
+
+    def create_sql_count_query(
+        self,
+        conditions: dict,
+        custom_sql_conditions: List[str],
+        visible_only: bool,
+    ) -> str:
+        return """
+            SELECT VALUE COUNT(1) FROM c
+            WHERE c.{partition_key_attribute}=@partition_key_value
+            {conditions_clause}
+            {visibility_condition}
+            {custom_sql_conditions_clause}
+            """.format(
+            partition_key_attribute=self.partition_key_attribute,
+            visibility_condition=self.create_sql_condition_for_visibility(
+                visible_only
+            ),
+            conditions_clause=self.create_sql_where_conditions(conditions),
+            custom_sql_conditions_clause=self.create_custom_sql_conditions(
+                custom_sql_conditions
+            ),
+        )
+
     def find_all(
         self,
         event_context: EventContext,
@@ -248,35 +493,118 @@ class CosmosDBRepository:
         ]
         params.extend(self.generate_params(conditions))
         params.extend(custom_params)
-        query_str = """
-            SELECT * FROM c
-            WHERE c.{partition_key_attribute}=@partition_key_value
-            {conditions_clause}
-            {visibility_condition}
-            {custom_sql_conditions_clause}
-            {order_clause}
-            OFFSET @offset LIMIT @max_count
-            """.format(
-            partition_key_attribute=self.partition_key_attribute,
-            visibility_condition=self.create_sql_condition_for_visibility(
-                visible_only
-            ),
-            conditions_clause=self.create_sql_where_conditions(conditions),
-            custom_sql_conditions_clause=self.create_custom_sql_conditions(
-                custom_sql_conditions
-            ),
-            order_clause=self.create_sql_order_clause(),
+        query_str = self.create_sql_find_query(
+            conditions,
+            custom_sql_conditions,
+            visible_only,
+            page_clause='OFFSET @offset LIMIT @max_count',
         )
         result = self.container.query_items(
             query=query_str,
             parameters=params,
             partition_key=partition_key_value,
             max_item_count=max_count,
+            tags=self.call_tags('find_all', event_context),
         )
 
         function_mapper = self.get_mapper_or_dict(mapper)
         return list(map(function_mapper, result))
 
+    def find_page(
+        self,
+        event_context: EventContext,
+        conditions: dict = None,
+        custom_sql_conditions: List[str] = None,
+        custom_params: dict = None,
+        page_size=None,
+        continuation_token: str = None,
+        visible_only=True,
+        mapper: Callable = None,
+    ) -> Tuple[list, Optional[str]]:
+        """
+        Finds one page of items and the continuation token of the next one,
+        which is None on the last page. Unlike `offset`, the token makes
+        Cosmos DB resume the query where the previous page ended, so the
+        cost of a page doesn't depend on how deep it is.
+        """
+        conditions = conditions if conditions else {}
+        custom_sql_conditions = (
+            custom_sql_conditions if custom_sql_conditions else []
+        )
+        custom_params = custom_params if custom_params else {}
+
+        partition_key_value = self.find_partition_key_value(event_context)
+        params = [
+            {"name": "@partition_key_value", "value": partition_key_value},
+        ]
+        params.extend(self.generate_params(conditions))
+        params.extend(custom_params)
+        query_str = self.create_sql_find_query(
+            conditions, custom_sql_conditions, visible_only
+        )
+        pages = self.container.query_items(
+            query=query_str,
+            parameters=params,
+            partition_key=partition_key_value,
+            max_item_count=self.get_page_size_or(page_size),
+            tags=self.call_tags('find_page', event_context),
+        ).by_page(decode_continuation_token(continuation_token))
+        page = list(next(pages, []))
+
+        function_mapper = self.get_mapper_or_dict(mapper)
+        return (
+            list(map(function_mapper, page)),
+            encode_continuation_token(pages.continuation_token),
+        )
+
+    def iter_pages(
+        self,
+        event_context: EventContext,
+        conditions: dict = None,
+        custom_sql_conditions: List[str] = None,
+        custom_params: dict = None,
+        page_size=None,
+        visible_only=True,
+        mapper: Callable = None,
+    ) -> Iterator[list]:
+        """
+        Yields the mapped items page by page, so only one page is held in
+        memory at a time. Nothing is queried until the first page is asked.
+        """
+        conditions = conditions if conditions else {}
+        custom_sql_conditions = (
+            custom_sql_conditions if custom_sql_conditions else []
+        )
+        custom_params = custom_params if custom_params else {}
+
+        partition_key_value = self.find_partition_key_value(event_context)
+        params = [
+            {"name": "@partition_key_value", "value": partition_key_value},
+        ]
+        params.extend(self.generate_params(conditions))
+        params.extend(custom_params)
+        query_str = self.create_sql_find_query(
+            conditions, custom_sql_conditions, visible_only
+        )
+        pages = self.container.query_items(
+            query=query_str,
+            parameters=params,
+            partition_key=partition_key_value,
+            max_item_count=page_size or STREAM_PAGE_SIZE,
+            tags=self.call_tags('iter_pages', event_context),
+        ).by_page()
+
+        function_mapper = self.get_mapper_or_dict(mapper)
+        for page in pages:
+            yield list(map(function_mapper, page))
+
+    def iter_all(self, event_context: EventContext, **kwargs) -> Iterator:
+        """
+        Lazy version of `find_all`. It accepts the arguments of `iter_pages`
+        """
+        for page in self.iter_pages(event_context, **kwargs):
+            yield from page
+
     def count(
         self,
         event_context: EventContext,
@@ -296,21 +624,8 @@ class CosmosDBRepository:
         ]
         params.extend(self.generate_params(conditions))
         params.extend(custom_params)
-        query_str = """
-            SELECT VALUE COUNT(1) FROM c
-            WHERE c.{partition_key_attribute}=@partition_key_value
-            {conditions_clause}
-            {visibility_condition}
-            {custom_sql_conditions_clause}
-            """.format(
-            partition_key_attribute=self.partition_key_attribute,
-            visibility_condition=self.create_sql_condition_for_visibility(
-                visible_only
-            ),
-            conditions_clause=self.create_sql_where_conditions(conditions),
-            custom_sql_conditions_clause=self.create_custom_sql_conditions(
-                custom_sql_conditions
-            ),
+        query_str = self.create_sql_count_query(
+            conditions, custom_sql_conditions, visible_only
         )
 
         flask.current_app.logger.debug(query_str)
@@ -318,6 +633,7 @@ class CosmosDBRepository:
             query=query_str,
             parameters=params,
             partition_key=partition_key_value,
+            tags=self.call_tags('count', event_context),
         )
         return result.next()
 
@@ -328,15 +644,39 @@ class CosmosDBRepository:
         event_context: EventContext,
         visible_only=True,
         mapper: Callable = None,
+        current_item: dict = None,
     ):
-        item_data = self.find(
-            id,
-            event_context,
-            visible_only=visible_only,
-            mapper=dict,
-        )
-        item_data.update(changes)
-        return self.update(id, item_data, event_context, mapper=mapper)
+        """
+        Applies the changes with optimistic concurrency: the item is only
+        replaced if its `_etag` is still the one it had when it was read.
+        Otherwise (412) it is read again and the changes are applied on top
+        of the latest version. Pass the item as `current_item` if it was
+        already read, to save that request.
+        """
+        retries = 0
+        while True:
+            if current_item is None:
+                current_item = self.find(
+                    id,
+                    event_context,
+                    visible_only=visible_only,
+                    mapper=dict,
+                )
+            item_data = dict(current_item)
+            item_data.update(changes)
+            try:
+                return self.update(
+                    id,
+                    item_data,
+                    event_context,
+                    mapper=mapper,
+                    etag=current_item.get('_etag'),
+                )
+            except exceptions.CosmosAccessConditionFailedError:
+                if retries >= PARTIAL_UPDATE_MAX_RETRIES:
+                    raise
+                retries += 1
+                current_item = None
 
     def update(
         self,
@@ -344,26 +684,96 @@ class CosmosDBRepository:
         item_data: dict,
         event_context: EventContext,
         mapper: Callable = None,
+        etag: str = None,
     ):
         self.on_update(item_data, event_context)
         function_mapper = self.get_mapper_or_dict(mapper)
         self.attach_context(item_data, event_context)
-        return function_mapper(self.container.replace_item(id, body=item_data))
+        return function_mapper(
+            self.container.replace_item(
+                id,
+                body=item_data,
+                etag=etag,
+                match_condition=MatchConditions.IfNotModified
+                if etag
+                else None,
+                tags=self.call_tags('update', event_context),
+            )
+        )
 
-    def delete(
+    def patch(
         self,
         id: str,
         event_context: EventContext,
+        set_values: dict = None,
+        remove_fields: List[str] = None,
+        filter_predicate: str = None,
+        etag: str = None,
+        visible_only=True,
         mapper: Callable = None,
     ):
-        return self.partial_update(
-            id,
-            {'deleted': generate_uuid4()},
-            event_context,
-            visible_only=True,
-            mapper=mapper,
+        """
+        Updates only the given fields with a partial document update, so the
+        item doesn't need to be read and sent back whole. `filter_predicate`
+        is a condition on the stored item, e.g. `c.end_date = null`: when it
+        doesn't hold, or the item is deleted and `visible_only`, nothing is
+        changed and a `CosmosAccessConditionFailedError` (412) is raised.
+        """
+        set_values = dict(set_values or {})
+        self.replace_empty_value_per_none(set_values)
+        self.attach_context(set_values, event_context)
+        patch_operations = [
+            {'op': 'set', 'path': '/%s' % field, 'value': value}
+            for field, value in set_values.items()
+        ]
+        patch_operations.extend(
+            {'op': 'remove', 'path': '/%s' % field}
+            for field in remove_fields or []
+        )
+        filter_predicate = 'FROM c WHERE {predicate} {visibility}'.format(
+            predicate='(%s)' % filter_predicate
+            if filter_predicate
+            else 'true',
+            visibility=self.create_sql_condition_for_visibility(visible_only),
+        )
+        partition_key_value = self.find_partition_key_value(event_context)
+        function_mapper = self.get_mapper_or_dict(mapper)
+        return function_mapper(
+            self.container.patch_item(
+                id,
+                partition_key_value,
+                patch_operations,
+                filter_predicate=filter_predicate,
+                etag=etag,
+                match_condition=MatchConditions.IfNotModified
+                if etag
+                else None,
+                tags=self.call_tags('patch', event_context),
+            )
         )
 
+    def delete(
+        self,
+        id: str,
+        event_context: EventContext,
+        mapper: Callable = None,
+        filter_predicate: str = None,
+    ):
+        try:
+            return self.patch(
+                id,
+                event_context,
+                set_values={'deleted': generate_uuid4()},
+                filter_predicate=filter_predicate,
+                mapper=mapper,
+            )
+        except exceptions.CosmosAccessConditionFailedError:
+            if filter_predicate is not None:
+                raise
+            raise exceptions.CosmosResourceNotFoundError(
+                message='Deleted item', status_code=404
+            )
+
     def delete_permanently(self, id: str, event_context: EventContext) -> None:
         partition_key_value = self.find_partition_key_value(event_context)
         self.container.delete_item(id, partition_key_value)
@@ -371,6 +781,17 @@ class CosmosDBRepository:
     def find_partition_key_value(self, event_context: EventContext):
         return getattr(event_context, self.partition_key_attribute)
 
+    def call_tags(
+        self, method: str, event_context: EventContext = None
+    ) -> CallTags:
+        """
+        Tags of the calls to Cosmos DB made by the method, for the metrics
+        """
+        return CallTags(
+            '%s.%s' % (type(self).__name__, method),
+            event_context.action if event_context else None,
+        )
+
     def get_mapper_or_dict(self, alternative_mapper: Callable) -> Callable:
         return alternative_mapper or self.mapper or dict
 
@@ -399,6 +820,13 @@ class CosmosDBDao(CRUDDao):
             event_ctx, conditions=conditions, **kwargs
         )
 
+    def iter_all(self, conditions: dict = None, **kwargs) -> Iterator:
+        conditions = conditions if conditions else {}
+        event_ctx = self.create_event_context("read-many")
+        return self.repository.iter_all(
+            event_ctx, conditions=conditions, **kwargs
+        )
+
     def get(self, id):
         event_ctx = self.create_event_context("read")
         return self.repository.find(id, event_ctx)
@@ -429,9 +857,53 @@ class CustomError(HTTPException):
         self.description = description
 
 
+def encode_continuation_token(continuation_token: str) -> Optional[str]:
+    """
+    Makes the continuation token of Cosmos DB, a JSON document, safe to be
+    sent back as a query argument. Clients must not rely on its content.
+    """
+    if continuation_token is None:
+        return None
+    return base64.urlsafe_b64encode(continuation_token.encode()).decode()
+
+
+def decode_continuation_token(continuation_token: str) -> Optional[str]:
+    if not continuation_token:
+        return None
+    try:
+        return base64.urlsafe_b64decode(continuation_token.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise CustomError(
+            HTTPStatus.BAD_REQUEST, "The continuation token is not valid"
+        )
+
+
+def sql_literal(value) -> str:
+    """
+    The value as a Cosmos DB SQL literal, for the queries that can't take
+    parameters, like the filter predicate of `patch`
+    """
+    return json.dumps(value)
+
+
+def retry_after_seconds(
+    error: exceptions.CosmosHttpResponseError, retries: int
+) -> float:
+    """
+    The time Cosmos DB asks to wait after a 429, or an exponential backoff
+    when it doesn't say
+    """
+    headers = getattr(error, 'headers', None) or {}
+    retry_after_ms = headers.get('x-ms-retry-after-ms')
+    if retry_after_ms is not None:
+        return float(retry_after_ms) / 1000
+    return 0.1 * 2**retries
+
+
 def init_app(app: Flask) -> None:
     global cosmos_helper
     cosmos_helper = CosmosDBFacade.from_flask_config(app)
+    cosmos_db_metrics.init_app(app)
 
 
 def generate_uuid4() -> str:
@@ -0,0 +1,451 @@
+"""
+Asynchronous counterpart of `cosmos_db`, on top of `azure.cosmos.aio`
+
+An `AsyncCosmosDBRepository` wraps a `CosmosDBRepository` and keeps its
+queries, hooks and mapper, so only the calls to Cosmos DB change: they
+return awaitables, and the independent calls of an endpoint can be awaited
+concurrently, e.g. with `asyncio.gather`. Synchronous code, like the Flask
+views, runs them with `run_async` in an event loop shared by the whole
+process, which keeps the connections to Cosmos DB open between requests.
+"""
+import asyncio
+import copy
+import threading
+from typing import Awaitable, Callable, List
+
+import azure.cosmos.aio as cosmos_client
+import azure.cosmos.exceptions as exceptions
+from azure.core import MatchConditions
+from flask import Flask
+
+from commons.data_access_layer import cosmos_db, cosmos_db_metrics
+from commons.data_access_layer.cosmos_db import (
+    PARTIAL_UPDATE_MAX_RETRIES,
+    CosmosDBRepository,
+    generate_uuid4,
+)
+from commons.data_access_layer.cosmos_db_cache import (
+    CachedCosmosDBRepository,
+    InvalidateOnWriteMixin,
+)
+from commons.data_access_layer.cosmos_db_metrics import (
+    CallTags,
+    InstrumentedAsyncContainerProxy,
+)
+from commons.data_access_layer.database import EventContext
+from commons.data_access_layer.in_memory_cosmos_db import (
+    AsyncInMemoryCosmosClient,
+    InMemoryCosmosClient,
+)
+
+
+class AsyncCosmosDBFacade:
+    def __init__(self, client, db_id: str):
+        self.client = client
+        self.db = self.client.get_database_client(db_id)
+
+    @classmethod
+    def from_flask_config(cls, app: Flask):
+        """
+        Connects to the database of `cosmos_db.cosmos_helper`, so that
+        module has to be initialized first
+        """
+        sync_cosmos_helper = cosmos_db.cosmos_helper
+        if isinstance(sync_cosmos_helper.client, InMemoryCosmosClient):
+            client = AsyncInMemoryCosmosClient(sync_cosmos_helper.client)
+        elif app.config.get('COSMOS_DATABASE_URI') is None:
+            client = cosmos_client.CosmosClient(
+                app.config.get('DATABASE_ACCOUNT_URI'),
+                {'masterKey': app.config.get('DATABASE_MASTER_KEY')},
+                user_agent="TimeTrackerAPI",
+                user_agent_overwrite=True,
+            )
+        else:
+            client = cosmos_client.CosmosClient.from_connection_string(
+                app.config.get('COSMOS_DATABASE_URI')
+            )
+
+        return cls(client, sync_cosmos_helper.db.id)
+
+
+async_cosmos_helper: AsyncCosmosDBFacade = None
+
+
+class EventLoopThread:
+    """
+    An event loop that runs forever in a daemon thread, started on first use
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(
+                    target=loop.run_forever,
+                    name='cosmos-db-event-loop',
+                    daemon=True,
+                )
+                self.thread.start()
+                self.loop = loop
+        return self.loop
+
+    def run(self, coroutine: Awaitable, timeout: float = None):
+        if threading.current_thread() is self.thread:
+            raise RuntimeError(
+                "run_async can't be called from the event loop, use await"
+            )
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.start())
+        return future.result(timeout)
+
+
+event_loop_thread = EventLoopThread()
+
+
+def run_async(coroutine: Awaitable, timeout: float = None):
+    """
+    Runs the coroutine in the shared event loop and waits for its result.
+    Its calls to Cosmos DB count in the metrics of the current request, but
+    it doesn't see the request, so its event contexts have to be resolved.
+    """
+    return event_loop_thread.run(
+        cosmos_db_metrics.awaited_in_current_request(coroutine), timeout
+    )
+
+
+class AsyncCosmosDBRepository:
+    """
+    Awaitable `find`, `find_all`, `count`, `create`, `partial_update`,
+    `update` and `delete` of the container of `repository`, with its SQL,
+    its `on_create` and `on_update` hooks and its mapper. When the
+    repository invalidates a cache on its writes, these writes invalidate
+    it too.
+    """
+
+    def __init__(
+        self,
+        repository: CosmosDBRepository,
+        custom_cosmos_helper: AsyncCosmosDBFacade = None,
+    ):
+        global async_cosmos_helper
+        self.cosmos_helper = custom_cosmos_helper or async_cosmos_helper
+        if self.cosmos_helper is None:  # pragma: no cover
+            raise ValueError(
+                "The cosmos_db_aio module has not been initialized!"
+            )
+        self.repository = repository
+        self.container = InstrumentedAsyncContainerProxy(
+            self.cosmos_helper.db.get_container_client(repository.container.id)
+        )
+
+    def call_tags(
+        self, method: str, event_context: EventContext = None
+    ) -> CallTags:
+        return CallTags(
+            '%s.%s' % (type(self).__name__, method),
+            event_context.action if event_context else None,
+        )
+
+    def invalidate_cache(self, event_context: EventContext) -> None:
+        if isinstance(self.repository, InvalidateOnWriteMixin):
+            self.repository.invalidate_cache(event_context)
+
+    async def create(
+        self, data: dict, event_context: EventContext, mapper: Callable = None
+    ):
+        await self.on_create(data, event_context)
+        function_mapper = self.repository.get_mapper_or_dict(mapper)
+        self.repository.attach_context(data, event_context)
+        try:
+            return function_mapper(
+                await self.container.create_item(
+                    body=data, tags=self.call_tags('create', event_context)
+                )
+            )
+        finally:
+            self.invalidate_cache(event_context)
+
+    async def on_create(
+        self, new_item_data: dict, event_context: EventContext
+    ):
+        self.repository.on_create(new_item_data, event_context)
+
+    async def find(
+        self,
+        id: str,
+        event_context: EventContext,
+        visible_only=True,
+        mapper: Callable = None,
+    ):
+        partition_key_value = self.repository.find_partition_key_value(
+            event_context
+        )
+        found_item = await self.container.read_item(
+            id, partition_key_value, tags=self.call_tags('find', event_context)
+        )
+        function_mapper = self.repository.get_mapper_or_dict(mapper)
+        return function_mapper(
+            self.repository.check_visibility(found_item, visible_only)
+        )
+
+    async def find_all(
+        self,
+        event_context: EventContext,
+        conditions: dict = None,
+        custom_sql_conditions: List[str] = None,
+        custom_params: dict = None,
+        max_count=None,
+        offset=0,
+        visible_only=True,
+        mapper: Callable = None,
+    ):
+        conditions = conditions if conditions else {}
+        custom_sql_conditions = (
+            custom_sql_conditions if custom_sql_conditions else []
+        )
+        custom_params = custom_params if custom_params else {}
+
+        partition_key_value = self.repository.find_partition_key_value(
+            event_context
+        )
+        max_count = self.repository.get_page_size_or(max_count)
+        params = [
+            {"name": "@partition_key_value", "value": partition_key_value},
+            {"name": "@offset", "value": offset},
+            {"name": "@max_count", "value": max_count},
+        ]
+        params.extend(self.repository.generate_params(conditions))
+        params.extend(custom_params)
+        query_str = self.repository.create_sql_find_query(
+            conditions,
+            custom_sql_conditions,
+            visible_only,
+            page_clause='OFFSET @offset LIMIT @max_count',
+        )
+        result = self.container.query_items(
+            query=query_str,
+            parameters=params,
+            partition_key=partition_key_value,
+            max_item_count=max_count,
+            tags=self.call_tags('find_all', event_context),
+        )
+
+        function_mapper = self.repository.get_mapper_or_dict(mapper)
+        return [function_mapper(item) async for item in result]
+
+    async def count(
+        self,
+        event_context: EventContext,
+        conditions: dict = None,
+        custom_sql_conditions: List[str] = None,
+        custom_params: dict = None,
+        visible_only=True,
+    ):
+        conditions = conditions if conditions else {}
+        custom_sql_conditions = (
+            custom_sql_conditions if custom_sql_conditions else []
+        )
+        custom_params = custom_params if custom_params else {}
+        partition_key_value = self.repository.find_partition_key_value(
+            event_context
+        )
+        params = [
+            {"name": "@partition_key_value", "value": partition_key_value},
+        ]
+        params.extend(self.repository.generate_params(conditions))
+        params.extend(custom_params)
+        result = self.container.query_items(
+            query=self.repository.create_sql_count_query(
+                conditions, custom_sql_conditions, visible_only
+            ),
+            parameters=params,
+            partition_key=partition_key_value,
+            tags=self.call_tags('count', event_context),
+        )
+        async for counter in result:
+            return counter
+
+    async def partial_update(
+        self,
+        id: str,
+        changes: dict,
+        event_context: EventContext,
+        visible_only=True,
+        mapper: Callable = None,
+        current_item: dict = None,
+    ):
+        """
+        Like `CosmosDBRepository.partial_update`, the changes are applied
+        again on the latest version of the item when it changed after it
+        was read
+        """
+        retries = 0
+        while True:
+            if current_item is None:
+                current_item = await self.find(
+                    id,
+                    event_context,
+                    visible_only=visible_only,
+                    mapper=dict,
+                )
+            item_data = dict(current_item)
+            item_data.update(changes)
+            try:
+                return await self.update(
+                    id,
+                    item_data,
+                    event_context,
+                    mapper=mapper,
+                    etag=current_item.get('_etag'),
+                )
+            except exceptions.CosmosAccessConditionFailedError:
+                if retries >= PARTIAL_UPDATE_MAX_RETRIES:
+                    raise
+                retries += 1
+                current_item = None
+
+    async def update(
+        self,
+        id: str,
+        item_data: dict,
+        event_context: EventContext,
+        mapper: Callable = None,
+        etag: str = None,
+    ):
+        await self.on_update(item_data, event_context)
+        function_mapper = self.repository.get_mapper_or_dict(mapper)
+        self.repository.attach_context(item_data, event_context)
+        try:
+            return function_mapper(
+                await self.container.replace_item(
+                    id,
+                    body=item_data,
+                    etag=etag,
+                    match_condition=MatchConditions.IfNotModified
+                    if etag
+                    else None,
+                    tags=self.call_tags('update', event_context),
+                )
+            )
+        finally:
+            self.invalidate_cache(event_context)
+
+    async def on_update(
+        self, update_item_data: dict, event_context: EventContext
+    ):
+        self.repository.on_update(update_item_data, event_context)
+
+    async def delete(
+        self, id: str, event_context: EventContext, mapper: Callable = None
+    ):
+        return await self.partial_update(
+            id,
+            {'deleted': generate_uuid4()},
+            event_context,
+            visible_only=True,
+            mapper=mapper,
+        )
+
+
+class AsyncCachedCosmosDBRepository(AsyncCosmosDBRepository):
+    """
+    `AsyncCosmosDBRepository` of a `CachedCosmosDBRepository`, whose
+    `find_all` goes through the same cache
+    """
+
+    repository: CachedCosmosDBRepository
+
+    async def find_all(
+        self,
+        event_context: EventContext,
+        conditions: dict = None,
+        custom_sql_conditions: List[str] = None,
+        custom_params: dict = None,
+        max_count=None,
+        offset=0,
+        visible_only=True,
+        mapper: Callable = None,
+    ):
+        key = self.repository.find_all_key(
+            conditions,
+            custom_sql_conditions,
+            custom_params,
+            max_count,
+            offset,
+            visible_only,
+        )
+        items = await self.repository.cache.get_or_load_async(
+            self.repository.find_partition_key_value(event_context),
+            key,
+            lambda: AsyncCosmosDBRepository.find_all(
+                self,
+                event_context,
+                conditions=conditions,
+                custom_sql_conditions=custom_sql_conditions,
+                custom_params=custom_params,
+                max_count=max_count,
+                offset=offset,
+                visible_only=visible_only,
+                mapper=dict,
+            ),
+        )
+        function_mapper = self.repository.get_mapper_or_dict(mapper)
+        return [function_mapper(item) for item in copy.deepcopy(items)]
+
+
+class AsyncCosmosDBDao:
+    """
+    Counterpart of `CosmosDBDao` whose methods return awaitables. The event
+    context is created and resolved when the method is called, not when it
+    is awaited, so the DAO can be called in a request and awaited in the
+    event loop, which doesn't see the request.
+    """
+
+    def __init__(self, repository: AsyncCosmosDBRepository):
+        self.repository = repository
+
+    def get_all(self, conditions: dict = None, **kwargs) -> Awaitable:
+        conditions = conditions if conditions else {}
+        event_ctx = self.create_event_context("read-many").resolve()
+        return self.repository.find_all(
+            event_ctx, conditions=conditions, **kwargs
+        )
+
+    def count(self, conditions: dict = None, **kwargs) -> Awaitable:
+        conditions = conditions if conditions else {}
+        event_ctx = self.create_event_context("read-many").resolve()
+        return self.repository.count(
+            event_ctx, conditions=conditions, **kwargs
+        )
+
+    def get(self, id) -> Awaitable:
+        event_ctx = self.create_event_context("read").resolve()
+        return self.repository.find(id, event_ctx)
+
+    def create(self, data: dict) -> Awaitable:
+        event_ctx = self.create_event_context("create").resolve()
+        return self.repository.create(data, event_ctx)
+
+    def update(self, id, data: dict) -> Awaitable:
+        event_ctx = self.create_event_context("update").resolve()
+        return self.repository.partial_update(id, data, event_ctx)
+
+    def delete(self, id) -> Awaitable:
+        event_ctx = self.create_event_context("delete").resolve()
+        return self.repository.delete(id, event_ctx)
+
+    def create_event_context(
+        self, action: str = None, description: str = None
+    ):
+        return EventContext(
+            self.repository.container.id, action, description=description
+        )
+
+
+def init_app(app: Flask) -> None:
+    global async_cosmos_helper
+    async_cosmos_helper = AsyncCosmosDBFacade.from_flask_config(app)
@@ -0,0 +1,288 @@
+"""
+Read-through cache of the queries of small containers that rarely change,
+like the projects, activities and customers
+
+`CachedCosmosDBRepository.find_all` keeps its results per partition (the
+tenant) for `CACHE_TTL` seconds, in a cache shared by every repository of
+the same container. Any write through those repositories invalidates the
+partition it touched. The documents are cached, not the models, and every
+call maps a copy of them, so the callers can't change the cached ones.
+The cache is local to the process, so the changes made by other processes
+are seen once the entries expire. `cache_stats` is served by
+`GET /metrics/cache`.
+"""
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+from commons.data_access_layer.cosmos_db import CosmosDBRepository
+from commons.data_access_layer.database import EventContext
+
+CACHE_TTL = 60
+CACHE_MAX_SIZE = 512
+
+
+class ReadThroughCache:
+    """
+    LRU cache whose entries expire `ttl` seconds after they were loaded.
+    The entries are grouped by partition, so they can be invalidated
+    together. A value loaded while its partition was being invalidated is
+    returned but not stored, so it can't outlive the invalidation.
+    """
+
+    def __init__(
+        self,
+        ttl: float = CACHE_TTL,
+        max_size: int = CACHE_MAX_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries: OrderedDict = OrderedDict()
+        self.generations: Dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, partition: Hashable, key: str, loader: Callable):
+        found, value, generation = self.lookup(partition, key)
+        if found:
+            return value
+        value = loader()
+        self.store(partition, key, value, generation)
+        return value
+
+    async def get_or_load_async(
+        self, partition: Hashable, key: str, loader: Callable[[], Awaitable]
+    ):
+        """
+        Like `get_or_load`, for a loader that returns an awaitable
+        """
+        found, value, generation = self.lookup(partition, key)
+        if found:
+            return value
+        value = await loader()
+        self.store(partition, key, value, generation)
+        return value
+
+    def lookup(self, partition: Hashable, key: str) -> Tuple[bool, Any, int]:
+        """
+        Whether the entry is cached, its value and, when it is not, the
+        generation of the partition it has to be stored in
+        """
+        entry_key = (partition, key)
+        with self.lock:
+            entry = self.entries.get(entry_key)
+            if entry is not None and entry[0] > self.clock():
+                self.entries.move_to_end(entry_key)
+                self.hits += 1
+                return True, entry[1], None
+            self.misses += 1
+            return False, None, self.generations.get(partition, 0)
+
+    def store(
+        self, partition: Hashable, key: str, value, generation: int
+    ) -> None:
+        entry_key = (partition, key)
+        with self.lock:
+            if self.generations.get(partition, 0) == generation:
+                self.entries[entry_key] = (self.clock() + self.ttl, value)
+                self.entries.move_to_end(entry_key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+
+    def invalidate(self, partition: Hashable) -> None:
+        with self.lock:
+            self.generations[partition] = (
+                self.generations.get(partition, 0) + 1
+            )
+            for entry_key in [k for k in self.entries if k[0] == partition]:
+                del self.entries[entry_key]
+
+    def clear(self) -> None:
+        with self.lock:
+            for partition in {k[0] for k in self.entries}:
+                self.generations[partition] = (
+                    self.generations.get(partition, 0) + 1
+                )
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / requests if requests else 0.0,
+                'size': len(self.entries),
+            }
+
+
+caches: Dict[str, ReadThroughCache] = {}
+caches_lock = threading.Lock()
+cache_ttl = CACHE_TTL
+
+
+def get_cache(container_id: str) -> ReadThroughCache:
+    with caches_lock:
+        if container_id not in caches:
+            caches[container_id] = ReadThroughCache(ttl=cache_ttl)
+        return caches[container_id]
+
+
+def set_cache_ttl(ttl: float) -> None:
+    """
+    Changes the TTL of the caches of every container, e.g. to keep the
+    entries longer when something else invalidates them on time
+    """
+    global cache_ttl
+    with caches_lock:
+        cache_ttl = ttl
+        for cache in caches.values():
+            cache.ttl = ttl
+
+
+def cache_stats() -> Dict[str, dict]:
+    """
+    Hits and misses of the cache of every container
+    """
+    return {
+        container_id: cache.stats() for container_id, cache in caches.items()
+    }
+
+
+class InvalidateOnWriteMixin:
+    """
+    Mixin of a `CosmosDBRepository` that invalidates the partitions it writes
+    in `invalidated_cache`, also when the write fails, because it could have
+    been applied anyway. The partition of a write comes from
+    `find_partition_key_value`, and the one of a bulk write from the
+    `partition_key_attribute` of its items.
+    """
+
+    @property
+    def invalidated_cache(self) -> ReadThroughCache:
+        raise NotImplementedError  # pragma: no cover
+
+    def invalidate_cache(self, event_context: EventContext) -> None:
+        self.invalidated_cache.invalidate(
+            self.find_partition_key_value(event_context)
+        )
+
+    def create(
+        self, data: dict, event_context: EventContext, mapper: Callable = None
+    ):
+        try:
+            return super().create(data, event_context, mapper)
+        finally:
+            self.invalidate_cache(event_context)
+
+    def bulk_write(
+        self, operation_type: str, items: List[dict], *args, **kwargs
+    ):
+        try:
+            return super().bulk_write(operation_type, items, *args, **kwargs)
+        finally:
+            for partition in {
+                item.get(self.partition_key_attribute) for item in items
+            }:
+                self.invalidated_cache.invalidate(partition)
+
+    def update(
+        self, id: str, item_data: dict, event_context: EventContext, **kwargs
+    ):
+        try:
+            return super().update(id, item_data, event_context, **kwargs)
+        finally:
+            self.invalidate_cache(event_context)
+
+    def patch(self, id: str, event_context: EventContext, **kwargs):
+        try:
+            return super().patch(id, event_context, **kwargs)
+        finally:
+            self.invalidate_cache(event_context)
+
+    def delete_permanently(self, id: str, event_context: EventContext) -> None:
+        try:
+            super().delete_permanently(id, event_context)
+        finally:
+            self.invalidate_cache(event_context)
+
+
+class CachedCosmosDBRepository(InvalidateOnWriteMixin, CosmosDBRepository):
+    """
+    `CosmosDBRepository` whose `find_all` goes through the cache of its
+    container. `find` is not cached, because its result is used as the base
+    of the updates.
+    """
+
+    @property
+    def cache(self) -> ReadThroughCache:
+        return get_cache(self.container.id)
+
+    @property
+    def invalidated_cache(self) -> ReadThroughCache:
+        return self.cache
+
+    def find_all(
+        self,
+        event_context: EventContext,
+        conditions: dict = None,
+        custom_sql_conditions: List[str] = None,
+        custom_params: dict = None,
+        max_count=None,
+        offset=0,
+        visible_only=True,
+        mapper: Callable = None,
+    ):
+        key = self.find_all_key(
+            conditions,
+            custom_sql_conditions,
+            custom_params,
+            max_count,
+            offset,
+            visible_only,
+        )
+        items = self.cache.get_or_load(
+            self.find_partition_key_value(event_context),
+            key,
+            lambda: CosmosDBRepository.find_all(
+                self,
+                event_context,
+                conditions=conditions,
+                custom_sql_conditions=custom_sql_conditions,
+                custom_params=custom_params,
+                max_count=max_count,
+                offset=offset,
+                visible_only=visible_only,
+                mapper=dict,
+            ),
+        )
+        function_mapper = self.get_mapper_or_dict(mapper)
+        return [function_mapper(item) for item in copy.deepcopy(items)]
+
+    @staticmethod
+    def find_all_key(
+        conditions: dict,
+        custom_sql_conditions: List[str],
+        custom_params: dict,
+        max_count,
+        offset,
+        visible_only,
+    ) -> str:
+        return json.dumps(
+            [
+                conditions,
+                custom_sql_conditions,
+                custom_params,
+                max_count,
+                offset,
+                visible_only,
+            ],
+            sort_keys=True,
+            default=str,
+        )
@@ -0,0 +1,340 @@
+"""
+Invalidation of the cached queries from the change feed of Cosmos DB
+
+The cache of `cosmos_db_cache` is local to each process, so it only sees the
+writes made through the process itself. When `CHANGE_FEED_ENABLED`, every
+process polls the change feed of the cached containers in a background
+thread and invalidates the tenants of the documents that changed, whoever
+changed them. The caches can then keep their entries longer, see
+`CHANGE_FEED_CACHE_TTL`.
+
+The continuation of each feed is kept in a `ContinuationStore`, a JSON file
+if `CHANGE_FEED_CONTINUATION_PATH` is set, so a process that restarts goes
+on from where the feed was left instead of from the current time. The
+processes can share the file: reading a change twice only invalidates the
+cache twice.
+
+The feeds that must be read by a single process of the whole deployment
+keep their continuation in a `LeaseContinuationStore` instead.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from azure.core import MatchConditions
+from azure.core.paging import ItemPaged
+from azure.cosmos import PartitionKey
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+from flask import Flask
+
+from commons.data_access_layer import cosmos_db, cosmos_db_cache
+
+CHANGE_FEED_CONTAINERS = ['project', 'activity', 'customer', 'technology']
+CHANGE_FEED_POLL_INTERVAL = 5
+CHANGE_FEED_CACHE_TTL = 3600
+CHANGE_FEED_LEASE_TTL = 60
+
+lease_container_definition = {
+    'id': 'change_feed_lease',
+    'partition_key': PartitionKey(path='/id'),
+}
+
+logger = logging.getLogger(__name__)
+
+
+class ContinuationStore:
+    def __init__(self):
+        self.continuations: Dict[str, str] = {}
+
+    def acquire(self, key: str) -> bool:
+        """
+        Whether this process may read the feed of `key` now
+        """
+        return True
+
+    def get(self, container_id: str) -> Optional[str]:
+        return self.continuations.get(container_id)
+
+    def set(self, container_id: str, continuation: str) -> None:
+        self.continuations[container_id] = continuation
+
+
+class FileContinuationStore(ContinuationStore):
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as file:
+                self.continuations = json.load(file)
+        except (OSError, ValueError):
+            self.continuations = {}
+
+    def set(self, container_id: str, continuation: str) -> None:
+        with self.lock:
+            super().set(container_id, continuation)
+            temporary_path = '%s.%s' % (self.path, os.getpid())
+            with open(temporary_path, 'w') as file:
+                json.dump(self.continuations, file)
+            os.replace(temporary_path, self.path)
+
+
+class LeaseContinuationStore(ContinuationStore):
+    """
+    Continuations kept in a Cosmos DB container, each one in a lease that a
+    single process owns. The owner renews it every time it reads the feed
+    and the other processes take it over when it has not been renewed for
+    `ttl` seconds, so the feed is read by one process of the deployment at
+    a time and the new owner goes on from where the last one left it.
+
+    The leases are written conditioned on their etag, so a process that
+    lost its lease can neither renew it nor move its continuation.
+    """
+
+    def __init__(
+        self,
+        container,
+        owner: str = None,
+        ttl: float = CHANGE_FEED_LEASE_TTL,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__()
+        self.container = container
+        self.owner = owner or str(uuid.uuid4())
+        self.ttl = ttl
+        self.clock = clock
+        self.leases: Dict[str, dict] = {}
+
+    def read(self, key: str) -> Optional[dict]:
+        try:
+            return self.container.read_item(key, partition_key=key)
+        except CosmosResourceNotFoundError:
+            return None
+
+    def write(self, key: str, lease: dict) -> bool:
+        try:
+            if lease.get('_etag'):
+                self.leases[key] = self.container.replace_item(
+                    key,
+                    lease,
+                    etag=lease['_etag'],
+                    match_condition=MatchConditions.IfNotModified,
+                )
+            else:
+                self.leases[key] = self.container.create_item(lease)
+            return True
+        except (CosmosAccessConditionFailedError, CosmosResourceExistsError):
+            # Another process took the lease since it was read
+            self.leases.pop(key, None)
+            return False
+
+    def acquire(self, key: str) -> bool:
+        lease = self.leases.get(key)
+        if lease is None:
+            lease = self.read(key) or {'id': key}
+            if (
+                lease.get('owner') not in (None, self.owner)
+                and lease['expires_at'] > self.clock()
+            ):
+                return False
+        return self.write(
+            key,
+            dict(lease, owner=self.owner, expires_at=self.clock() + self.ttl),
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        return self.leases.get(key, {}).get('continuation')
+
+    def set(self, key: str, continuation: str) -> None:
+        if key in self.leases:
+            self.write(key, dict(self.leases[key], continuation=continuation))
+
+
+class ChangeFeedReader:
+    """
+    Reads the changes of a container made after the stored continuation and
+    hands every changed document to `on_change`. The first read, without a
+    continuation, starts from the current time, or from the beginning of
+    the feed if `start_from_beginning`. The continuation is stored under
+    `key`, the id of the container by default, so several readers of the
+    same container must be given their own.
+    """
+
+    def __init__(
+        self,
+        container,
+        on_change: Callable[[dict], None],
+        store: ContinuationStore,
+        key: str = None,
+        start_from_beginning: bool = False,
+    ):
+        self.container = container
+        self.on_change = on_change
+        self.store = store
+        self.key = key or container.id
+        self.start_from_beginning = start_from_beginning
+
+    def read_changes(self) -> int:
+        if not self.store.acquire(self.key):
+            return 0
+        etags = []
+
+        def keep_etag(headers: dict, result):
+            # The SDK also calls the hook when the query is created, with
+            # the headers of the previous response of the client
+            if not isinstance(result, ItemPaged) and headers.get('etag'):
+                etags.append(headers['etag'])
+
+        changes = self.container.query_items_change_feed(
+            continuation=self.store.get(self.key),
+            is_start_from_beginning=self.start_from_beginning,
+            response_hook=keep_etag,
+        )
+        count = 0
+        for document in changes:
+            self.on_change(document)
+            count += 1
+        if etags:
+            self.store.set(self.key, etags[-1])
+        return count
+
+
+class ChangeFeedPoller:
+    """
+    Reads the change feeds of its readers every `poll_interval` seconds in a
+    daemon thread
+    """
+
+    thread_name = 'cosmos-db-change-feed'
+    # Whether the first poll is made before the thread starts, so the
+    # continuations of the readers that start from the current time are
+    # set and the changes made from then on are not missed
+    poll_on_start = True
+
+    def __init__(
+        self,
+        readers: List[ChangeFeedReader],
+        poll_interval: float = CHANGE_FEED_POLL_INTERVAL,
+    ):
+        self.readers = readers
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def poll(self) -> int:
+        count = 0
+        for reader in self.readers:
+            try:
+                count += reader.read_changes()
+            except Exception as e:
+                logger.warning(
+                    "Change feed of %s could not be read: %s",
+                    reader.container.id,
+                    e,
+                )
+        return count
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.poll_interval):
+            self.poll()
+
+    def start(self) -> None:
+        if self.thread is None:
+            if self.poll_on_start:
+                self.poll()
+            self.thread = threading.Thread(
+                target=self.run, name=self.thread_name, daemon=True
+            )
+            self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+class ChangeFeedInvalidator(ChangeFeedPoller):
+    """
+    Polls the change feed of the containers and invalidates the cached
+    queries of the tenants that changed
+    """
+
+    def __init__(
+        self,
+        containers: list,
+        store: ContinuationStore,
+        poll_interval: float = CHANGE_FEED_POLL_INTERVAL,
+        partition_key_attribute: str = 'tenant_id',
+    ):
+        super().__init__(
+            [
+                ChangeFeedReader(
+                    container,
+                    self.invalidation_of(
+                        container.id, partition_key_attribute
+                    ),
+                    store,
+                )
+                for container in containers
+            ],
+            poll_interval,
+        )
+
+    @staticmethod
+    def invalidation_of(
+        container_id: str, partition_key_attribute: str
+    ) -> Callable[[dict], None]:
+        def invalidate(document: dict):
+            cosmos_db_cache.get_cache(container_id).invalidate(
+                document.get(partition_key_attribute)
+            )
+
+        return invalidate
+
+
+change_feed_invalidator: ChangeFeedInvalidator = None
+
+
+file_continuation_stores: Dict[str, FileContinuationStore] = {}
+
+
+def get_continuation_store(app: Flask) -> ContinuationStore:
+    """
+    The file store of `CHANGE_FEED_CONTINUATION_PATH` is shared by all the
+    readers of the process, so they don't overwrite each other's
+    continuations
+    """
+    continuation_path = app.config.get('CHANGE_FEED_CONTINUATION_PATH')
+    if not continuation_path:
+        return ContinuationStore()
+    if continuation_path not in file_continuation_stores:
+        file_continuation_stores[continuation_path] = FileContinuationStore(
+            continuation_path
+        )
+    return file_continuation_stores[continuation_path]
+
+
+def init_app(app: Flask) -> None:
+    """
+    Starts the invalidator on the first request instead of here, so every
+    worker forked by the server runs its own thread
+    """
+    global change_feed_invalidator
+    if not app.config.get('CHANGE_FEED_ENABLED'):
+        return
+
+    change_feed_invalidator = ChangeFeedInvalidator(
+        [
+            cosmos_db.cosmos_helper.db.get_container_client(container_id)
+            for container_id in CHANGE_FEED_CONTAINERS
+        ],
+        get_continuation_store(app),
+    )
+    cosmos_db_cache.set_cache_ttl(CHANGE_FEED_CACHE_TTL)
+    app.before_first_request(change_feed_invalidator.start)
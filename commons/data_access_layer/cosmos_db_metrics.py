@@ -0,0 +1,520 @@
+"""
+Request charge (RU) and latency of the calls to Cosmos DB
+
+Every repository talks to Cosmos DB through an `InstrumentedContainerProxy`
+that creates a `CosmosDBCallRecord` per call, or per page in the case of
+queries, and hands it to the registered listeners. `init_app` registers the
+listener that sums the records of each request, sends the totals in the
+`X-Request-Charge` and `Server-Timing` response headers and aggregates them
+per endpoint in `endpoint_metrics`, which the admins can read from
+`GET /metrics/cosmos-db`. The calls made in other threads for a request
+count in its totals when they run `in_current_request`, and the ones of a
+coroutine when it is `awaited_in_current_request`. `azure.cosmos.aio`
+containers are wrapped by an `InstrumentedAsyncContainerProxy`.
+"""
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from itertools import chain
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import flask
+from azure.core.async_paging import AsyncList
+from flask import Flask
+
+REQUEST_CHARGE_HEADER = 'x-ms-request-charge'
+ITEM_COUNT_HEADER = 'x-ms-item-count'
+CONTINUATION_HEADER = 'x-ms-continuation'
+
+
+@dataclass
+class CosmosDBCallRecord:
+    container: str
+    operation: str
+    request_charge: float
+    latency_ms: float
+    item_count: Optional[int] = None
+    continuation: Optional[str] = None
+    method: Optional[str] = None
+    action: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class CallTags:
+    """
+    What a call is made for: the repository method that makes it, e.g.
+    `ProjectCosmosDBRepository.find_all`, and the action of its event context
+    """
+
+    method: Optional[str] = None
+    action: Optional[str] = None
+
+
+listeners: List[Callable[[CosmosDBCallRecord], None]] = []
+
+
+def add_listener(listener: Callable[[CosmosDBCallRecord], None]) -> None:
+    if listener not in listeners:
+        listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[CosmosDBCallRecord], None]) -> None:
+    if listener in listeners:
+        listeners.remove(listener)
+
+
+def notify(record: CosmosDBCallRecord) -> None:
+    for listener in list(listeners):
+        listener(record)
+
+
+def parse_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def parse_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ResponseHeaders:
+    """
+    `response_hook` that keeps the headers of the responses of one call.
+    The `last_response_headers` of the client are shared by every thread
+    that uses it, so they may already belong to another call. The charges
+    of several responses, like the partitions of a cross-partition query
+    page, are added up.
+    """
+
+    def __init__(self, response_hook: Callable = None):
+        self.response_hook = response_hook
+        self.reset()
+
+    def reset(self) -> None:
+        self.headers = {}
+        self.request_charge = 0.0
+
+    def __call__(self, headers, result) -> None:
+        self.headers = headers or {}
+        self.request_charge += parse_float(
+            self.headers.get(REQUEST_CHARGE_HEADER)
+        )
+        if self.response_hook is not None:
+            self.response_hook(headers, result)
+
+
+class InstrumentedContainerProxy:
+    """
+    Wraps an `azure.cosmos.ContainerProxy` and records the calls to
+    `query_items`, `read_item`, `create_item`, `replace_item`, `patch_item`
+    and `execute_item_batch`, tagged with the `tags` keyword argument.
+    Anything else is delegated to the wrapped container untouched.
+    """
+
+    def __init__(self, container):
+        self.wrapped_container = container
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped_container, name)
+
+    def record(
+        self,
+        operation: str,
+        started_at: float,
+        tags: Optional[CallTags],
+        response: ResponseHeaders,
+        item_count: int = None,
+    ) -> None:
+        latency_ms = (time.perf_counter() - started_at) * 1000
+        headers = response.headers
+        tags = tags or CallTags()
+        notify(
+            CosmosDBCallRecord(
+                container=self.wrapped_container.id,
+                operation=operation,
+                request_charge=response.request_charge,
+                latency_ms=latency_ms,
+                item_count=parse_int(
+                    headers.get(ITEM_COUNT_HEADER, item_count)
+                ),
+                continuation=headers.get(CONTINUATION_HEADER),
+                method=tags.method,
+                action=tags.action,
+            )
+        )
+
+    def call(
+        self,
+        operation: str,
+        *args,
+        tags: CallTags = None,
+        item_count: int = 1,
+        **kwargs,
+    ):
+        response = ResponseHeaders(kwargs.pop('response_hook', None))
+        started_at = time.perf_counter()
+        result = getattr(self.wrapped_container, operation)(
+            *args, response_hook=response, **kwargs
+        )
+        self.record(
+            operation, started_at, tags, response, item_count=item_count
+        )
+        return result
+
+    def read_item(self, *args, **kwargs):
+        return self.call('read_item', *args, **kwargs)
+
+    def create_item(self, *args, **kwargs):
+        return self.call('create_item', *args, **kwargs)
+
+    def replace_item(self, *args, **kwargs):
+        return self.call('replace_item', *args, **kwargs)
+
+    def patch_item(self, *args, **kwargs):
+        return self.call('patch_item', *args, **kwargs)
+
+    def execute_item_batch(self, batch_operations, *args, **kwargs):
+        return self.call(
+            'execute_item_batch',
+            batch_operations,
+            *args,
+            item_count=len(batch_operations),
+            **kwargs,
+        )
+
+    def query_items(self, *args, tags: CallTags = None, **kwargs):
+        response = ResponseHeaders(kwargs.pop('response_hook', None))
+        return InstrumentedItemPaged(
+            self,
+            self.wrapped_container.query_items(
+                *args, response_hook=response, **kwargs
+            ),
+            tags,
+            response,
+        )
+
+
+class InstrumentedItemPaged:
+    """
+    Wraps the `ItemPaged` of a query, so every page fetched from Cosmos DB
+    is recorded, whether it is read item by item or with `by_page()`
+    """
+
+    def __init__(
+        self,
+        container: InstrumentedContainerProxy,
+        item_paged,
+        tags: Optional[CallTags],
+        response: ResponseHeaders,
+    ):
+        self.container = container
+        self.item_paged = item_paged
+        self.tags = tags
+        self.response = response
+        self.items = None
+
+    def by_page(self, continuation_token: str = None):
+        return InstrumentedPageIterator(
+            self.container,
+            self.item_paged.by_page(continuation_token),
+            self.tags,
+            self.response,
+        )
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.items is None:
+            self.items = chain.from_iterable(self.by_page())
+        return next(self.items)
+
+    next = __next__
+
+
+class InstrumentedPageIterator:
+    def __init__(
+        self,
+        container: InstrumentedContainerProxy,
+        pages,
+        tags: Optional[CallTags],
+        response: ResponseHeaders,
+    ):
+        self.container = container
+        self.pages = pages
+        self.tags = tags
+        self.response = response
+
+    @property
+    def continuation_token(self):
+        return self.pages.continuation_token
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # The SDK also calls the hook when the query is created, before
+        # any page is fetched
+        self.response.reset()
+        started_at = time.perf_counter()
+        page = list(next(self.pages))
+        self.container.record(
+            'query_items',
+            started_at,
+            self.tags,
+            self.response,
+            item_count=len(page),
+        )
+        return iter(page)
+
+    next = __next__
+
+
+class InstrumentedAsyncPageIterator(InstrumentedPageIterator):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        self.response.reset()
+        started_at = time.perf_counter()
+        page = [item async for item in await self.pages.__anext__()]
+        self.container.record(
+            'query_items',
+            started_at,
+            self.tags,
+            self.response,
+            item_count=len(page),
+        )
+        return AsyncList(page)
+
+
+class InstrumentedAsyncItemPaged(InstrumentedItemPaged):
+    def by_page(self, continuation_token: str = None):
+        return InstrumentedAsyncPageIterator(
+            self.container,
+            self.item_paged.by_page(continuation_token),
+            self.tags,
+            self.response,
+        )
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.items is None:
+            self.items = self.iter_items()
+        return await self.items.__anext__()
+
+    async def iter_items(self):
+        async for page in self.by_page():
+            async for item in page:
+                yield item
+
+
+class InstrumentedAsyncContainerProxy(InstrumentedContainerProxy):
+    """
+    `InstrumentedContainerProxy` of an `azure.cosmos.aio.ContainerProxy`
+    """
+
+    async def call(
+        self,
+        operation: str,
+        *args,
+        tags: CallTags = None,
+        item_count: int = 1,
+        **kwargs,
+    ):
+        response = ResponseHeaders(kwargs.pop('response_hook', None))
+        started_at = time.perf_counter()
+        result = await getattr(self.wrapped_container, operation)(
+            *args, response_hook=response, **kwargs
+        )
+        self.record(
+            operation, started_at, tags, response, item_count=item_count
+        )
+        return result
+
+    def query_items(self, *args, tags: CallTags = None, **kwargs):
+        response = ResponseHeaders(kwargs.pop('response_hook', None))
+        return InstrumentedAsyncItemPaged(
+            self,
+            self.wrapped_container.query_items(
+                *args, response_hook=response, **kwargs
+            ),
+            tags,
+            response,
+        )
+
+
+@dataclass
+class CallTotals:
+    calls: int = 0
+    request_charge: float = 0.0
+    latency_ms: float = 0.0
+    by_method: Dict[str, float] = field(default_factory=dict)
+    # The calls of a request may be made from several threads at once
+    lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def add(self, record: CosmosDBCallRecord) -> None:
+        with self.lock:
+            self.calls += 1
+            self.request_charge += record.request_charge
+            self.latency_ms += record.latency_ms
+            key = record.method or record.container
+            self.by_method[key] = (
+                self.by_method.get(key, 0.0) + record.request_charge
+            )
+
+
+class EndpointMetrics:
+    """
+    Aggregates the totals of the requests per endpoint. It lives as long as
+    the process, so it must be safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints: Dict[str, dict] = {}
+
+    def add(self, endpoint: str, totals: CallTotals) -> None:
+        with self.lock:
+            metrics = self.endpoints.setdefault(
+                endpoint,
+                {
+                    'requests': 0,
+                    'calls': 0,
+                    'request_charge': 0.0,
+                    'max_request_charge': 0.0,
+                    'latency_ms': 0.0,
+                },
+            )
+            metrics['requests'] += 1
+            metrics['calls'] += totals.calls
+            metrics['request_charge'] += totals.request_charge
+            metrics['latency_ms'] += totals.latency_ms
+            metrics['max_request_charge'] = max(
+                metrics['max_request_charge'], totals.request_charge
+            )
+
+    def snapshot(self) -> List[dict]:
+        """
+        The metrics of every endpoint, the most RU-heavy ones first
+        """
+        with self.lock:
+            result = [
+                dict(
+                    metrics,
+                    endpoint=endpoint,
+                    average_request_charge=metrics['request_charge']
+                    / metrics['requests'],
+                )
+                for endpoint, metrics in self.endpoints.items()
+            ]
+        return sorted(result, key=lambda m: m['request_charge'], reverse=True)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.endpoints.clear()
+
+
+endpoint_metrics = EndpointMetrics()
+
+
+# Totals of the request that a worker thread makes its calls for
+# Totals of the request the calls of the current thread, or of the current
+# task of an event loop, are made for
+request_totals: ContextVar = ContextVar('cosmos_db_totals', default=None)
+
+
+def in_current_request(function: Callable) -> Callable:
+    """
+    Makes the calls to Cosmos DB of the function, run in another thread,
+    count in the totals of the current request
+    """
+    if not flask.has_request_context():
+        return function
+    totals = flask.g.setdefault('cosmos_db_totals', CallTotals())
+
+    def run_in_current_request(*args, **kwargs):
+        token = request_totals.set(totals)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            request_totals.reset(token)
+
+    return run_in_current_request
+
+
+def awaited_in_current_request(coroutine: Awaitable) -> Awaitable:
+    """
+    Like `in_current_request`, for a coroutine awaited in the event loop of
+    another thread. The tasks it starts count in the same totals.
+    """
+    if not flask.has_request_context():
+        return coroutine
+    totals = flask.g.setdefault('cosmos_db_totals', CallTotals())
+
+    async def await_in_current_request():
+        request_totals.set(totals)
+        return await coroutine
+
+    return await_in_current_request()
+
+
+def record_in_current_request(record: CosmosDBCallRecord) -> None:
+    totals = request_totals.get()
+    if totals is not None:
+        totals.add(record)
+    elif flask.has_request_context():
+        flask.g.setdefault('cosmos_db_totals', CallTotals()).add(record)
+
+
+def add_totals_headers(response: flask.Response) -> flask.Response:
+    """
+    Streamed responses only include the calls made before they started
+    """
+    totals = flask.g.get('cosmos_db_totals')
+    if totals is not None:
+        response.headers['X-Request-Charge'] = '%.2f' % totals.request_charge
+        response.headers[
+            'Server-Timing'
+        ] = 'cosmosdb;dur=%.1f;desc="%d calls"' % (
+            totals.latency_ms,
+            totals.calls,
+        )
+    return response
+
+
+def aggregate_per_endpoint(exception=None) -> None:
+    totals = flask.g.get('cosmos_db_totals')
+    if totals is None:
+        return
+    request = flask.request
+    endpoint = '%s %s' % (
+        request.method,
+        request.url_rule.rule if request.url_rule else request.path,
+    )
+    endpoint_metrics.add(endpoint, totals)
+    flask.current_app.logger.debug(
+        "%s: %d Cosmos DB calls, %.2f RU, %.1f ms %s",
+        endpoint,
+        totals.calls,
+        totals.request_charge,
+        totals.latency_ms,
+        totals.by_method,
+    )
+
+
+def init_app(app: Flask) -> None:
+    add_listener(record_in_current_request)
+    if add_totals_headers not in app.after_request_funcs.get(None, []):
+        app.after_request(add_totals_headers)
+        app.teardown_request(aggregate_per_endpoint)
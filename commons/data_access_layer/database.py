@@ -72,3 +72,10 @@ class EventContext:
     @property
     def app_id(self):
         return self._app_id
+
+    def resolve(self):
+        """
+        Reads now the values that are looked up when they are first used, so
+        the context can be used outside of the current request
+        """
+        return self
@@ -0,0 +1,1782 @@
+"""
+In-memory stand-in for the Azure Cosmos DB SDK
+
+It implements the subset of `CosmosClient`, `DatabaseProxy` and
+`ContainerProxy` used by `CosmosDBRepository`: point reads and writes,
+partial document updates, partition keys, unique key policies and the SQL
+dialect that the repositories emit. Plug it through `CosmosDBFacade` to run
+the API, the tests or a benchmark without an Azure account, e.g.
+
+    helper = CosmosDBFacade(InMemoryCosmosClient(), 'time-tracker')
+    repository = CosmosDBRepository.from_definition(
+        container_definition, custom_cosmos_helper=helper
+    )
+
+`AsyncInMemoryCosmosClient` mimics `azure.cosmos.aio.CosmosClient` over
+the databases of an `InMemoryCosmosClient`.
+
+Request charges reported in the `x-ms-request-charge` header are only an
+approximation of the ones Cosmos DB would bill.
+"""
+import bisect
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import azure.cosmos.exceptions as exceptions
+from azure.core.async_paging import AsyncItemPaged
+from azure.core.paging import ItemPaged
+from azure.cosmos import PartitionKey
+
+IN_MEMORY_DATABASE_URI = 'memory://'
+
+DEFAULT_PAGE_SIZE = 100
+POINT_READ_CHARGE = 1.0
+WRITE_CHARGE = 6.0
+QUERY_BASE_CHARGE = 2.3
+QUERY_CHARGE_PER_DOCUMENT = 0.25
+# Charge of the documents a query reads but doesn't return, because they
+# don't match the filter or they are skipped by OFFSET
+QUERY_CHARGE_PER_SKIPPED_DOCUMENT = 0.05
+COMPILED_QUERIES_CACHE_SIZE = 256
+MAX_BATCH_OPERATIONS = 100
+MAX_PATCH_OPERATIONS = 10
+FAILED_DEPENDENCY = 424
+
+
+class _Undefined:
+    def __repr__(self):
+        return 'undefined'  # pragma: no cover
+
+    def __bool__(self):
+        return False
+
+
+UNDEFINED = _Undefined()
+
+_NO_PARTITION_KEY = ('__no_partition_key__',)
+
+
+def bad_request(message: str) -> exceptions.CosmosHttpResponseError:
+    return exceptions.CosmosHttpResponseError(status_code=400, message=message)
+
+
+def not_found(message: str = 'Resource not found'):
+    return exceptions.CosmosResourceNotFoundError(
+        status_code=404, message=message
+    )
+
+
+def conflict(message: str = 'Resource with specified id already exists'):
+    return exceptions.CosmosResourceExistsError(
+        status_code=409, message=message
+    )
+
+
+def precondition_failed(message: str = 'Precondition failed'):
+    return exceptions.CosmosAccessConditionFailedError(
+        status_code=412, message=message
+    )
+
+
+def clone(value):
+    if isinstance(value, dict):
+        return {k: clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [clone(v) for v in value]
+    return value
+
+
+def item_id(item) -> str:
+    return item['id'] if isinstance(item, dict) else item
+
+
+def apply_patch_operation(document: dict, operation: dict) -> None:
+    """
+    Applies a partial document update operation: `add`, `set`, `replace`,
+    `remove` or `incr` on the property at `path`, e.g. `/end_date`
+    """
+    op, path = operation.get('op'), operation.get('path') or ''
+    names = path.strip('/').split('/')
+    if not path.startswith('/') or not all(names):
+        raise bad_request('Invalid patch path %s' % path)
+    parent = document
+    for name in names[:-1]:
+        parent = parent.get(name) if isinstance(parent, dict) else None
+        if not isinstance(parent, dict):
+            raise bad_request('Patch path %s does not exist' % path)
+    name = names[-1]
+    if op in ('add', 'set'):
+        parent[name] = clone(operation.get('value'))
+    elif op == 'replace':
+        if name not in parent:
+            raise bad_request('Patch path %s does not exist' % path)
+        parent[name] = clone(operation.get('value'))
+    elif op == 'remove':
+        if name not in parent:
+            raise bad_request('Patch path %s does not exist' % path)
+        del parent[name]
+    elif op == 'incr':
+        parent[name] = parent.get(name, 0) + operation.get('value')
+    else:
+        raise bad_request('Unknown patch operation %s' % op)
+
+
+"""
+Cosmos DB SQL semantics
+
+Values that do not exist are `UNDEFINED`. Comparing values of different
+types or involving `UNDEFINED` is undefined too, and only documents whose
+filter evaluates to `True` are returned.
+"""
+
+
+TYPE_RANKS = {
+    _Undefined: 0,
+    type(None): 1,
+    bool: 2,
+    int: 3,
+    float: 3,
+    str: 4,
+    list: 5,
+    dict: 6,
+}
+
+
+def type_rank(value) -> int:
+    return TYPE_RANKS.get(type(value), 6)
+
+
+def sort_key(value):
+    rank = type_rank(value)
+    if rank in (2, 3, 4):
+        return rank, value
+    return rank, 0
+
+
+def compare(left, right, operator: Callable):
+    rank = TYPE_RANKS.get(type(left), 6)
+    if rank == 0 or rank != TYPE_RANKS.get(type(right), 6):
+        return UNDEFINED
+    if rank == 1:
+        return operator(0, 0)
+    if rank > 4 and operator not in (_eq, _ne):
+        return UNDEFINED
+    return operator(left, right)
+
+
+def logical_and(left, right):
+    if left is False or right is False:
+        return False
+    if left is True and right is True:
+        return True
+    return UNDEFINED
+
+
+def logical_not(value):
+    return (not value) if isinstance(value, bool) else UNDEFINED
+
+
+def _eq(a, b):
+    return a == b
+
+
+def _ne(a, b):
+    return a != b
+
+
+RANGE_OPERATORS = ('<', '<=', '>', '>=')
+REVERSED_RANGE_OPERATORS = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+COMPARISON_OPERATORS = {
+    '=': _eq,
+    '!=': _ne,
+    '<>': _ne,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def _arithmetic(operator: Callable):
+    def apply(a, b):
+        if type_rank(a) != 3 or type_rank(b) != 3:
+            return UNDEFINED
+        try:
+            return operator(a, b)
+        except ZeroDivisionError:
+            return UNDEFINED
+
+    return apply
+
+
+ARITHMETIC_OPERATORS = {
+    '+': _arithmetic(lambda a, b: a + b),
+    '-': _arithmetic(lambda a, b: a - b),
+    '*': _arithmetic(lambda a, b: a * b),
+    '/': _arithmetic(lambda a, b: a / b),
+    '%': _arithmetic(lambda a, b: a % b),
+    '||': lambda a, b: (
+        a + b if isinstance(a, str) and isinstance(b, str) else UNDEFINED
+    ),
+}
+
+
+def _string_function(function: Callable):
+    def apply(*args):
+        if not all(isinstance(a, str) for a in args):
+            return UNDEFINED
+        return function(*args)
+
+    return apply
+
+
+SCALAR_FUNCTIONS = {
+    'IS_DEFINED': lambda v: v is not UNDEFINED,
+    'IS_NULL': lambda v: v is None,
+    'IS_BOOL': lambda v: type_rank(v) == 2,
+    'IS_NUMBER': lambda v: type_rank(v) == 3,
+    'IS_STRING': lambda v: type_rank(v) == 4,
+    'IS_ARRAY': lambda v: type_rank(v) == 5,
+    'IS_OBJECT': lambda v: type_rank(v) == 6,
+    'ARRAY_CONTAINS': lambda a, v: (
+        v in a if isinstance(a, list) else UNDEFINED
+    ),
+    'ARRAY_LENGTH': lambda a: len(a) if isinstance(a, list) else UNDEFINED,
+    'CONTAINS': _string_function(lambda s, sub: sub in s),
+    'STARTSWITH': _string_function(lambda s, prefix: s.startswith(prefix)),
+    'ENDSWITH': _string_function(lambda s, suffix: s.endswith(suffix)),
+    'LOWER': _string_function(str.lower),
+    'UPPER': _string_function(str.upper),
+    'LENGTH': _string_function(len),
+}
+
+
+def _defined(values):
+    return [v for v in values if v is not UNDEFINED]
+
+
+def _numbers(values):
+    return [v for v in values if type_rank(v) == 3]
+
+
+def _extreme(function: Callable):
+    def apply(values):
+        values = [v for v in values if type_rank(v) in (2, 3, 4)]
+        if not values:
+            return UNDEFINED
+        return function(values, key=sort_key)
+
+    return apply
+
+
+AGGREGATE_FUNCTIONS = {
+    'COUNT': lambda values: len(_defined(values)),
+    'SUM': lambda values: sum(_numbers(values)),
+    'AVG': lambda values: (
+        sum(_numbers(values)) / len(_numbers(values))
+        if _numbers(values)
+        else UNDEFINED
+    ),
+    'MIN': _extreme(min),
+    'MAX': _extreme(max),
+}
+
+
+"""
+Cosmos DB SQL parser
+
+Every expression is compiled into a closure `f(document, parameters)`.
+"""
+
+TOKEN_REGEX = re.compile(
+    r"""
+    (?P<space>\s+)
+    |(?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+    |(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<param>@[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<name>[A-Za-z_][A-Za-z0-9_$]*)
+    |(?P<symbol>!=|<>|<=|>=|\|\||[=<>(),.\[\]*+\-/%])
+    """,
+    re.VERBOSE,
+)
+
+ESCAPE_REGEX = re.compile(r'\\(.)')
+ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', 'b': '\b', 'f': '\f'}
+
+KEYWORDS = {
+    'SELECT',
+    'VALUE',
+    'TOP',
+    'DISTINCT',
+    'FROM',
+    'WHERE',
+    'AND',
+    'OR',
+    'NOT',
+    'BETWEEN',
+    'IN',
+    'ORDER',
+    'BY',
+    'ASC',
+    'DESC',
+    'OFFSET',
+    'LIMIT',
+    'AS',
+    'TRUE',
+    'FALSE',
+    'NULL',
+    'UNDEFINED',
+}
+
+
+def tokenize(query: str) -> list:
+    tokens = []
+    position = 0
+    while position < len(query):
+        match = TOKEN_REGEX.match(query, position)
+        if match is None:
+            raise bad_request(
+                "Syntax error, invalid token at '%s'" % query[position:][:20]
+            )
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'space':
+            continue
+        if kind == 'name' and value.upper() in KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        tokens.append((kind, value))
+    tokens.append(('end', None))
+    return tokens
+
+
+class CompiledQuery:
+    def __init__(self):
+        self.alias = None
+        self.distinct = False
+        self.top = None
+        self.select_value = False
+        self.projection = None
+        self.aggregate = None
+        self.where = None
+        self.order_by = []
+        self.offset = None
+        self.limit = None
+
+
+class QueryParser:
+    def __init__(self, query: str):
+        self.query = query
+        self.tokens = tokenize(query)
+        self.position = 0
+        self.alias = None
+
+    def peek(self, offset=0):
+        return self.tokens[self.position + offset]
+
+    def advance(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def accept(self, kind: str, value=None) -> bool:
+        token_kind, token_value = self.peek()
+        if token_kind == kind and (value is None or token_value == value):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind: str, value=None):
+        token = self.advance()
+        if token[0] != kind or (value is not None and token[1] != value):
+            raise bad_request(
+                "Syntax error near '%s' in query: %s" % (token[1], self.query)
+            )
+        return token[1]
+
+    def parse(self) -> CompiledQuery:
+        compiled = CompiledQuery()
+        self.expect('keyword', 'SELECT')
+        compiled.distinct = self.accept('keyword', 'DISTINCT')
+        if self.accept('keyword', 'TOP'):
+            compiled.top = self.parse_primary()
+
+        select_start = self.position
+        self.skip_select_list()
+        self.expect('keyword', 'FROM')
+        self.alias = self.expect('name')
+        if self.accept('keyword', 'AS') or self.peek()[0] == 'name':
+            self.alias = self.expect('name')
+        compiled.alias = self.alias
+
+        after_from = self.position
+        self.position = select_start
+        self.parse_select_list(compiled)
+        self.position = after_from
+
+        if self.accept('keyword', 'WHERE'):
+            compiled.where = self.parse_expression()
+        if self.accept('keyword', 'ORDER'):
+            self.expect('keyword', 'BY')
+            compiled.order_by.append(self.parse_order_item())
+            while self.accept('symbol', ','):
+                compiled.order_by.append(self.parse_order_item())
+        if self.accept('keyword', 'OFFSET'):
+            compiled.offset = self.parse_primary()
+            self.expect('keyword', 'LIMIT')
+            compiled.limit = self.parse_primary()
+        self.expect('end')
+        return compiled
+
+    def skip_select_list(self):
+        depth = 0
+        while True:
+            kind, value = self.peek()
+            if kind == 'end':
+                raise bad_request("Syntax error, FROM clause is missing")
+            if kind == 'keyword' and value == 'FROM' and depth == 0:
+                return
+            if kind == 'symbol' and value in ('(', '['):
+                depth += 1
+            if kind == 'symbol' and value in (')', ']'):
+                depth -= 1
+            self.advance()
+
+    def parse_select_list(self, compiled: CompiledQuery):
+        if self.accept('symbol', '*'):
+            compiled.projection = None
+        elif self.accept('keyword', 'VALUE'):
+            compiled.select_value = True
+            aggregate = self.parse_aggregate()
+            if aggregate is not None:
+                compiled.aggregate = aggregate
+            else:
+                compiled.projection = self.parse_expression()
+        else:
+            fields = [self.parse_select_item(1)]
+            while self.accept('symbol', ','):
+                fields.append(self.parse_select_item(len(fields) + 1))
+            compiled.projection = self.build_projection(fields)
+        self.expect('keyword', 'FROM')
+
+    def parse_aggregate(self):
+        kind, value = self.peek()
+        is_aggregate = (
+            kind == 'name'
+            and value.upper() in AGGREGATE_FUNCTIONS
+            and self.peek(1) == ('symbol', '(')
+        )
+        if not is_aggregate:
+            return None
+        self.advance()
+        self.expect('symbol', '(')
+        argument = self.parse_expression()
+        self.expect('symbol', ')')
+        return AGGREGATE_FUNCTIONS[value.upper()], argument
+
+    def parse_select_item(self, index: int):
+        kind, value = self.peek()
+        name = '$%s' % index
+        if kind == 'name' and self.peek(1) == ('symbol', '.'):
+            position = self.position
+            while self.peek(1) == ('symbol', '.'):
+                self.advance()
+                self.advance()
+            name = self.peek()[1]
+            self.position = position
+        expression = self.parse_expression()
+        if self.accept('keyword', 'AS'):
+            name = self.expect('name')
+        return name, expression
+
+    @staticmethod
+    def build_projection(fields: list):
+        def project(document, parameters):
+            result = {}
+            for name, expression in fields:
+                value = expression(document, parameters)
+                if value is not UNDEFINED:
+                    result[name] = value
+            return result
+
+        return project
+
+    def parse_order_item(self):
+        expression = self.parse_expression()
+        descending = False
+        if self.accept('keyword', 'DESC'):
+            descending = True
+        else:
+            self.accept('keyword', 'ASC')
+        return expression, descending
+
+    def parse_expression(self):
+        return self.parse_or()
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.accept('keyword', 'OR'):
+            operands.append(self.parse_and())
+        if len(operands) == 1:
+            return operands[0]
+
+        def evaluate(d, p):
+            result = False
+            for operand in operands:
+                value = operand(d, p)
+                if value is True:
+                    return True
+                if value is not False:
+                    result = UNDEFINED
+            return result
+
+        return evaluate
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.accept('keyword', 'AND'):
+            operands.append(self.parse_not())
+        if len(operands) == 1:
+            return operands[0]
+
+        conjuncts = []
+        for operand in operands:
+            conjuncts.extend(getattr(operand, 'conjuncts', [operand]))
+
+        def evaluate(d, p):
+            result = True
+            for operand in conjuncts:
+                value = operand(d, p)
+                if value is False:
+                    return False
+                if value is not True:
+                    result = UNDEFINED
+            return result
+
+        evaluate.conjuncts = conjuncts
+        return evaluate
+
+    def parse_not(self):
+        if self.accept('keyword', 'NOT'):
+            operand = self.parse_not()
+            return lambda d, p: logical_not(operand(d, p))
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_additive()
+        kind, value = self.peek()
+        if kind == 'symbol' and value in COMPARISON_OPERATORS:
+            self.advance()
+            right = self.parse_additive()
+            operator = COMPARISON_OPERATORS[value]
+
+            def evaluate(d, p):
+                return compare(left(d, p), right(d, p), operator)
+
+            if value == '=':
+                evaluate.equality = self.equality(left, right)
+            elif value in RANGE_OPERATORS:
+                evaluate.range = self.range(left, right, value)
+            return evaluate
+
+        negated = False
+        if (kind, value) == ('keyword', 'NOT') and self.peek(1)[1] in (
+            'BETWEEN',
+            'IN',
+        ):
+            self.advance()
+            negated = True
+
+        if self.accept('keyword', 'BETWEEN'):
+            low = self.parse_additive()
+            self.expect('keyword', 'AND')
+            high = self.parse_additive()
+            expression = self.between(left, low, high)
+        elif self.accept('keyword', 'IN'):
+            expression = self.in_list(left)
+        else:
+            return left
+
+        if negated:
+            return lambda d, p: logical_not(expression(d, p))
+        return expression
+
+    @staticmethod
+    def equality(left, right):
+        """
+        `(property, value)` when the comparison is `c.property = value` and
+        the value does not depend on the document, so an index can be used
+        """
+        if hasattr(right, 'property') and hasattr(left, 'constant'):
+            left, right = right, left
+        if hasattr(left, 'property') and hasattr(right, 'constant'):
+            return left.property, right
+        return None
+
+    @staticmethod
+    def range(left, right, operator: str):
+        """
+        `(property, operator, value)` when the comparison is `c.property <
+        value`, `<=`, `>` or `>=` and the value does not depend on the
+        document, so a composite index can be used
+        """
+        if hasattr(right, 'property') and hasattr(left, 'constant'):
+            left, right = right, left
+            operator = REVERSED_RANGE_OPERATORS[operator]
+        if hasattr(left, 'property') and hasattr(right, 'constant'):
+            return left.property, operator, right
+        return None
+
+    @staticmethod
+    def between(value, low, high):
+        ge, le = COMPARISON_OPERATORS['>='], COMPARISON_OPERATORS['<=']
+
+        def evaluate(d, p):
+            v = value(d, p)
+            return logical_and(
+                compare(v, low(d, p), ge), compare(v, high(d, p), le)
+            )
+
+        return evaluate
+
+    def in_list(self, value):
+        self.expect('symbol', '(')
+        candidates = []
+        if not self.accept('symbol', ')'):
+            candidates.append(self.parse_expression())
+            while self.accept('symbol', ','):
+                candidates.append(self.parse_expression())
+            self.expect('symbol', ')')
+
+        def evaluate(d, p):
+            v = value(d, p)
+            if v is UNDEFINED:
+                return UNDEFINED
+            return any(
+                compare(v, candidate(d, p), _eq) is True
+                for candidate in candidates
+            )
+
+        return evaluate
+
+    def parse_additive(self):
+        left = self.parse_multiplicative()
+        while self.peek()[0] == 'symbol' and self.peek()[1] in (
+            '+',
+            '-',
+            '||',
+        ):
+            operator = ARITHMETIC_OPERATORS[self.advance()[1]]
+            right = self.parse_multiplicative()
+            left = self.binary(operator, left, right)
+        return left
+
+    def parse_multiplicative(self):
+        left = self.parse_unary()
+        while self.peek()[0] == 'symbol' and self.peek()[1] in (
+            '*',
+            '/',
+            '%',
+        ):
+            operator = ARITHMETIC_OPERATORS[self.advance()[1]]
+            right = self.parse_unary()
+            left = self.binary(operator, left, right)
+        return left
+
+    def parse_unary(self):
+        if self.accept('symbol', '-'):
+            operand = self.parse_unary()
+            negate = ARITHMETIC_OPERATORS['-']
+            return lambda d, p: negate(0, operand(d, p))
+        return self.parse_primary()
+
+    @staticmethod
+    def binary(operator, left, right):
+        return lambda d, p: operator(left(d, p), right(d, p))
+
+    def parse_primary(self):
+        kind, value = self.advance()
+        if kind == 'number':
+            number = float(value) if re.search('[.eE]', value) else int(value)
+            return self.constant(lambda d, p: number)
+        if kind == 'string':
+            text = ESCAPE_REGEX.sub(
+                lambda m: ESCAPES.get(m.group(1), m.group(1)), value[1:-1]
+            )
+            return self.constant(lambda d, p: text)
+        if kind == 'param':
+            return self.constant(self.parameter(value))
+        if kind == 'keyword' and value in ('TRUE', 'FALSE', 'NULL'):
+            constant = {'TRUE': True, 'FALSE': False, 'NULL': None}[value]
+            return self.constant(lambda d, p: constant)
+        if kind == 'keyword' and value == 'UNDEFINED':
+            return lambda d, p: UNDEFINED
+        if kind == 'symbol' and value == '(':
+            expression = self.parse_expression()
+            self.expect('symbol', ')')
+            return expression
+        if kind == 'symbol' and value == '[':
+            return self.array_literal()
+        if kind == 'name' and self.peek() == ('symbol', '('):
+            return self.function_call(value)
+        if kind == 'name':
+            return self.property_path(value)
+        raise bad_request(
+            "Syntax error near '%s' in query: %s" % (value, self.query)
+        )
+
+    @staticmethod
+    def constant(expression):
+        expression.constant = True
+        return expression
+
+    def parameter(self, name: str):
+        def evaluate(d, p):
+            if name not in p:
+                raise bad_request("Parameter '%s' is not defined" % name)
+            return p[name]
+
+        return evaluate
+
+    def array_literal(self):
+        elements = []
+        if not self.accept('symbol', ']'):
+            elements.append(self.parse_expression())
+            while self.accept('symbol', ','):
+                elements.append(self.parse_expression())
+            self.expect('symbol', ']')
+        return lambda d, p: [e(d, p) for e in elements]
+
+    def function_call(self, name: str):
+        function = SCALAR_FUNCTIONS.get(name.upper())
+        if function is None:
+            raise bad_request("Function '%s' is not supported" % name)
+        self.expect('symbol', '(')
+        arguments = []
+        if not self.accept('symbol', ')'):
+            arguments.append(self.parse_expression())
+            while self.accept('symbol', ','):
+                arguments.append(self.parse_expression())
+            self.expect('symbol', ')')
+        return lambda d, p: function(*[a(d, p) for a in arguments])
+
+    def property_path(self, root: str):
+        if root != self.alias:
+            raise bad_request(
+                "Identifier '%s' could not be resolved in query: %s"
+                % (root, self.query)
+            )
+        steps = []
+        while True:
+            if self.accept('symbol', '.'):
+                steps.append(self.expect('name'))
+            elif self.peek() == ('symbol', '['):
+                self.advance()
+                kind, value = self.advance()
+                if kind == 'number':
+                    steps.append(int(value))
+                elif kind == 'string':
+                    steps.append(value[1:-1])
+                else:
+                    raise bad_request("Invalid property accessor '%s'" % value)
+                self.expect('symbol', ']')
+            else:
+                break
+
+        if len(steps) == 1 and isinstance(steps[0], str):
+            key = steps[0]
+
+            def evaluate_property(d, p):
+                return d.get(key, UNDEFINED)
+
+            evaluate_property.property = key
+            return evaluate_property
+
+        def evaluate(d, p):
+            value = d
+            for step in steps:
+                if isinstance(step, int):
+                    if not isinstance(value, list) or step >= len(value):
+                        return UNDEFINED
+                    value = value[step]
+                elif isinstance(value, dict):
+                    value = value.get(step, UNDEFINED)
+                else:
+                    return UNDEFINED
+            return value
+
+        return evaluate
+
+
+"""
+SDK stand-ins
+"""
+
+
+class InMemoryClientConnection:
+    def __init__(self):
+        self.last_response_headers = {}
+
+
+def batch_response(status_code: int, request_charge: float, document=None):
+    response = {'statusCode': status_code, 'requestCharge': request_charge}
+    if document is not None:
+        response['eTag'] = document['_etag']
+        response['resourceBody'] = clone(document)
+    return response
+
+
+def sequence_of(document: dict) -> int:
+    return int(document['_rid'].rsplit('-', 1)[1], 16)
+
+
+class InMemoryContainer:
+    def __init__(
+        self,
+        database_id: str,
+        id: str,
+        partition_key: PartitionKey,
+        unique_key_policy: dict = None,
+        indexing_policy: dict = None,
+        **kwargs,
+    ):
+        self.database_id = database_id
+        self.id = id
+        self.partition_key = partition_key
+        self.partition_key_steps = [
+            step for step in partition_key['paths'][0].split('/') if step
+        ]
+        self.unique_key_policy = unique_key_policy or {'uniqueKeys': []}
+        self.unique_keys = [
+            [
+                [step for step in path.split('/') if step]
+                for path in unique_key['paths']
+            ]
+            for unique_key in self.unique_key_policy.get('uniqueKeys', [])
+        ]
+        self.indexing_policy = indexing_policy or {}
+        self.composite_indexes = [
+            tuple(path['path'].strip('/') for path in composite_index)
+            for composite_index in self.indexing_policy.get(
+                'compositeIndexes', []
+            )
+            if len(composite_index) == 2
+        ]
+        self.partitions: Dict[Any, Dict[str, dict]] = {}
+        self.unique_indexes: Dict[Any, List[dict]] = {}
+        self.equality_indexes: Dict[Any, Dict[str, Dict[tuple, dict]]] = {}
+        self.range_indexes: Dict[Any, Dict[tuple, Dict[tuple, list]]] = {}
+        self.sequence = itertools.count(1)
+        self.last_sequence = 0
+        self.lock = threading.RLock()
+
+    @property
+    def properties(self) -> dict:
+        return {
+            'id': self.id,
+            'partitionKey': dict(self.partition_key),
+            'uniqueKeyPolicy': self.unique_key_policy,
+            'indexingPolicy': self.indexing_policy,
+        }
+
+    def partition_key_of(self, document: dict):
+        value = document
+        for step in self.partition_key_steps:
+            if not isinstance(value, dict) or step not in value:
+                return _NO_PARTITION_KEY
+            value = value[step]
+        return value
+
+    @staticmethod
+    def normalize_partition_key(partition_key):
+        return (
+            _NO_PARTITION_KEY if partition_key is UNDEFINED else partition_key
+        )
+
+    def unique_values(self, document: dict) -> list:
+        result = []
+        for paths in self.unique_keys:
+            values = []
+            for steps in paths:
+                value = document
+                for step in steps:
+                    value = (
+                        value.get(step) if isinstance(value, dict) else None
+                    )
+                values.append(json.dumps(value, sort_keys=True))
+            result.append(tuple(values))
+        return result
+
+    def check_unique_keys(self, partition, document: dict, ignore_id=None):
+        indexes = self.unique_indexes.get(partition)
+        if not indexes:
+            return
+        for index, values in zip(indexes, self.unique_values(document)):
+            owner = index.get(values)
+            if owner is not None and owner != ignore_id:
+                raise conflict(
+                    'Unique index constraint violation on container %s'
+                    % self.id
+                )
+
+    def index_unique_keys(self, partition, document: dict):
+        if not self.unique_keys:
+            return
+        indexes = self.unique_indexes.setdefault(
+            partition, [{} for _ in self.unique_keys]
+        )
+        for index, values in zip(indexes, self.unique_values(document)):
+            index[values] = document['id']
+
+    def unindex_unique_keys(self, partition, document: dict):
+        indexes = self.unique_indexes.get(partition)
+        if not indexes:
+            return
+        for index, values in zip(indexes, self.unique_values(document)):
+            if index.get(values) == document['id']:
+                del index[values]
+
+    @staticmethod
+    def equality_key(value) -> Optional[tuple]:
+        rank = type_rank(value)
+        return (rank, value) if rank <= 4 else None
+
+    def lookup(self, partition, field: str, value) -> Optional[list]:
+        """
+        Documents of the partition whose top-level `field` equals `value`.
+        The index of a field is built on its first lookup and kept up to
+        date by the writes. Returns None when the value can't be indexed.
+        """
+        key = self.equality_key(value)
+        if key is None or [field] == self.partition_key_steps:
+            return None
+        with self.lock:
+            indexes = self.equality_indexes.setdefault(partition, {})
+            index = indexes.get(field)
+            if index is None:
+                index = indexes[field] = {}
+                for document in self.partitions.get(partition, {}).values():
+                    self.index_field(index, field, document)
+            return list(index.get(key, {}).values())
+
+    def index_field(self, index: dict, field: str, document: dict):
+        key = self.equality_key(document.get(field, UNDEFINED))
+        if key is not None:
+            index.setdefault(key, {})[document['id']] = document
+
+    def range_entry(self, fields: tuple, document: dict) -> Optional[tuple]:
+        """
+        `(equality key, (number, id))` of the document in the composite
+        index of the two fields. Only the numbers of the second field are
+        indexed, as the range comparisons with other types never match.
+        """
+        key = self.equality_key(document.get(fields[0], UNDEFINED))
+        value = document.get(fields[1], UNDEFINED)
+        if key is None or type_rank(value) != 3:
+            return None
+        return key, (value, document['id'])
+
+    def range_lookup(
+        self, partition, fields: tuple, value, low=None, high=None
+    ) -> Optional[list]:
+        """
+        Documents of the partition whose `fields[0]` equals `value` and
+        whose `fields[1]` is within the `(number, inclusive)` bounds, taken
+        from the composite index of both fields. It is built on its first
+        lookup and kept up to date by the writes.
+        """
+        key = self.equality_key(value)
+        if key is None:
+            return None
+        with self.lock:
+            indexes = self.range_indexes.setdefault(partition, {})
+            index = indexes.get(fields)
+            if index is None:
+                index = indexes[fields] = {}
+                for document in self.partitions.get(partition, {}).values():
+                    entry = self.range_entry(fields, document)
+                    if entry is not None:
+                        bisect.insort(index.setdefault(entry[0], []), entry[1])
+            entries = index.get(key, [])
+            start, end = 0, len(entries)
+            if low is not None:
+                bound = (low[0], '' if low[1] else '\uffff')
+                start = bisect.bisect_left(entries, bound)
+            if high is not None:
+                bound = (high[0], '\uffff' if high[1] else '')
+                end = bisect.bisect_right(entries, bound)
+            documents = self.partitions.get(partition, {})
+            return [documents[id] for _, id in entries[start:end]]
+
+    def index_document(self, partition, document: dict):
+        self.index_unique_keys(partition, document)
+        for field, index in self.equality_indexes.get(partition, {}).items():
+            self.index_field(index, field, document)
+        for fields, index in self.range_indexes.get(partition, {}).items():
+            entry = self.range_entry(fields, document)
+            if entry is not None:
+                bisect.insort(index.setdefault(entry[0], []), entry[1])
+
+    def unindex_document(self, partition, document: dict):
+        self.unindex_unique_keys(partition, document)
+        for field, index in self.equality_indexes.get(partition, {}).items():
+            key = self.equality_key(document.get(field, UNDEFINED))
+            if key is not None and key in index:
+                index[key].pop(document['id'], None)
+                if not index[key]:
+                    del index[key]
+        for fields, index in self.range_indexes.get(partition, {}).items():
+            entry = self.range_entry(fields, document)
+            if entry is not None and entry[0] in index:
+                entries = index[entry[0]]
+                position = bisect.bisect_left(entries, entry[1])
+                if entries[position : position + 1] == [entry[1]]:
+                    del entries[position]
+                if not entries:
+                    del index[entry[0]]
+
+    def stamp(self, document: dict) -> dict:
+        sequence = self.last_sequence = next(self.sequence)
+        rid = '%s-%012x' % (self.id, sequence)
+        document['_rid'] = rid
+        document['_self'] = 'dbs/%s/colls/%s/docs/%s/' % (
+            self.database_id,
+            self.id,
+            rid,
+        )
+        document['_etag'] = '"%08x-0000-0000-0000-%012x"' % (
+            hash(self.id) & 0xFFFFFFFF,
+            sequence,
+        )
+        document['_attachments'] = 'attachments/'
+        document['_ts'] = int(time.time())
+        return document
+
+    def find(self, id: str, partition) -> Optional[dict]:
+        return self.partitions.get(partition, {}).get(id)
+
+    def insert(self, document: dict, upsert=False) -> dict:
+        if not isinstance(document.get('id'), str) or not document['id']:
+            raise bad_request("The input content is invalid: 'id' is missing")
+        partition = self.partition_key_of(document)
+        with self.lock:
+            current = self.find(document['id'], partition)
+            if current is not None and not upsert:
+                raise conflict()
+            self.check_unique_keys(partition, document, document['id'])
+            if current is not None:
+                self.remove(partition, current['id'])
+            return clone(self.put(partition, self.stamp(clone(document))))
+
+    def replace(
+        self, id: str, document: dict, etag: str = None, match_condition=None
+    ) -> dict:
+        partition = self.partition_key_of(document)
+        with self.lock:
+            current = self.find(id, partition)
+            if current is None:
+                raise not_found()
+            self.check_precondition(current, etag, match_condition)
+            new_id = document.get('id')
+            if new_id != id and self.find(new_id, partition) is not None:
+                raise conflict()
+            self.check_unique_keys(partition, document, id)
+            self.remove(partition, id)
+            return clone(self.put(partition, self.stamp(clone(document))))
+
+    def patch(
+        self,
+        id: str,
+        partition,
+        operations: list,
+        filter_predicate: Callable = None,
+        etag: str = None,
+        match_condition=None,
+    ) -> dict:
+        if not 0 < len(operations) <= MAX_PATCH_OPERATIONS:
+            raise bad_request(
+                'Patch request has to have between 1 and %d operations'
+                % MAX_PATCH_OPERATIONS
+            )
+        with self.lock:
+            current = self.find(id, partition)
+            if current is None:
+                raise not_found()
+            self.check_precondition(current, etag, match_condition)
+            if filter_predicate is not None and (
+                filter_predicate(current, {}) is not True
+            ):
+                raise precondition_failed()
+            document = clone(current)
+            for operation in operations:
+                apply_patch_operation(document, operation)
+            if (
+                document.get('id') != id
+                or self.partition_key_of(document) != partition
+            ):
+                raise bad_request(
+                    'The id and the partition key cannot be patched'
+                )
+            self.check_unique_keys(partition, document, id)
+            self.remove(partition, id)
+            return clone(self.put(partition, self.stamp(document)))
+
+    def delete(self, id: str, partition, etag=None, match_condition=None):
+        with self.lock:
+            current = self.find(id, partition)
+            if current is None:
+                raise not_found()
+            self.check_precondition(current, etag, match_condition)
+            self.remove(partition, id)
+
+    def put(self, partition, document: dict) -> dict:
+        self.partitions.setdefault(partition, {})[document['id']] = document
+        self.index_document(partition, document)
+        return document
+
+    def remove(self, partition, id: str) -> dict:
+        document = self.partitions[partition].pop(id)
+        self.unindex_document(partition, document)
+        return document
+
+    def execute_batch(self, operations: list, partition) -> list:
+        """
+        Applies the operations in order and all or nothing, like a
+        transactional batch: when one fails, the previous ones are undone
+        """
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            raise bad_request(
+                'Batch request has more operations than what is supported'
+            )
+        with self.lock:
+            previous = []
+            responses = []
+            for index, operation in enumerate(operations):
+                try:
+                    responses.append(
+                        self.execute_operation(operation, partition, previous)
+                    )
+                except exceptions.CosmosHttpResponseError as e:
+                    for id, document in reversed(previous):
+                        if self.find(id, partition) is not None:
+                            self.remove(partition, id)
+                        if document is not None:
+                            self.put(partition, document)
+                    raise exceptions.CosmosBatchOperationError(
+                        error_index=index,
+                        headers={},
+                        status_code=e.status_code,
+                        message=e.http_error_message,
+                        operation_responses=[
+                            {
+                                'statusCode': e.status_code
+                                if i == index
+                                else FAILED_DEPENDENCY,
+                                'requestCharge': 0,
+                            }
+                            for i in range(len(operations))
+                        ],
+                    )
+            return responses
+
+    def execute_operation(self, operation: tuple, partition, previous: list):
+        operation_type, args = operation[0].lower(), operation[1]
+        if operation_type == 'read':
+            found = self.find(args[0], partition)
+            if found is None:
+                raise not_found()
+            return batch_response(200, POINT_READ_CHARGE, found)
+
+        if operation_type == 'delete':
+            previous.append((args[0], self.find(args[0], partition)))
+            self.delete(args[0], partition)
+            return batch_response(204, WRITE_CHARGE)
+
+        body = args[-1]
+        if self.partition_key_of(body) != partition:
+            raise bad_request(
+                'Partition key of the operation does not match the one of '
+                'the batch'
+            )
+        if operation_type == 'replace':
+            from azure.core import MatchConditions
+
+            etag = (
+                operation[2].get('if_match_etag')
+                if len(operation) > 2
+                else None
+            )
+            previous.append((args[0], self.find(args[0], partition)))
+            previous.append(
+                (body.get('id'), self.find(body.get('id'), partition))
+            )
+            return batch_response(
+                200,
+                WRITE_CHARGE,
+                self.replace(
+                    args[0],
+                    body,
+                    etag=etag,
+                    match_condition=MatchConditions.IfNotModified,
+                ),
+            )
+        if operation_type in ('create', 'upsert'):
+            upsert = operation_type == 'upsert'
+            current = self.find(body.get('id'), partition)
+            previous.append((body.get('id'), current))
+            return batch_response(
+                200 if upsert and current is not None else 201,
+                WRITE_CHARGE,
+                self.insert(body, upsert=upsert),
+            )
+        raise bad_request('Unknown batch operation %s' % operation[0])
+
+    @staticmethod
+    def check_precondition(current: dict, etag: str, match_condition):
+        if etag is None or match_condition is None:
+            return
+        from azure.core import MatchConditions
+
+        if match_condition == MatchConditions.IfNotModified:
+            if etag != '*' and current['_etag'] != etag:
+                raise precondition_failed()
+        elif match_condition == MatchConditions.IfModified:
+            if current['_etag'] == etag:
+                raise precondition_failed()
+
+    def changes_since(self, sequence: int, partition=UNDEFINED) -> list:
+        """
+        Latest version of the documents written after the given sequence
+        number, in the order they were written. Like in Cosmos DB, the
+        documents deleted permanently are not reported.
+        """
+        with self.lock:
+            changes = [
+                document
+                for document in self.documents(partition)
+                if sequence_of(document) > sequence
+            ]
+        return sorted(changes, key=sequence_of)
+
+    def documents(self, partition=UNDEFINED):
+        if partition is UNDEFINED:
+            return itertools.chain.from_iterable(
+                list(p.values()) for p in list(self.partitions.values())
+            )
+        return list(self.partitions.get(partition, {}).values())
+
+
+class InMemoryContainerProxy:
+    """
+    Mimics `azure.cosmos.ContainerProxy`. The container is looked up on
+    every call, so the proxy can be created before the container exists,
+    like the real one.
+    """
+
+    def __init__(self, database, id: str):
+        self.database = database
+        self.id = id
+        self.client_connection = database.client_connection
+
+    def __repr__(self):
+        return '<InMemoryContainerProxy [%s]>' % self.id  # pragma: no cover
+
+    @property
+    def container(self) -> InMemoryContainer:
+        return self.database.get_container(self.id)
+
+    def read(self, **kwargs) -> dict:
+        return self.container.properties
+
+    def respond(self, response_hook, result, request_charge, **headers):
+        response_headers = {
+            'x-ms-request-charge': str(round(request_charge, 2)),
+            'x-ms-activity-id': str(uuid.uuid4()),
+        }
+        response_headers.update(
+            {k.replace('_', '-'): v for k, v in headers.items() if v}
+        )
+        self.client_connection.last_response_headers = response_headers
+        if response_hook:
+            response_hook(response_headers, result)
+        return result
+
+    def read_item(self, item, partition_key, **kwargs) -> dict:
+        container = self.container
+        partition = container.normalize_partition_key(partition_key)
+        found = container.find(item_id(item), partition)
+        if found is None:
+            raise not_found('Entity with the specified id does not exist')
+        return self.respond(
+            kwargs.get('response_hook'),
+            clone(found),
+            POINT_READ_CHARGE,
+            etag=found['_etag'],
+        )
+
+    def create_item(self, body: dict, **kwargs) -> dict:
+        created = self.container.insert(body)
+        return self.respond(
+            kwargs.get('response_hook'),
+            created,
+            WRITE_CHARGE,
+            etag=created['_etag'],
+        )
+
+    def upsert_item(self, body: dict, **kwargs) -> dict:
+        upserted = self.container.insert(body, upsert=True)
+        return self.respond(
+            kwargs.get('response_hook'),
+            upserted,
+            WRITE_CHARGE,
+            etag=upserted['_etag'],
+        )
+
+    def replace_item(self, item, body: dict, **kwargs) -> dict:
+        replaced = self.container.replace(
+            item_id(item),
+            body,
+            etag=kwargs.get('etag'),
+            match_condition=kwargs.get('match_condition'),
+        )
+        return self.respond(
+            kwargs.get('response_hook'),
+            replaced,
+            WRITE_CHARGE,
+            etag=replaced['_etag'],
+        )
+
+    def patch_item(
+        self, item, partition_key, patch_operations: list, **kwargs
+    ) -> dict:
+        """
+        `filter_predicate` is a `FROM c WHERE ...` clause and the item is
+        only patched when it matches, otherwise it fails with a 412
+        """
+        container = self.container
+        filter_predicate = kwargs.get('filter_predicate')
+        patched = container.patch(
+            item_id(item),
+            container.normalize_partition_key(partition_key),
+            list(patch_operations),
+            filter_predicate=self.database.compile(
+                'SELECT * ' + filter_predicate
+            ).where
+            if filter_predicate
+            else None,
+            etag=kwargs.get('etag'),
+            match_condition=kwargs.get('match_condition'),
+        )
+        return self.respond(
+            kwargs.get('response_hook'),
+            patched,
+            WRITE_CHARGE,
+            etag=patched['_etag'],
+        )
+
+    def execute_item_batch(
+        self, batch_operations, partition_key, **kwargs
+    ) -> list:
+        container = self.container
+        responses = container.execute_batch(
+            list(batch_operations),
+            container.normalize_partition_key(partition_key),
+        )
+        return self.respond(
+            kwargs.get('response_hook'),
+            responses,
+            sum(r['requestCharge'] for r in responses),
+        )
+
+    def delete_item(self, item, partition_key, **kwargs) -> None:
+        container = self.container
+        container.delete(
+            item_id(item),
+            container.normalize_partition_key(partition_key),
+            etag=kwargs.get('etag'),
+            match_condition=kwargs.get('match_condition'),
+        )
+        self.respond(kwargs.get('response_hook'), None, WRITE_CHARGE)
+
+    def read_all_items(self, max_item_count=None, **kwargs) -> ItemPaged:
+        return self.query_items(
+            'SELECT * FROM c',
+            enable_cross_partition_query=True,
+            max_item_count=max_item_count,
+            **kwargs,
+        )
+
+    def query_pages(
+        self,
+        query: str,
+        parameters: list = None,
+        partition_key=None,
+        enable_cross_partition_query=None,
+        max_item_count=None,
+        **kwargs,
+    ) -> Callable:
+        """
+        The function that fetches the pages of the query, given the
+        continuation token of each one
+        """
+        if partition_key is None and not enable_cross_partition_query:
+            raise bad_request(
+                'Cross partition query is required but disabled. Please '
+                'set x-ms-documentdb-query-enablecrosspartition to true'
+            )
+        compiled = self.database.compile(query)
+        parameters = {p['name']: p['value'] for p in parameters or []}
+        partition = (
+            UNDEFINED
+            if partition_key is None
+            else self.container.normalize_partition_key(partition_key)
+        )
+        page_size = max_item_count or DEFAULT_PAGE_SIZE
+        response_hook = kwargs.get('response_hook')
+        execution = {}
+
+        def get_next(continuation_token):
+            if 'result' not in execution:
+                execution['result'], execution['skipped'] = self.execute(
+                    compiled, parameters, partition
+                )
+            result = execution['result']
+            start = int(continuation_token) if continuation_token else 0
+            page = result[start : start + page_size]
+            next_token = start + page_size
+            continuation = (
+                str(next_token) if next_token < len(result) else None
+            )
+            skipped = execution['skipped'] if start == 0 else 0
+            request_charge = (
+                QUERY_BASE_CHARGE
+                + QUERY_CHARGE_PER_DOCUMENT * len(page)
+                + QUERY_CHARGE_PER_SKIPPED_DOCUMENT * skipped
+            )
+            self.respond(
+                response_hook,
+                page,
+                request_charge,
+                x_ms_item_count=str(len(page)),
+                x_ms_continuation=continuation,
+            )
+            return continuation, page
+
+        return get_next
+
+    def query_items(self, *args, **kwargs) -> ItemPaged:
+        return ItemPaged(
+            self.query_pages(*args, **kwargs), lambda response: response
+        )
+
+    def query_items_change_feed(
+        self,
+        partition_key_range_id: str = None,
+        is_start_from_beginning=False,
+        continuation: str = None,
+        max_item_count=None,
+        **kwargs,
+    ) -> ItemPaged:
+        """
+        The `etag` response header of every page is the continuation to
+        read the changes made after it. It is the sequence number of the
+        last write seen, e.g. `"42"`.
+        """
+        container = self.container
+        if continuation is not None:
+            sequence = int(continuation.strip('"'))
+        elif is_start_from_beginning:
+            sequence = 0
+        else:
+            sequence = container.last_sequence
+        partition = (
+            container.normalize_partition_key(kwargs['partition_key'])
+            if kwargs.get('partition_key') is not None
+            else UNDEFINED
+        )
+        page_size = max_item_count or DEFAULT_PAGE_SIZE
+        response_hook = kwargs.get('response_hook')
+        position = {'sequence': sequence}
+
+        def get_next(continuation_token):
+            changes = container.changes_since(position['sequence'], partition)
+            page = [clone(document) for document in changes[:page_size]]
+            if page:
+                position['sequence'] = sequence_of(page[-1])
+            self.respond(
+                response_hook,
+                {'Documents': page},
+                QUERY_BASE_CHARGE + QUERY_CHARGE_PER_DOCUMENT * len(page),
+                x_ms_item_count=str(len(page)),
+                etag='"%d"' % position['sequence'],
+            )
+            return ('more' if len(changes) > page_size else None), page
+
+        result = ItemPaged(get_next, lambda response: response)
+        if response_hook:
+            response_hook(self.client_connection.last_response_headers, result)
+        return result
+
+    def candidates(self, where: Callable, parameters: dict, partition):
+        """
+        Narrows the documents to scan using the equality indexes of the
+        `c.field = value` conjuncts of the WHERE clause, or the composite
+        indexes of a `c.field = value` and a `c.other_field < value` (or
+        `<=`, `>`, `>=`) conjuncts
+        """
+        container = self.container
+        if where is None or partition is UNDEFINED:
+            return container.documents(partition)
+        best = None
+        equalities, bounds = {}, {}
+        for conjunct in getattr(where, 'conjuncts', [where]):
+            equality = getattr(conjunct, 'equality', None)
+            range_comparison = getattr(conjunct, 'range', None)
+            if range_comparison is not None:
+                field, operator, value = range_comparison
+                number = value(None, parameters)
+                if type_rank(number) == 3:
+                    side = 'low' if operator[0] == '>' else 'high'
+                    bounds.setdefault(field, {})[side] = (
+                        number,
+                        operator.endswith('='),
+                    )
+            if equality is None:
+                continue
+            field, value = equality
+            equalities[field] = value(None, parameters)
+            found = container.lookup(partition, field, equalities[field])
+            if found is not None and (best is None or len(found) < len(best)):
+                best = found
+        for fields in container.composite_indexes:
+            if fields[0] not in equalities or fields[1] not in bounds:
+                continue
+            found = container.range_lookup(
+                partition,
+                fields,
+                equalities[fields[0]],
+                **bounds[fields[1]],
+            )
+            if found is not None and (best is None or len(found) < len(best)):
+                best = found
+        return container.documents(partition) if best is None else best
+
+    def execute(self, compiled: CompiledQuery, parameters: dict, partition):
+        documents = self.candidates(compiled.where, parameters, partition)
+        if not isinstance(documents, list):
+            documents = list(documents)
+        filtered_out = 0
+        if compiled.where is not None:
+            where = compiled.where
+            scanned = len(documents)
+            documents = [d for d in documents if where(d, parameters) is True]
+            filtered_out = scanned - len(documents)
+
+        for expression, descending in reversed(compiled.order_by):
+            documents.sort(
+                key=lambda d: sort_key(expression(d, parameters)),
+                reverse=descending,
+            )
+
+        if compiled.aggregate is not None:
+            function, argument = compiled.aggregate
+            value = function([argument(d, parameters) for d in documents])
+            return ([] if value is UNDEFINED else [value]), filtered_out
+
+        if compiled.projection is None:
+            results = documents
+        else:
+            projection = compiled.projection
+            results = [projection(d, parameters) for d in documents]
+            if compiled.select_value:
+                results = [r for r in results if r is not UNDEFINED]
+
+        if compiled.distinct:
+            unique = OrderedDict()
+            for r in results:
+                unique.setdefault(json.dumps(r, sort_keys=True), r)
+            results = list(unique.values())
+
+        skipped = 0
+        if compiled.offset is not None:
+            skipped = compiled.offset(None, parameters)
+            limit = compiled.limit(None, parameters)
+            results = results[skipped : skipped + limit]
+        if compiled.top is not None:
+            results = results[: compiled.top(None, parameters)]
+
+        return [clone(r) for r in results], skipped + filtered_out
+
+
+class InMemoryDatabaseProxy:
+    """
+    Mimics `azure.cosmos.DatabaseProxy`. When `default_partition_key` is
+    given, containers that were never created are provisioned with it on
+    first use, so that the API can run without the migrations.
+    """
+
+    def __init__(
+        self, client, id: str, default_partition_key: PartitionKey = None
+    ):
+        self.client = client
+        self.id = id
+        self.default_partition_key = default_partition_key
+        self.client_connection = client.client_connection
+        self.containers: Dict[str, InMemoryContainer] = {}
+        self.compiled_queries = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get_container(self, id: str) -> InMemoryContainer:
+        container = self.containers.get(id)
+        if container is None:
+            if self.default_partition_key is None:
+                raise not_found('Container %s does not exist' % id)
+            return self.create_container_if_not_exists(
+                id, self.default_partition_key
+            ).container
+        return container
+
+    def create_container(self, id: str, partition_key: PartitionKey, **kwargs):
+        with self.lock:
+            if id in self.containers:
+                raise conflict('Container %s already exists' % id)
+            self.containers[id] = InMemoryContainer(
+                self.id, id, partition_key, **kwargs
+            )
+        return InMemoryContainerProxy(self, id)
+
+    def create_container_if_not_exists(
+        self, id: str, partition_key: PartitionKey, **kwargs
+    ):
+        with self.lock:
+            if id not in self.containers:
+                self.create_container(id, partition_key, **kwargs)
+        return InMemoryContainerProxy(self, id)
+
+    def delete_container(self, container, **kwargs) -> None:
+        id = container if isinstance(container, str) else container.id
+        with self.lock:
+            if self.containers.pop(id, None) is None:
+                raise not_found('Container %s does not exist' % id)
+
+    def get_container_client(self, container) -> InMemoryContainerProxy:
+        id = container if isinstance(container, str) else container.id
+        return InMemoryContainerProxy(self, id)
+
+    def list_containers(self, **kwargs):
+        return [c.properties for c in self.containers.values()]
+
+    def compile(self, query: str) -> CompiledQuery:
+        with self.lock:
+            compiled = self.compiled_queries.get(query)
+            if compiled is not None:
+                self.compiled_queries.move_to_end(query)
+                return compiled
+        compiled = QueryParser(query).parse()
+        with self.lock:
+            self.compiled_queries[query] = compiled
+            if len(self.compiled_queries) > COMPILED_QUERIES_CACHE_SIZE:
+                self.compiled_queries.popitem(last=False)
+        return compiled
+
+
+class InMemoryCosmosClient:
+    """
+    Mimics `azure.cosmos.CosmosClient`
+    """
+
+    def __init__(self, default_partition_key: PartitionKey = None):
+        self.default_partition_key = default_partition_key
+        self.client_connection = InMemoryClientConnection()
+        self.databases: Dict[str, InMemoryDatabaseProxy] = {}
+        self.lock = threading.Lock()
+
+    def get_database_client(self, database) -> InMemoryDatabaseProxy:
+        id = database if isinstance(database, str) else database.id
+        with self.lock:
+            if id not in self.databases:
+                self.databases[id] = InMemoryDatabaseProxy(
+                    self, id, self.default_partition_key
+                )
+            return self.databases[id]
+
+    def create_database_if_not_exists(self, id: str, **kwargs):
+        return self.get_database_client(id)
+
+
+def asynchronous(name: str) -> Callable:
+    async def method(self, *args, **kwargs):
+        return getattr(self.container_proxy, name)(*args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+class AsyncInMemoryContainerProxy:
+    """
+    Mimics `azure.cosmos.aio.ContainerProxy` on top of the containers of an
+    `InMemoryCosmosClient`, so the asynchronous repositories see the data
+    of the synchronous ones
+    """
+
+    def __init__(self, container_proxy: InMemoryContainerProxy):
+        self.container_proxy = container_proxy
+        self.id = container_proxy.id
+        self.client_connection = container_proxy.client_connection
+
+    read = asynchronous('read')
+    read_item = asynchronous('read_item')
+    create_item = asynchronous('create_item')
+    upsert_item = asynchronous('upsert_item')
+    replace_item = asynchronous('replace_item')
+    patch_item = asynchronous('patch_item')
+    delete_item = asynchronous('delete_item')
+    execute_item_batch = asynchronous('execute_item_batch')
+
+    def query_items(self, *args, **kwargs) -> AsyncItemPaged:
+        get_next = self.container_proxy.query_pages(*args, **kwargs)
+
+        async def get_next_async(continuation_token):
+            return get_next(continuation_token)
+
+        async def extract_data(response):
+            return response
+
+        return AsyncItemPaged(get_next_async, extract_data)
+
+
+class AsyncInMemoryDatabaseProxy:
+    def __init__(self, database: InMemoryDatabaseProxy):
+        self.database = database
+        self.id = database.id
+
+    def get_container_client(self, container) -> AsyncInMemoryContainerProxy:
+        return AsyncInMemoryContainerProxy(
+            self.database.get_container_client(container)
+        )
+
+
+class AsyncInMemoryCosmosClient:
+    """
+    Mimics `azure.cosmos.aio.CosmosClient`. Pass the `InMemoryCosmosClient`
+    whose databases it should use.
+    """
+
+    def __init__(self, client: InMemoryCosmosClient = None):
+        self.client = client or InMemoryCosmosClient()
+        self.client_connection = self.client.client_connection
+
+    def get_database_client(self, database) -> AsyncInMemoryDatabaseProxy:
+        return AsyncInMemoryDatabaseProxy(
+            self.client.get_database_client(database)
+        )
+
+    async def close(self) -> None:
+        pass
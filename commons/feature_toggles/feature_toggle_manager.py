@@ -1,7 +1,20 @@
 import os
 import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
 from time_tracker_api.security import current_user_email
 from azure.appconfiguration import AzureAppConfigurationClient
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
+
+FEATURE_FLAG_PREFIX = '.appconfig.featureflag/'
+FEATURE_FLAGS_REFRESH_INTERVAL = 30
+MISSING_FEATURE_FLAGS_TTL = 60
+
+logger = logging.getLogger(__name__)
 
 
 class FeatureToggleConfig:
@@ -20,6 +33,152 @@ class FeatureToggleConfig:
     )
 
 
+class FeatureFlagStore:
+    """
+    Feature flags of an App Configuration store, kept in memory by the whole
+    process. All of them are loaded with a single listing on first use and
+    then refreshed in a background thread every `refresh_interval` seconds
+    with conditional requests, so only the flags that changed are
+    downloaded again. A flag created after the load is fetched the first
+    time it is asked for, and a flag that does not exist is not asked for
+    again during `missing_ttl` seconds.
+
+    The requests to the store are made without holding the lock of the
+    flags, so the readers of the loaded flags never wait for them.
+    """
+
+    def __init__(
+        self,
+        connection_str: str,
+        refresh_interval: float = FEATURE_FLAGS_REFRESH_INTERVAL,
+        missing_ttl: float = MISSING_FEATURE_FLAGS_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.connection_str = connection_str
+        self.refresh_interval = refresh_interval
+        self.missing_ttl = missing_ttl
+        self.clock = clock
+        self.client = None
+        self.flags: Optional[Dict[Tuple[str, str], tuple]] = None
+        self.missing: Dict[Tuple[str, str], float] = {}
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def get_client(self) -> AzureAppConfigurationClient:
+        with self.lock:
+            if self.client is None:
+                self.client = (
+                    AzureAppConfigurationClient.from_connection_string(
+                        self.connection_str
+                    )
+                )
+            return self.client
+
+    def store(self, setting) -> dict:
+        data = json.loads(setting.value)
+        with self.lock:
+            self.flags[(setting.key, setting.label)] = (setting, data)
+            self.missing.pop((setting.key, setting.label), None)
+        return data
+
+    def load(self) -> None:
+        # Without flags there is nothing to answer with, so the readers wait
+        # for the thread that is loading them
+        with self.load_lock:
+            if self.flags is not None:
+                return
+            flags = {}
+            for setting in self.get_client().list_configuration_settings(
+                key_filter=FEATURE_FLAG_PREFIX + '*'
+            ):
+                flags[(setting.key, setting.label)] = (
+                    setting,
+                    json.loads(setting.value),
+                )
+            with self.lock:
+                self.flags = flags
+            self.start()
+
+    def get_data(self, key: str, label: str = None) -> dict:
+        """
+        The data of the flag, shared by all its readers, so it must not be
+        modified
+
+        :raises ResourceNotFoundError: if the flag does not exist
+        """
+        full_key = FEATURE_FLAG_PREFIX + key
+        if self.flags is None:
+            self.load()
+        with self.lock:
+            flag = self.flags.get((full_key, label))
+            missing_at = self.missing.get((full_key, label))
+        if flag is not None:
+            return flag[1]
+        if (
+            missing_at is not None
+            and self.clock() - missing_at < self.missing_ttl
+        ):
+            raise ResourceNotFoundError(
+                'The feature flag %s does not exist' % key
+            )
+        try:
+            setting = self.get_client().get_configuration_setting(
+                key=full_key, label=label
+            )
+        except ResourceNotFoundError:
+            with self.lock:
+                self.missing[(full_key, label)] = self.clock()
+            raise
+        return self.store(setting)
+
+    def refresh(self) -> None:
+        with self.lock:
+            flags = list(self.flags.items())
+        for (key, label), (setting, _) in flags:
+            try:
+                updated_setting = self.get_client().get_configuration_setting(
+                    key=key,
+                    label=label,
+                    etag=setting.etag,
+                    match_condition=MatchConditions.IfModified,
+                )
+            except ResourceNotFoundError:
+                with self.lock:
+                    self.flags.pop((key, label), None)
+                continue
+            if updated_setting is not None:
+                self.store(updated_setting)
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, name='feature-flags', daemon=True
+            )
+            self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("Feature flags could not be refreshed: %s", e)
+
+
+feature_flag_stores: Dict[str, FeatureFlagStore] = {}
+feature_flag_stores_lock = threading.Lock()
+
+
+def get_feature_flag_store(connection_str: str) -> FeatureFlagStore:
+    with feature_flag_stores_lock:
+        if connection_str not in feature_flag_stores:
+            feature_flag_stores[connection_str] = FeatureFlagStore(
+                connection_str
+            )
+        return feature_flag_stores[connection_str]
+
+
 class FeatureToggleManager:
     def __init__(
         self, key: str, label: str = None, config=FeatureToggleConfig
@@ -27,39 +186,21 @@ class FeatureToggleManager:
         self.key = key
         self.label = label
         self.config = config
-        self.client = self.get_azure_app_configuration_client()
-
-    def get_azure_app_configuration_client(self):
-        connection_str = self.config.AZURE_APP_CONFIGURATION_CONNECTION_STRING
-        client = AzureAppConfigurationClient.from_connection_string(
-            connection_str
-        )
-
-        return client
-
-    def get_configuration(self, key: str, label: str):
-        configuration = self.client.get_configuration_setting(
-            key=f".appconfig.featureflag/{key}", label=label
+        self.store = get_feature_flag_store(
+            self.config.AZURE_APP_CONFIGURATION_CONNECTION_STRING
         )
 
-        return configuration
-
     def get_data_configuration(self):
-        feature_data_configuration = self.get_configuration(
-            self.key, self.label
-        )
-        result = json.loads(feature_data_configuration.value)
-
-        return result
+        return self.store.get_data(self.key, self.label)
 
-    def is_toggle_enabled(self):
-        data = self.get_data_configuration()
+    def is_toggle_enabled(self, data: dict = None):
+        data = data if data is not None else self.get_data_configuration()
         result = data["enabled"]
 
         return result
 
-    def get_list_users(self):
-        data = self.get_data_configuration()
+    def get_list_users(self, data: dict = None):
+        data = data if data is not None else self.get_data_configuration()
         client_filters = data["conditions"]["client_filters"]
         first_client = client_filters[0]
         list_users = first_client["parameters"]["Audience"]["Users"]
@@ -67,7 +208,8 @@ class FeatureToggleManager:
         return list_users
 
     def is_toggle_enabled_for_user(self):
-        list_users = self.get_list_users()
+        data = self.get_data_configuration()
+        list_users = self.get_list_users(data)
         current_user = current_user_email()
 
-        return current_user in list_users and self.is_toggle_enabled()
+        return current_user in list_users and self.is_toggle_enabled(data)
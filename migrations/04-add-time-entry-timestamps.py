@@ -0,0 +1,29 @@
+# Run after every instance of the API writes start_ts and end_ts, or run
+# it again once the older ones are stopped: it fixes the timestamps that
+# do not match the dates of the time entries.
+def up():
+    from commons.data_access_layer.cosmos_db import cosmos_helper
+    from time_tracker_api.time_entries.time_entries_model import (
+        container_definition as time_entry_definition,
+    )
+    from time_tracker_api.time_entries.time_entries_repository import (
+        TimeEntryCosmosDBRepository,
+    )
+    from . import app
+
+    app.logger.info("Updating the indexing policy of time_entry...")
+    cosmos_helper.db.replace_container(
+        time_entry_definition['id'],
+        partition_key=time_entry_definition['partition_key'],
+        indexing_policy=time_entry_definition['indexing_policy'],
+    )
+
+    app.logger.info("Adding start_ts and end_ts to the time entries...")
+    updated = TimeEntryCosmosDBRepository().backfill_timestamps()
+    app.logger.info("- %s time entries updated" % updated)
+
+    app.logger.info("Done!")
+
+
+def down():
+    print("Not implemented!")
@@ -0,0 +1,33 @@
+def up():
+    from commons.data_access_layer.cosmos_db import cosmos_helper
+    from commons.data_access_layer.cosmos_db_change_feed import (
+        lease_container_definition,
+    )
+    from time_tracker_api.time_entries.worked_time_rollup import (
+        WorkedTimeRollup,
+        container_definition as worked_time_rollup_definition,
+    )
+    from . import app
+
+    app.logger.info("Creating worked_time_rollup container...")
+    cosmos_helper.create_container_if_not_exists(worked_time_rollup_definition)
+
+    app.logger.info("Creating change_feed_lease container...")
+    cosmos_helper.create_container_if_not_exists(lease_container_definition)
+
+    app.logger.info("Adding the worked time of the existing time entries...")
+    rollup = WorkedTimeRollup(
+        cosmos_helper.db.get_container_client(
+            worked_time_rollup_definition['id']
+        )
+    )
+    updated = rollup.rebuild(
+        cosmos_helper.db.get_container_client('time_entry')
+    )
+    app.logger.info("- %s time entries added" % updated)
+
+    app.logger.info("Done!")
+
+
+def down():
+    print("Not implemented!")
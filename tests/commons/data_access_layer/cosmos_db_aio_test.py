@@ -0,0 +1,164 @@
+import asyncio
+
+import flask
+import pytest
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from faker import Faker
+from flask import Flask
+
+from commons.data_access_layer.cosmos_db import CosmosDBRepository
+from commons.data_access_layer.cosmos_db_aio import (
+    AsyncCachedCosmosDBRepository,
+    AsyncCosmosDBDao,
+    AsyncCosmosDBRepository,
+    run_async,
+)
+from commons.data_access_layer.cosmos_db_cache import CachedCosmosDBRepository
+from commons.data_access_layer.database import EventContext
+
+fake = Faker()
+
+
+@pytest.fixture(scope="module")
+def async_cosmos_db_repository(
+    app: Flask, cosmos_db_repository: CosmosDBRepository
+) -> AsyncCosmosDBRepository:
+    return AsyncCosmosDBRepository(cosmos_db_repository)
+
+
+@pytest.fixture
+def async_event_context() -> EventContext:
+    return EventContext("test", "async", tenant_id=fake.uuid4())
+
+
+def test_async_repository_shares_the_data_of_the_sync_one(
+    async_cosmos_db_repository: AsyncCosmosDBRepository,
+    cosmos_db_repository: CosmosDBRepository,
+    async_event_context: EventContext,
+):
+    created_item = run_async(
+        async_cosmos_db_repository.create(
+            {'name': fake.name(), 'email': fake.safe_email(), 'age': 20},
+            async_event_context,
+        )
+    )
+
+    found_item = cosmos_db_repository.find(
+        created_item['id'], async_event_context
+    )
+    assert found_item['name'] == created_item['name']
+    assert found_item['tenant_id'] == async_event_context.tenant_id
+
+
+def test_independent_calls_can_be_awaited_concurrently(
+    async_cosmos_db_repository: AsyncCosmosDBRepository,
+    async_event_context: EventContext,
+):
+    async def create_people():
+        return await asyncio.gather(
+            *(
+                async_cosmos_db_repository.create(
+                    {'email': fake.safe_email(), 'age': age},
+                    async_event_context,
+                )
+                for age in range(5)
+            )
+        )
+
+    async def find_all_and_count():
+        return await asyncio.gather(
+            async_cosmos_db_repository.find_all(
+                async_event_context, conditions={'age': 3}
+            ),
+            async_cosmos_db_repository.count(async_event_context),
+        )
+
+    created_items = run_async(create_people())
+    found_items, count = run_async(find_all_and_count())
+
+    assert count == len(created_items) == 5
+    assert [item['age'] for item in found_items] == [3]
+
+
+def test_async_partial_update_and_delete(
+    async_cosmos_db_repository: AsyncCosmosDBRepository,
+    async_event_context: EventContext,
+):
+    created_item = run_async(
+        async_cosmos_db_repository.create(
+            {'email': fake.safe_email(), 'age': 20}, async_event_context
+        )
+    )
+
+    updated_item = run_async(
+        async_cosmos_db_repository.partial_update(
+            created_item['id'], {'age': 21}, async_event_context
+        )
+    )
+    run_async(
+        async_cosmos_db_repository.delete(
+            created_item['id'], async_event_context
+        )
+    )
+
+    assert updated_item['age'] == 21
+    with pytest.raises(CosmosResourceNotFoundError):
+        run_async(
+            async_cosmos_db_repository.find(
+                created_item['id'], async_event_context
+            )
+        )
+
+
+def test_async_cached_find_all_shares_the_cache_of_the_sync_repository(
+    cosmos_db_repository: CosmosDBRepository,
+    cosmos_db_model: dict,
+    async_event_context: EventContext,
+    mocker,
+):
+    cached_repository = CachedCosmosDBRepository.from_definition(
+        cosmos_db_model
+    )
+    async_repository = AsyncCachedCosmosDBRepository(cached_repository)
+    cached_repository.find_all(async_event_context)
+    query_spy = mocker.spy(async_repository.container, 'query_items')
+
+    assert run_async(async_repository.find_all(async_event_context)) == []
+    query_spy.assert_not_called()
+
+    run_async(
+        async_repository.create(
+            {'email': fake.safe_email(), 'age': 30}, async_event_context
+        )
+    )
+
+    assert [
+        item['age'] for item in cached_repository.find_all(async_event_context)
+    ] == [30]
+
+
+def test_run_async_counts_the_calls_in_the_metrics_of_the_request(
+    app: Flask,
+    async_cosmos_db_repository: AsyncCosmosDBRepository,
+    async_event_context: EventContext,
+):
+    with app.test_request_context():
+        run_async(async_cosmos_db_repository.find_all(async_event_context))
+
+        assert flask.g.cosmos_db_totals.calls == 1
+
+
+def test_async_dao_creates_the_event_context_when_it_is_called(
+    async_cosmos_db_repository: AsyncCosmosDBRepository,
+    async_event_context: EventContext,
+    mocker,
+):
+    dao = AsyncCosmosDBDao(async_cosmos_db_repository)
+    create_event_context_mock = mocker.patch.object(
+        dao, 'create_event_context', return_value=async_event_context
+    )
+
+    awaitable = dao.count()
+
+    create_event_context_mock.assert_called_once_with("read-many")
+    assert run_async(awaitable) == 0
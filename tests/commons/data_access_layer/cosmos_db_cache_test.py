@@ -0,0 +1,106 @@
+from unittest.mock import Mock
+
+import pytest
+from faker import Faker
+from flask import Flask
+
+from commons.data_access_layer.cosmos_db import CosmosDBRepository
+from commons.data_access_layer.cosmos_db_cache import (
+    CachedCosmosDBRepository,
+    ReadThroughCache,
+)
+from commons.data_access_layer.database import EventContext
+
+fake = Faker()
+
+
+@pytest.fixture(scope="module")
+def cached_cosmos_db_repository(
+    app: Flask, cosmos_db_repository: CosmosDBRepository, cosmos_db_model
+) -> CachedCosmosDBRepository:
+    return CachedCosmosDBRepository.from_definition(cosmos_db_model)
+
+
+@pytest.fixture
+def cache_event_context() -> EventContext:
+    return EventContext("test", "cache", tenant_id=fake.uuid4())
+
+
+def test_read_through_cache_loads_each_key_once_until_it_expires():
+    now = [0]
+    cache = ReadThroughCache(ttl=10, clock=lambda: now[0])
+    loader = Mock(side_effect=['first', 'second'])
+
+    values = [cache.get_or_load('tenant', 'key', loader) for _ in range(3)]
+    now[0] = 11
+    expired_value = cache.get_or_load('tenant', 'key', loader)
+
+    assert values == ['first', 'first', 'first']
+    assert expired_value == 'second'
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 2
+
+
+def test_read_through_cache_evicts_the_least_recently_used_entry():
+    cache = ReadThroughCache(max_size=2)
+    cache.get_or_load('tenant', 'a', lambda: 'a')
+    cache.get_or_load('tenant', 'b', lambda: 'b')
+    cache.get_or_load('tenant', 'a', lambda: 'a')
+    cache.get_or_load('tenant', 'c', lambda: 'c')
+
+    assert cache.get_or_load('tenant', 'a', lambda: 'reloaded') == 'a'
+    assert cache.get_or_load('tenant', 'b', lambda: 'reloaded') == 'reloaded'
+
+
+def test_read_through_cache_does_not_store_a_value_loaded_during_invalidation():
+    cache = ReadThroughCache()
+
+    def load_while_invalidating():
+        cache.invalidate('tenant')
+        return 'stale'
+
+    cache.get_or_load('tenant', 'key', load_while_invalidating)
+
+    assert cache.get_or_load('tenant', 'key', lambda: 'fresh') == 'fresh'
+
+
+def test_cached_find_all_is_invalidated_by_the_writes_of_its_tenant(
+    cached_cosmos_db_repository: CachedCosmosDBRepository,
+    cache_event_context: EventContext,
+    mocker,
+):
+    other_event_context = EventContext("test", "cache", tenant_id="other")
+    cached_cosmos_db_repository.find_all(cache_event_context)
+    cached_cosmos_db_repository.find_all(other_event_context)
+    query_spy = mocker.spy(
+        cached_cosmos_db_repository.container, 'query_items'
+    )
+
+    assert cached_cosmos_db_repository.find_all(cache_event_context) == []
+    query_spy.assert_not_called()
+
+    created_item = cached_cosmos_db_repository.create(
+        {'email': fake.safe_email()}, cache_event_context
+    )
+    found_items = cached_cosmos_db_repository.find_all(cache_event_context)
+    cached_cosmos_db_repository.find_all(other_event_context)
+
+    assert [item['id'] for item in found_items] == [created_item['id']]
+    assert query_spy.call_count == 1
+
+
+def test_cached_find_all_returns_items_the_callers_can_change(
+    cached_cosmos_db_repository: CachedCosmosDBRepository,
+    cache_event_context: EventContext,
+):
+    cached_cosmos_db_repository.create(
+        {'email': fake.safe_email(), 'tags': ['a']}, cache_event_context
+    )
+    [item] = cached_cosmos_db_repository.find_all(cache_event_context)
+    item['customer_name'] = 'Ioet'
+    item['tags'].append('b')
+
+    [cached_item] = cached_cosmos_db_repository.find_all(cache_event_context)
+
+    assert 'customer_name' not in cached_item
+    assert cached_item['tags'] == ['a']
@@ -0,0 +1,144 @@
+import pytest
+from faker import Faker
+from flask import Flask
+
+from commons.data_access_layer.cosmos_db import CosmosDBRepository
+from commons.data_access_layer.cosmos_db_cache import (
+    CachedCosmosDBRepository,
+)
+from commons.data_access_layer.cosmos_db_change_feed import (
+    ChangeFeedInvalidator,
+    ChangeFeedReader,
+    ContinuationStore,
+    FileContinuationStore,
+    LeaseContinuationStore,
+    lease_container_definition,
+)
+from commons.data_access_layer.database import EventContext
+
+fake = Faker()
+
+
+@pytest.fixture(scope="module")
+def cached_cosmos_db_repository(
+    app: Flask, cosmos_db_repository: CosmosDBRepository, cosmos_db_model
+) -> CachedCosmosDBRepository:
+    return CachedCosmosDBRepository.from_definition(cosmos_db_model)
+
+
+@pytest.fixture
+def change_feed_event_context() -> EventContext:
+    return EventContext("test", "change-feed", tenant_id=fake.uuid4())
+
+
+def test_change_feed_reader_goes_on_from_the_stored_continuation(
+    cosmos_db_repository: CosmosDBRepository,
+    change_feed_event_context: EventContext,
+):
+    changed_documents = []
+    reader = ChangeFeedReader(
+        cosmos_db_repository.container.wrapped_container,
+        changed_documents.append,
+        ContinuationStore(),
+    )
+    assert reader.read_changes() == 0
+
+    created_items = [
+        cosmos_db_repository.create(
+            {'email': fake.safe_email()}, change_feed_event_context
+        )
+        for _ in range(2)
+    ]
+
+    assert reader.read_changes() == 2
+    assert reader.read_changes() == 0
+    assert [document['id'] for document in changed_documents] == [
+        item['id'] for item in created_items
+    ]
+
+
+def test_file_continuation_store_persists_the_continuations(tmp_path):
+    path = str(tmp_path / 'continuations.json')
+    FileContinuationStore(path).set('project', '"42"')
+
+    assert FileContinuationStore(path).get('project') == '"42"'
+    assert FileContinuationStore(path).get('activity') is None
+
+
+def test_changes_made_elsewhere_invalidate_the_cache_of_their_tenant(
+    cosmos_db_repository: CosmosDBRepository,
+    cached_cosmos_db_repository: CachedCosmosDBRepository,
+    change_feed_event_context: EventContext,
+):
+    invalidator = ChangeFeedInvalidator(
+        [cosmos_db_repository.container.wrapped_container],
+        ContinuationStore(),
+    )
+    invalidator.poll()
+    assert (
+        cached_cosmos_db_repository.find_all(change_feed_event_context) == []
+    )
+
+    created_item = cosmos_db_repository.create(
+        {'email': fake.safe_email()}, change_feed_event_context
+    )
+    stale_items = cached_cosmos_db_repository.find_all(
+        change_feed_event_context
+    )
+    invalidator.poll()
+    found_items = cached_cosmos_db_repository.find_all(
+        change_feed_event_context
+    )
+
+    assert stale_items == []
+    assert [item['id'] for item in found_items] == [created_item['id']]
+
+
+def test_lease_continuation_store_lets_a_single_process_read_the_feed(
+    app: Flask,
+    cosmos_db_repository: CosmosDBRepository,
+    change_feed_event_context: EventContext,
+):
+    from commons.data_access_layer.cosmos_db import cosmos_helper
+
+    lease_container = cosmos_helper.create_container_if_not_exists(
+        lease_container_definition
+    )
+    key = fake.uuid4()
+    now = [0]
+    changed_documents = {'first': [], 'second': []}
+    readers = {
+        owner: ChangeFeedReader(
+            cosmos_db_repository.container.wrapped_container,
+            changed_documents[owner].append,
+            LeaseContinuationStore(
+                lease_container, owner=owner, ttl=60, clock=lambda: now[0]
+            ),
+            key=key,
+            start_from_beginning=True,
+        )
+        for owner in changed_documents
+    }
+    created_item = cosmos_db_repository.create(
+        {'email': fake.safe_email()}, change_feed_event_context
+    )
+
+    assert readers['first'].read_changes() > 0
+    assert readers['second'].read_changes() == 0
+    assert created_item['id'] in [
+        document['id'] for document in changed_documents['first']
+    ]
+    assert changed_documents['second'] == []
+
+    # The first process stops renewing its lease, so the second one takes
+    # it over and goes on from where the first one left the feed
+    now[0] = 60
+    created_item = cosmos_db_repository.create(
+        {'email': fake.safe_email()}, change_feed_event_context
+    )
+
+    assert readers['second'].read_changes() == 1
+    assert readers['first'].read_changes() == 0
+    assert [document['id'] for document in changed_documents['second']] == [
+        created_item['id']
+    ]
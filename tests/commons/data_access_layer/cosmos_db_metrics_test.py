@@ -0,0 +1,142 @@
+import flask
+import pytest
+from faker import Faker
+from flask import Flask
+
+from commons.data_access_layer import cosmos_db_metrics
+from commons.data_access_layer.cosmos_db import (
+    CosmosDBDao,
+    CosmosDBRepository,
+)
+from commons.data_access_layer.cosmos_db_metrics import (
+    CallTotals,
+    CosmosDBCallRecord,
+    EndpointMetrics,
+)
+from commons.data_access_layer.database import EventContext
+from commons.data_access_layer.in_memory_cosmos_db import POINT_READ_CHARGE
+
+fake = Faker()
+
+
+@pytest.fixture
+def records():
+    result = []
+    cosmos_db_metrics.add_listener(result.append)
+    yield result
+    cosmos_db_metrics.remove_listener(result.append)
+
+
+def test_point_operations_are_recorded_with_their_request_charge(
+    cosmos_db_repository: CosmosDBRepository,
+    event_context: EventContext,
+    sample_item: dict,
+    records: list,
+):
+    cosmos_db_repository.find(sample_item['id'], event_context)
+
+    assert len(records) == 1
+    record = records[0]
+    assert record.container == cosmos_db_repository.container.id
+    assert record.operation == 'read_item'
+    assert record.request_charge > 0
+    assert record.latency_ms >= 0
+    assert record.method == 'CosmosDBRepository.find'
+    assert record.action == event_context.action
+
+
+def test_queries_are_recorded_per_page(
+    cosmos_db_repository: CosmosDBRepository,
+    event_context: EventContext,
+    sample_item: dict,
+    another_item: dict,
+    records: list,
+):
+    pages = list(cosmos_db_repository.iter_pages(event_context, page_size=1))
+
+    assert len(records) == len(pages)
+    assert all(r.operation == 'query_items' for r in records)
+    assert [r.item_count for r in records] == [len(p) for p in pages]
+    assert records[0].continuation is not None
+    assert records[-1].continuation is None
+
+
+def test_calls_keep_their_own_response_headers(
+    cosmos_db_repository: CosmosDBRepository,
+    event_context: EventContext,
+    sample_item: dict,
+    records: list,
+):
+    container = cosmos_db_repository.container
+
+    def make_another_call(headers, result):
+        # Like a call of another thread, it replaces the response headers
+        # that the client shares
+        list(
+            container.wrapped_container.query_items(
+                'SELECT * FROM c', partition_key=event_context.tenant_id
+            )
+        )
+
+    container.read_item(
+        sample_item['id'],
+        event_context.tenant_id,
+        response_hook=make_another_call,
+    )
+
+    assert [r.request_charge for r in records] == [POINT_READ_CHARGE]
+
+
+def test_calls_are_tagged_with_the_repository_method(
+    app: Flask,
+    cosmos_db_dao: CosmosDBDao,
+    event_context: EventContext,
+    records: list,
+    mocker,
+):
+    mocker.patch.object(
+        cosmos_db_dao, 'create_event_context', return_value=event_context
+    )
+
+    cosmos_db_dao.get_all()
+
+    assert records[0].method == 'CosmosDBRepository.find_all'
+    assert records[0].action == event_context.action
+
+
+def test_endpoint_metrics_sorts_the_most_expensive_endpoints_first():
+    endpoint_metrics = EndpointMetrics()
+    cheap, expensive = CallTotals(), CallTotals()
+    cheap.add(CosmosDBCallRecord('test', 'read_item', 1.0, 2.0))
+    expensive.add(CosmosDBCallRecord('test', 'query_items', 30.0, 9.0))
+
+    endpoint_metrics.add('GET /cheap', cheap)
+    endpoint_metrics.add('GET /expensive', expensive)
+    endpoint_metrics.add('GET /expensive', expensive)
+
+    snapshot = endpoint_metrics.snapshot()
+    assert [m['endpoint'] for m in snapshot] == [
+        'GET /expensive',
+        'GET /cheap',
+    ]
+    assert snapshot[0]['requests'] == 2
+    assert snapshot[0]['average_request_charge'] == 30.0
+
+
+def test_bulk_write_calls_count_in_the_totals_of_the_request(
+    app: Flask,
+    cosmos_db_repository: CosmosDBRepository,
+    records: list,
+):
+    event_context = EventContext("test", "import", tenant_id=fake.uuid4())
+    items = [
+        {'id': fake.uuid4(), 'email': fake.safe_email(), 'tenant_id': tenant}
+        for tenant in [fake.uuid4(), fake.uuid4(), fake.uuid4()]
+    ]
+
+    with app.test_request_context():
+        cosmos_db_repository.bulk_create(items, event_context)
+        totals = flask.g.cosmos_db_totals
+
+    assert totals.calls == len(records) == 3
+    assert totals.request_charge == sum(r.request_charge for r in records)
@@ -15,6 +15,7 @@ from commons.data_access_layer.database import EventContext
 from commons.data_access_layer.cosmos_db import (
     CosmosDBRepository,
     CosmosDBModel,
+    CustomError,
 )
 
 from utils.time import datetime_str, current_datetime
@@ -317,6 +318,68 @@ def test_find_all_with_offset(
     assert result_after_the_second_item == result_all_items[2:]
 
 
+def test_find_page_should_continue_where_the_previous_page_ended(
+    cosmos_db_repository: CosmosDBRepository, event_context: EventContext
+):
+    all_items = cosmos_db_repository.find_all(event_context)
+
+    first_page, continuation_token = cosmos_db_repository.find_page(
+        event_context, page_size=2
+    )
+    second_page, _ = cosmos_db_repository.find_page(
+        event_context, page_size=2, continuation_token=continuation_token
+    )
+
+    assert continuation_token is not None
+    assert first_page + second_page == all_items[:4]
+
+
+def test_find_page_should_return_no_continuation_token_on_the_last_page(
+    cosmos_db_repository: CosmosDBRepository, event_context: EventContext
+):
+    all_items = cosmos_db_repository.find_all(event_context)
+
+    items, continuation_token = cosmos_db_repository.find_page(
+        event_context, page_size=len(all_items) + 1
+    )
+
+    assert items == all_items
+    assert continuation_token is None
+
+
+def test_find_page_with_invalid_continuation_token_should_fail(
+    cosmos_db_repository: CosmosDBRepository, event_context: EventContext
+):
+    with pytest.raises(CustomError) as e:
+        cosmos_db_repository.find_page(
+            event_context, continuation_token='not base64!'
+        )
+
+    assert e.value.code == 400
+
+
+def test_iter_all_should_yield_the_same_items_as_find_all(
+    cosmos_db_repository: CosmosDBRepository, event_context: EventContext
+):
+    all_items = cosmos_db_repository.find_all(event_context)
+
+    items = cosmos_db_repository.iter_all(event_context, page_size=3)
+
+    assert not isinstance(items, list)
+    assert list(items) == all_items
+
+
+def test_iter_pages_should_yield_pages_of_the_given_size(
+    cosmos_db_repository: CosmosDBRepository, event_context: EventContext
+):
+    all_items = cosmos_db_repository.find_all(event_context)
+
+    pages = list(cosmos_db_repository.iter_pages(event_context, page_size=3))
+
+    assert all(len(page) <= 3 for page in pages)
+    assert sum(pages, []) == all_items
+
+
 def test_count(
     cosmos_db_repository: CosmosDBRepository, event_context: EventContext
 ):
@@ -409,6 +472,120 @@ def test_partial_update_should_only_update_fields_in_changes(
     assert updated_item['age'] == sample_item["age"]
 
 
+def test_partial_update_with_current_item_should_not_read_it_again(
+    cosmos_db_repository: CosmosDBRepository,
+    sample_item: dict,
+    event_context: EventContext,
+    mocker,
+):
+    read_item_spy = mocker.spy(cosmos_db_repository.container, 'read_item')
+
+    updated_item = cosmos_db_repository.partial_update(
+        sample_item['id'],
+        {'name': fake.name()},
+        event_context,
+        current_item=sample_item,
+    )
+
+    read_item_spy.assert_not_called()
+    assert updated_item['_etag'] != sample_item['_etag']
+
+
+def test_partial_update_should_apply_the_changes_to_the_latest_version(
+    cosmos_db_repository: CosmosDBRepository,
+    sample_item: dict,
+    event_context: EventContext,
+):
+    cosmos_db_repository.partial_update(
+        sample_item['id'], {'age': 99}, event_context
+    )
+
+    updated_item = cosmos_db_repository.partial_update(
+        sample_item['id'],
+        {'name': 'Concurrent'},
+        event_context,
+        current_item=sample_item,
+    )
+
+    assert updated_item['name'] == 'Concurrent'
+    assert updated_item['age'] == 99
+
+
+def test_partial_update_should_give_up_if_the_item_keeps_changing(
+    cosmos_db_repository: CosmosDBRepository,
+    sample_item: dict,
+    event_context: EventContext,
+    mocker,
+):
+    from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+
+    replace_item_mock = mocker.patch.object(
+        cosmos_db_repository.container,
+        'replace_item',
+        side_effect=CosmosAccessConditionFailedError(status_code=412),
+    )
+
+    with pytest.raises(CosmosAccessConditionFailedError):
+        cosmos_db_repository.partial_update(
+            sample_item['id'], {'name': fake.name()}, event_context
+        )
+
+    assert replace_item_mock.call_count == 4
+
+
+def test_patch_should_only_change_the_given_fields_without_reading_the_item(
+    cosmos_db_repository: CosmosDBRepository,
+    sample_item: dict,
+    event_context: EventContext,
+    mocker,
+):
+    read_item_spy = mocker.spy(cosmos_db_repository.container, 'read_item')
+
+    patched_item = cosmos_db_repository.patch(
+        sample_item['id'],
+        event_context,
+        set_values={'age': 99},
+        remove_fields=['email'],
+        filter_predicate='c.age = %d' % sample_item['age'],
+        mapper=Person,
+    )
+
+    read_item_spy.assert_not_called()
+    assert type(patched_item) is Person
+    assert patched_item.age == 99
+    assert patched_item.name == sample_item['name']
+    assert 'email' not in cosmos_db_repository.find(
+        sample_item['id'], event_context
+    )
+
+
+def test_patch_should_fail_if_the_filter_predicate_does_not_hold(
+    cosmos_db_repository: CosmosDBRepository,
+    sample_item: dict,
+    event_context: EventContext,
+):
+    from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+
+    with pytest.raises(CosmosAccessConditionFailedError):
+        cosmos_db_repository.patch(
+            sample_item['id'],
+            event_context,
+            set_values={'age': 99},
+            filter_predicate='c.age = %d' % (sample_item['age'] + 1),
+        )
+
+    cosmos_db_repository.delete(sample_item['id'], event_context)
+    with pytest.raises(CosmosAccessConditionFailedError):
+        cosmos_db_repository.patch(
+            sample_item['id'], event_context, set_values={'age': 99}
+        )
+
+    found_item = cosmos_db_repository.find(
+        sample_item['id'], event_context, visible_only=False
+    )
+    assert found_item['age'] == sample_item['age']
+
+
 @pytest.mark.parametrize(
     'mapper,expected_type', [(None, dict), (dict, dict), (Person, Person)]
 )
@@ -759,3 +936,100 @@ def test_attach_context_should_create_last_event_context_attrib(
     assert data["_last_event_ctx"]["description"] == None
     assert data["_last_event_ctx"]["user_id"] == owner_id
     assert data["_last_event_ctx"]["tenant_id"] == tenant_id
+
+
+def create_people(amount: int, tenant_id: str = None) -> list:
+    return [
+        dict(
+            id=fake.uuid4(),
+            name=fake.name(),
+            email='%s-%s' % (i, fake.safe_email()),
+            age=fake.pyint(min_value=10, max_value=80),
+            tenant_id=tenant_id,
+        )
+        for i in range(amount)
+    ]
+
+
+def test_bulk_create_should_group_items_in_batches_per_partition_key(
+    cosmos_db_repository: CosmosDBRepository, mocker
+):
+    event_context = EventContext("test", "import", tenant_id=fake.uuid4())
+    another_tenant_id = fake.uuid4()
+    items = create_people(150) + create_people(3, another_tenant_id)
+    execute_item_batch_spy = mocker.spy(
+        cosmos_db_repository.container, 'execute_item_batch'
+    )
+
+    results = cosmos_db_repository.bulk_create(
+        items, event_context, mapper=Person
+    )
+
+    assert [r.id for r in results] == [item['id'] for item in items]
+    assert all(r.status_code == 201 for r in results)
+    assert type(results[0].item) is Person
+    assert sorted(
+        len(args[0]) for args, _ in execute_item_batch_spy.call_args_list
+    ) == [3, 50, 100]
+    assert cosmos_db_repository.count(event_context) == 150
+
+
+def test_bulk_create_should_only_leave_out_the_items_that_fail(
+    cosmos_db_repository: CosmosDBRepository,
+):
+    event_context = EventContext("test", "import", tenant_id=fake.uuid4())
+    items = create_people(3)
+    items[1]['email'] = items[0]['email']
+
+    results = cosmos_db_repository.bulk_create(items, event_context)
+
+    assert [r.status_code for r in results] == [201, 409, 201]
+    assert not results[1].succeeded and results[1].error is not None
+    assert cosmos_db_repository.count(event_context) == 2
+
+
+def test_bulk_upsert_should_replace_existing_items(
+    cosmos_db_repository: CosmosDBRepository,
+):
+    event_context = EventContext("test", "import", tenant_id=fake.uuid4())
+    items = create_people(2)
+    cosmos_db_repository.bulk_create(items, event_context)
+
+    items[0]['name'] = 'Updated'
+    results = cosmos_db_repository.bulk_upsert(items, event_context)
+
+    assert [r.status_code for r in results] == [200, 200]
+    assert (
+        cosmos_db_repository.find(items[0]['id'], event_context)['name']
+        == 'Updated'
+    )
+
+
+def test_bulk_create_should_retry_throttled_batches(
+    cosmos_db_repository: CosmosDBRepository, mocker
+):
+    from azure.cosmos.exceptions import CosmosHttpResponseError
+
+    event_context = EventContext("test", "import", tenant_id=fake.uuid4())
+    execute_item_batch = cosmos_db_repository.container.execute_item_batch
+    responses = iter(
+        [CosmosHttpResponseError(status_code=429, message='Throttled')]
+    )
+
+    def throttle_once(*args, **kwargs):
+        error = next(responses, None)
+        if error is not None:
+            raise error
+        return execute_item_batch(*args, **kwargs)
+
+    mocker.patch.object(
+        cosmos_db_repository.container,
+        'execute_item_batch',
+        side_effect=throttle_once,
+    )
+    sleep_mock = mocker.patch('commons.data_access_layer.cosmos_db.time.sleep')
+
+    results = cosmos_db_repository.bulk_create(create_people(2), event_context)
+
+    sleep_mock.assert_called_once()
+    assert [r.status_code for r in results] == [201, 201]
@@ -0,0 +1,394 @@
+import pytest
+from azure.cosmos import PartitionKey
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosBatchOperationError,
+    CosmosHttpResponseError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+from faker import Faker
+
+from commons.data_access_layer.cosmos_db import (
+    CosmosDBFacade,
+    CosmosDBRepository,
+)
+from commons.data_access_layer.database import EventContext
+from commons.data_access_layer.in_memory_cosmos_db import (
+    InMemoryCosmosClient,
+)
+
+fake = Faker()
+
+container_definition = {
+    'id': 'in_memory_test',
+    'partition_key': PartitionKey(path='/tenant_id'),
+    'unique_key_policy': {
+        'uniqueKeys': [{'paths': ['/owner_id', '/end_date', '/deleted']}]
+    },
+}
+
+
+@pytest.fixture
+def in_memory_cosmos_helper() -> CosmosDBFacade:
+    helper = CosmosDBFacade(InMemoryCosmosClient(), 'test')
+    helper.create_container(container_definition)
+    return helper
+
+
+@pytest.fixture
+def container(in_memory_cosmos_helper: CosmosDBFacade):
+    return in_memory_cosmos_helper.db.get_container_client(
+        container_definition['id']
+    )
+
+
+def create_items(container, tenant_id: str, amount: int) -> list:
+    return [
+        container.create_item(
+            body={
+                'id': 'item-%03d' % i,
+                'tenant_id': tenant_id,
+                'owner_id': fake.uuid4(),
+                'start_date': '2020-10-01T%02d:00:00Z' % (i % 24),
+                'end_date': '2020-10-01T%02d:30:00Z' % (i % 24),
+                'hours': i,
+            }
+        )
+        for i in range(amount)
+    ]
+
+
+def query(container, query_str: str, partition_key: str, **params) -> list:
+    return list(
+        container.query_items(
+            query=query_str,
+            parameters=[
+                {'name': '@%s' % k, 'value': v} for k, v in params.items()
+            ],
+            partition_key=partition_key,
+        )
+    )
+
+
+def test_create_item_adds_system_properties(container, tenant_id: str):
+    created_item = container.create_item(
+        body={'id': fake.uuid4(), 'tenant_id': tenant_id}
+    )
+
+    assert created_item['_etag'] is not None
+    assert created_item['_ts'] > 0
+
+
+def test_create_item_with_same_id_in_same_partition_should_fail(
+    container, tenant_id: str, another_tenant_id: str
+):
+    item = {'id': fake.uuid4(), 'tenant_id': tenant_id}
+    container.create_item(body=item)
+
+    with pytest.raises(CosmosResourceExistsError):
+        container.create_item(body=item)
+
+    item['tenant_id'] = another_tenant_id
+    assert container.create_item(body=item)['id'] == item['id']
+
+
+def test_create_item_should_enforce_unique_key_policy(
+    container, tenant_id: str, owner_id: str
+):
+    container.create_item(
+        body={'id': fake.uuid4(), 'tenant_id': tenant_id, 'owner_id': owner_id}
+    )
+
+    with pytest.raises(CosmosResourceExistsError):
+        container.create_item(
+            body={
+                'id': fake.uuid4(),
+                'tenant_id': tenant_id,
+                'owner_id': owner_id,
+                'end_date': None,
+            }
+        )
+
+
+def test_read_item_returns_a_copy_of_the_stored_item(
+    container, tenant_id: str
+):
+    created_item = container.create_item(
+        body={'id': fake.uuid4(), 'tenant_id': tenant_id, 'tags': ['a']}
+    )
+
+    found_item = container.read_item(created_item['id'], tenant_id)
+    found_item['tags'].append('b')
+
+    assert container.read_item(created_item['id'], tenant_id)['tags'] == ['a']
+
+
+def test_replace_item_in_another_partition_should_fail(
+    container, tenant_id: str, another_tenant_id: str
+):
+    created_item = container.create_item(
+        body={'id': fake.uuid4(), 'tenant_id': tenant_id}
+    )
+
+    with pytest.raises(CosmosResourceNotFoundError):
+        container.replace_item(
+            created_item['id'],
+            body={'id': created_item['id'], 'tenant_id': another_tenant_id},
+        )
+
+
+def test_query_items_without_partition_key_should_fail(container):
+    with pytest.raises(CosmosHttpResponseError) as e:
+        list(container.query_items(query='SELECT * FROM c'))
+
+    assert e.value.status_code == 400
+
+
+def test_query_items_with_invalid_syntax_should_fail(container, tenant_id):
+    with pytest.raises(CosmosHttpResponseError) as e:
+        query(container, 'SELECT * FROM c WHERE c.id ==', tenant_id)
+
+    assert e.value.status_code == 400
+
+
+@pytest.mark.parametrize(
+    'where_clause,expected_ids',
+    [
+        ("c.hours = 2", ['item-002']),
+        ("c.hours != 2 AND c.hours < 3", ['item-000', 'item-001']),
+        ("c.id IN ('item-001', 'item-003')", ['item-001', 'item-003']),
+        ("c.id IN ('item-004')", ['item-004']),
+        ("c.hours BETWEEN 3 AND 4", ['item-003', 'item-004']),
+        ("NOT (c.hours >= 1)", ['item-000']),
+        ("c.hours = '2'", []),
+        ("c.missing = null", []),
+        ("NOT IS_DEFINED(c.deleted) AND c.hours > 3", ['item-004']),
+        (
+            "(c.start_date BETWEEN @start_date AND @end_date)",
+            ['item-001', 'item-002'],
+        ),
+    ],
+)
+def test_query_items_filters_like_cosmos_db(
+    container, tenant_id: str, where_clause: str, expected_ids: list
+):
+    create_items(container, tenant_id, 5)
+
+    result = query(
+        container,
+        'SELECT * FROM c WHERE c.tenant_id = @tenant_id AND %s' % where_clause,
+        tenant_id,
+        tenant_id=tenant_id,
+        start_date='2020-10-01T01:00:00Z',
+        end_date='2020-10-01T02:00:00Z',
+    )
+
+    assert sorted(item['id'] for item in result) == expected_ids
+
+
+def test_query_items_supports_order_offset_and_limit(container, tenant_id):
+    create_items(container, tenant_id, 10)
+
+    result = query(
+        container,
+        'SELECT * FROM c ORDER BY c.hours DESC OFFSET @offset LIMIT @limit',
+        tenant_id,
+        offset=2,
+        limit=3,
+    )
+
+    assert [item['hours'] for item in result] == [7, 6, 5]
+
+
+def test_query_items_supports_aggregates_and_projections(
+    container, tenant_id: str
+):
+    create_items(container, tenant_id, 4)
+
+    assert query(container, 'SELECT VALUE COUNT(1) FROM c', tenant_id) == [4]
+    assert query(container, 'SELECT VALUE MAX(c.hours) FROM c', tenant_id) == [
+        3
+    ]
+    assert query(
+        container,
+        'SELECT c.id, c.hours AS h FROM c WHERE c.hours = 1',
+        tenant_id,
+    ) == [{'id': 'item-001', 'h': 1}]
+
+
+def test_query_items_only_reads_the_given_partition(
+    container, tenant_id: str, another_tenant_id: str
+):
+    create_items(container, tenant_id, 3)
+    create_items(container, another_tenant_id, 2)
+
+    assert query(container, 'SELECT VALUE COUNT(1) FROM c', tenant_id) == [3]
+    assert query(
+        container, 'SELECT VALUE COUNT(1) FROM c', another_tenant_id
+    ) == [2]
+
+
+def test_query_items_pages_with_continuation_tokens(container, tenant_id):
+    create_items(container, tenant_id, 5)
+    charges = []
+
+    pages = container.query_items(
+        query='SELECT * FROM c ORDER BY c.hours',
+        partition_key=tenant_id,
+        max_item_count=2,
+        response_hook=lambda headers, _: charges.append(
+            float(headers['x-ms-request-charge'])
+        ),
+    ).by_page()
+    first_page = list(next(pages))
+
+    remaining_pages = container.query_items(
+        query='SELECT * FROM c ORDER BY c.hours',
+        partition_key=tenant_id,
+        max_item_count=2,
+    ).by_page(pages.continuation_token)
+
+    assert [item['hours'] for item in first_page] == [0, 1]
+    assert [item['hours'] for item in next(remaining_pages)] == [2, 3]
+    assert [item['hours'] for item in next(remaining_pages)] == [4]
+    assert remaining_pages.continuation_token is None
+    assert len(charges) == 1 and charges[0] > 0
+
+
+def test_execute_item_batch_is_all_or_nothing(container, tenant_id: str):
+    existing_item = container.create_item(
+        body={'id': 'existing', 'tenant_id': tenant_id, 'owner_id': '1'}
+    )
+    new_item = {'id': 'new', 'tenant_id': tenant_id, 'owner_id': '2'}
+
+    with pytest.raises(CosmosBatchOperationError) as e:
+        container.execute_item_batch(
+            [
+                ('create', (new_item,)),
+                ('delete', ('existing',)),
+                ('create', (new_item,)),
+            ],
+            partition_key=tenant_id,
+        )
+
+    assert e.value.error_index == 2
+    assert [r['statusCode'] for r in e.value.operation_responses] == [
+        424,
+        424,
+        409,
+    ]
+    assert query(container, 'SELECT VALUE c.id FROM c', tenant_id) == [
+        'existing'
+    ]
+    assert container.read_item('existing', tenant_id) == existing_item
+
+
+def test_patch_item_only_applies_when_the_filter_predicate_holds(
+    container, tenant_id: str
+):
+    created_item = container.create_item(
+        body={'id': fake.uuid4(), 'tenant_id': tenant_id, 'end_date': None}
+    )
+    operations = [
+        {'op': 'set', 'path': '/end_date', 'value': '2020-10-01'},
+        {'op': 'remove', 'path': '/end_date'},
+        {'op': 'add', 'path': '/tags', 'value': ['a']},
+    ]
+
+    patched_item = container.patch_item(
+        created_item['id'],
+        tenant_id,
+        operations,
+        filter_predicate='FROM c WHERE c.end_date = null',
+    )
+
+    assert 'end_date' not in patched_item
+    assert patched_item['tags'] == ['a']
+    assert patched_item['_etag'] != created_item['_etag']
+    with pytest.raises(CosmosAccessConditionFailedError):
+        container.patch_item(
+            created_item['id'],
+            tenant_id,
+            operations,
+            filter_predicate='FROM c WHERE c.end_date = null',
+        )
+    with pytest.raises(CosmosHttpResponseError):
+        container.patch_item(
+            created_item['id'],
+            tenant_id,
+            [{'op': 'replace', 'path': '/missing', 'value': 1}],
+        )
+    assert container.read_item(created_item['id'], tenant_id) == patched_item
+
+
+def test_repository_works_on_top_of_in_memory_cosmos_db(
+    in_memory_cosmos_helper: CosmosDBFacade, tenant_id: str, owner_id: str
+):
+    repository = CosmosDBRepository.from_definition(
+        container_definition, custom_cosmos_helper=in_memory_cosmos_helper
+    )
+    event_context = EventContext(
+        'test', 'any', user_id=owner_id, tenant_id=tenant_id
+    )
+
+    created_item = repository.create({'owner_id': owner_id}, event_context)
+    repository.delete(created_item['id'], event_context)
+
+    assert repository.find_all(event_context) == []
+    assert len(repository.find_all(event_context, visible_only=False)) == 1
+    with pytest.raises(CosmosResourceNotFoundError):
+        repository.find(created_item['id'], event_context)
+
+
+def test_query_items_uses_the_composite_indexes_for_ranges(tenant_id: str):
+    helper = CosmosDBFacade(InMemoryCosmosClient(), 'test')
+    helper.create_container(
+        dict(
+            container_definition,
+            unique_key_policy={'uniqueKeys': []},
+            indexing_policy={
+                'compositeIndexes': [
+                    [{'path': '/owner_id'}, {'path': '/hours'}],
+                ]
+            },
+        )
+    )
+    container = helper.db.get_container_client(container_definition['id'])
+    owner_id = fake.uuid4()
+    for i in range(50):
+        container.create_item(
+            body={
+                'id': 'item-%03d' % i,
+                'tenant_id': tenant_id,
+                'owner_id': owner_id,
+                'hours': i,
+            }
+        )
+    container.replace_item(
+        'item-010',
+        body={
+            'id': 'item-010',
+            'tenant_id': tenant_id,
+            'owner_id': owner_id,
+            'hours': 100,
+        },
+    )
+    charges = []
+
+    result = container.query_items(
+        query='SELECT * FROM c WHERE c.owner_id = @owner_id '
+        'AND @low < c.hours AND c.hours <= @high',
+        parameters=[
+            {'name': '@owner_id', 'value': owner_id},
+            {'name': '@low', 'value': 8},
+            {'name': '@high', 'value': 11},
+        ],
+        partition_key=tenant_id,
+        response_hook=lambda headers, _: charges.append(
+            float(headers['x-ms-request-charge'])
+        ),
+    )
+
+    assert sorted(item['id'] for item in result) == ['item-009', 'item-011']
+    assert charges == [2.3 + 0.25 * 2]
@@ -1,6 +1,14 @@
-from commons.feature_toggles.feature_toggle_manager import FeatureToggleManager
+import json
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
+from commons.feature_toggles.feature_toggle_manager import (
+    FeatureFlagStore,
+    FeatureToggleManager,
+)
+from faker import Faker
 from unittest.mock import Mock, patch
-from pytest import mark
+from pytest import mark, raises
 
 
 def mock_feature_toggle_config_response(enabled, user):
@@ -63,3 +71,116 @@ def test_if_is_toggle_enabled_for_user(
     assert (
         feature_toggle_manager.is_toggle_enabled_for_user() == expected_result
     )
+
+
+def mock_feature_flag_setting(key, enabled, user, etag='1'):
+    return Mock(
+        key='.appconfig.featureflag/%s' % key,
+        label=None,
+        etag=etag,
+        value=json.dumps(mock_feature_toggle_config_response(enabled, user)),
+    )
+
+
+@patch(
+    'azure.appconfiguration.AzureAppConfigurationClient.from_connection_string'
+)
+@patch('commons.feature_toggles.feature_toggle_manager.current_user_email')
+def test_feature_toggles_are_evaluated_from_a_single_listing(
+    current_user_email_mock, from_connection_string_mock
+):
+    client_mock = from_connection_string_mock.return_value
+    client_mock.list_configuration_settings.return_value = [
+        mock_feature_flag_setting('first', True, 'testUser@ioet.com'),
+        mock_feature_flag_setting('second', False, 'testUser@ioet.com'),
+    ]
+    current_user_email_mock.return_value = 'testUser@ioet.com'
+    config = Mock(AZURE_APP_CONFIGURATION_CONNECTION_STRING=Faker().uuid4())
+
+    assert FeatureToggleManager(
+        'first', config=config
+    ).is_toggle_enabled_for_user()
+    assert not FeatureToggleManager(
+        'second', config=config
+    ).is_toggle_enabled_for_user()
+
+    client_mock.list_configuration_settings.assert_called_once()
+    client_mock.get_configuration_setting.assert_not_called()
+
+
+@patch(
+    'azure.appconfiguration.AzureAppConfigurationClient.from_connection_string'
+)
+def test_feature_flag_store_refreshes_only_the_modified_flags(
+    from_connection_string_mock,
+):
+    client_mock = from_connection_string_mock.return_value
+    client_mock.list_configuration_settings.return_value = [
+        mock_feature_flag_setting('first', False, 'testUser@ioet.com'),
+        mock_feature_flag_setting('second', False, 'testUser@ioet.com'),
+    ]
+    client_mock.get_configuration_setting.side_effect = [
+        mock_feature_flag_setting('first', True, 'testUser@ioet.com', '2'),
+        None,
+    ]
+    store = FeatureFlagStore(Faker().uuid4(), refresh_interval=3600)
+    assert not store.get_data('first')['enabled']
+
+    store.refresh()
+
+    assert store.get_data('first')['enabled']
+    assert not store.get_data('second')['enabled']
+    assert (
+        client_mock.get_configuration_setting.call_args_list[0][1][
+            'match_condition'
+        ]
+        == MatchConditions.IfModified
+    )
+
+
+@patch(
+    'azure.appconfiguration.AzureAppConfigurationClient.from_connection_string'
+)
+def test_feature_flag_store_does_not_ask_again_for_missing_flags(
+    from_connection_string_mock,
+):
+    client_mock = from_connection_string_mock.return_value
+    client_mock.list_configuration_settings.return_value = []
+    client_mock.get_configuration_setting.side_effect = ResourceNotFoundError(
+        'Not found'
+    )
+    now = [0]
+    store = FeatureFlagStore(
+        Faker().uuid4(),
+        refresh_interval=3600,
+        missing_ttl=60,
+        clock=lambda: now[0],
+    )
+
+    for _ in range(2):
+        with raises(ResourceNotFoundError):
+            store.get_data('missing')
+    assert client_mock.get_configuration_setting.call_count == 1
+
+    now[0] = 60
+    with raises(ResourceNotFoundError):
+        store.get_data('missing')
+    assert client_mock.get_configuration_setting.call_count == 2
+
+
+@patch(
+    'commons.feature_toggles.feature_toggle_manager.FeatureToggleManager.get_data_configuration',
+    new_callable=Mock,
+)
+def test_feature_toggle_manager_uses_the_given_data_even_if_empty(
+    get_data_configuration_mock,
+):
+    feature_toggle_manager = FeatureToggleManager(
+        "test-feature-toggle",
+        config=Mock(AZURE_APP_CONFIGURATION_CONNECTION_STRING=Faker().uuid4()),
+    )
+
+    with raises(KeyError):
+        feature_toggle_manager.is_toggle_enabled({})
+
+    get_data_configuration_mock.assert_not_called()
@@ -1,3 +1,4 @@
+from flask_restplus._http import HTTPStatus
 from flask_restplus.reqparse import RequestParser
 from pytest import fail
 
@@ -43,3 +44,32 @@ def test_remove_required_constraint():
     for attrib in sample_model:
         assert new_model[attrib].required is False, "No attribute should be required"
         assert new_model[attrib] is not sample_model[attrib], "No attribute should be required"
+
+
+def test_request_totals_are_sent_in_the_response_headers(
+    client, valid_header: dict, time_entries_dao, mocker
+):
+    from commons.data_access_layer import cosmos_db_metrics
+    from commons.data_access_layer.cosmos_db_metrics import (
+        CosmosDBCallRecord,
+    )
+
+    def find_running(*args, **kwargs):
+        cosmos_db_metrics.notify(
+            CosmosDBCallRecord('time_entry', 'query_items', 2.5, 3.0)
+        )
+        raise StopIteration
+
+    mocker.patch.object(
+        time_entries_dao.repository, 'find_running', side_effect=find_running
+    )
+    cosmos_db_metrics.endpoint_metrics.clear()
+
+    response = client.get('/time-entries/running', headers=valid_header)
+
+    assert HTTPStatus.NOT_FOUND == response.status_code
+    assert response.headers['X-Request-Charge'] == '2.50'
+    assert 'cosmosdb;dur=3.0' in response.headers['Server-Timing']
+    assert cosmos_db_metrics.endpoint_metrics.snapshot()[0]['endpoint'] == (
+        'GET /time-entries/running'
+    )
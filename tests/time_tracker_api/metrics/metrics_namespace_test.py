@@ -0,0 +1,77 @@
+from unittest.mock import patch
+
+from flask import json
+from flask.testing import FlaskClient
+from flask_restplus._http import HTTPStatus
+
+from commons.data_access_layer.cosmos_db_cache import get_cache
+from commons.data_access_layer.cosmos_db_metrics import (
+    CallTotals,
+    CosmosDBCallRecord,
+    endpoint_metrics,
+)
+from time_tracker_api.security import roles
+
+
+@patch(
+    'time_tracker_api.metrics.metrics_namespace.current_role_user',
+    return_value=roles['admin']['name'],
+)
+def test_admins_can_read_the_cosmos_db_metrics_of_the_endpoints(
+    current_role_user_mock, client: FlaskClient, valid_header: dict
+):
+    endpoint_metrics.clear()
+    totals = CallTotals()
+    totals.add(CosmosDBCallRecord('time_entry', 'query_items', 12.5, 3.0))
+    endpoint_metrics.add('GET /time-entries', totals)
+
+    response = client.get('/metrics/cosmos-db', headers=valid_header)
+
+    assert HTTPStatus.OK == response.status_code
+    [metrics] = [
+        m
+        for m in json.loads(response.data)
+        if m['endpoint'] == 'GET /time-entries'
+    ]
+    assert metrics['requests'] == 1
+    assert metrics['calls'] == 1
+    assert metrics['request_charge'] == 12.5
+
+
+def test_other_users_cannot_read_the_metrics(
+    client: FlaskClient, valid_header: dict
+):
+    response = client.get('/metrics/cosmos-db', headers=valid_header)
+
+    assert HTTPStatus.FORBIDDEN == response.status_code
+
+
+@patch(
+    'time_tracker_api.metrics.metrics_namespace.current_role_user',
+    return_value=roles['admin']['name'],
+)
+def test_admins_can_read_the_hits_and_misses_of_the_caches(
+    current_role_user_mock, client: FlaskClient, valid_header: dict
+):
+    cache = get_cache('metrics_test')
+    cache.get_or_load('tenant', 'all', lambda: [])
+    cache.get_or_load('tenant', 'all', lambda: [])
+
+    response = client.get('/metrics/cache', headers=valid_header)
+
+    assert HTTPStatus.OK == response.status_code
+    [metrics] = [
+        m
+        for m in json.loads(response.data)
+        if m['container'] == 'metrics_test'
+    ]
+    assert metrics['hits'] >= 1
+    assert metrics['misses'] >= 1
+
+
+def test_other_users_cannot_read_the_cache_metrics(
+    client: FlaskClient, valid_header: dict
+):
+    response = client.get('/metrics/cache', headers=valid_header)
+
+    assert HTTPStatus.FORBIDDEN == response.status_code
@@ -1,6 +1,31 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from typing import List, Tuple
+from unittest.mock import Mock, patch
+
+import jwt
 import pytest
+import requests
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt import InvalidTokenError
+from jwt.algorithms import RSAAlgorithm
+from werkzeug.exceptions import HTTPException
 
-from time_tracker_api.security import parse_jwt, parse_tenant_id_from_iss_claim
+from time_tracker_api.security import (
+    JWKS_MIN_REFRESH_INTERVAL,
+    JWKS_TTL,
+    JwksClient,
+    JwtVerifier,
+    current_role_user,
+    current_user_id,
+    current_user_tenant_id,
+    parse_jwt,
+    parse_tenant_id_from_iss_claim,
+    roles,
+)
 
 
 def test_parse_jwt_with_valid_input(valid_jwt: str):
@@ -37,3 +62,179 @@ def test_parse_tenant_id_from_iss_claim_with_invalid_input():
     result2 = parse_tenant_id_from_iss_claim(invalid_iss_claim2)
 
     assert result1 == result2 == None
+
+
+def test_token_claims_are_decoded_once_per_request(
+    app, valid_header: dict, tenant_id: str, owner_id: str
+):
+    with patch(
+        'time_tracker_api.security.parse_jwt', wraps=parse_jwt
+    ) as parse_jwt_mock:
+        with app.test_request_context(headers=valid_header):
+            assert current_user_id() == owner_id
+            assert current_user_tenant_id() == tenant_id
+            assert current_role_user() == roles['client']['name']
+
+    parse_jwt_mock.assert_called_once()
+
+
+def create_signing_key(kid: str) -> Tuple[object, dict]:
+    private_key = rsa.generate_private_key(
+        public_exponent=65537, key_size=2048, backend=default_backend()
+    )
+    jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({'kid': kid, 'kty': 'RSA', 'use': 'sig'})
+    return private_key, jwk
+
+
+def create_get_mock(*jwks: List[dict]) -> Mock:
+    responses = {
+        'https://issuer/.well-known/openid-configuration': Mock(
+            json=Mock(return_value={'jwks_uri': 'https://issuer/keys'})
+        ),
+        'https://issuer/keys': Mock(
+            json=Mock(side_effect=[{'keys': keys} for keys in jwks])
+        ),
+    }
+    return Mock(side_effect=lambda url, **kwargs: responses[url])
+
+
+def create_token(
+    private_key, kid: str, audience: str = 'time-tracker', oid: str = 'OID'
+):
+    return jwt.encode(
+        {
+            'oid': oid,
+            'aud': audience,
+            'exp': datetime.utcnow() + timedelta(seconds=3600),
+        },
+        key=private_key,
+        algorithm='RS256',
+        headers={'kid': kid},
+    ).decode('UTF-8')
+
+
+def test_jwt_verifier_verifies_each_token_once_with_the_cached_keys():
+    private_key, jwk = create_signing_key('KEY1')
+    get_mock = create_get_mock([jwk])
+    verifier = JwtVerifier(
+        JwksClient(
+            'https://issuer/.well-known/openid-configuration', get=get_mock
+        ),
+        audience='time-tracker',
+    )
+    token = create_token(private_key, 'KEY1')
+
+    with patch(
+        'time_tracker_api.security.jwt.decode', wraps=jwt.decode
+    ) as decode_mock:
+        assert verifier.verify(token)['oid'] == 'OID'
+        assert verifier.verify(token)['oid'] == 'OID'
+        verifier.verify(create_token(private_key, 'KEY1', oid='OID2'))
+
+    assert decode_mock.call_count == 2
+    assert get_mock.call_count == 2
+
+
+def test_jwt_verifier_rejects_invalid_tokens():
+    private_key, jwk = create_signing_key('KEY1')
+    another_private_key, _ = create_signing_key('KEY1')
+    verifier = JwtVerifier(
+        JwksClient(
+            'https://issuer/.well-known/openid-configuration',
+            get=create_get_mock([jwk]),
+        ),
+        audience='time-tracker',
+    )
+
+    with pytest.raises(InvalidTokenError):
+        verifier.verify(create_token(another_private_key, 'KEY1'))
+    with pytest.raises(InvalidTokenError):
+        verifier.verify(create_token(private_key, 'KEY1', audience='other'))
+    with pytest.raises(InvalidTokenError):
+        verifier.verify(create_token(private_key, 'UNKNOWN'))
+
+
+def test_jwks_client_fetches_the_keys_again_for_an_unknown_kid():
+    _, old_jwk = create_signing_key('OLD')
+    _, new_jwk = create_signing_key('NEW')
+    now = [0]
+    jwks_client = JwksClient(
+        'https://issuer/.well-known/openid-configuration',
+        get=create_get_mock([old_jwk], [old_jwk, new_jwk]),
+        clock=lambda: now[0],
+    )
+    assert jwks_client.get_signing_key('OLD') is not None
+
+    now[0] = JWKS_MIN_REFRESH_INTERVAL
+
+    assert jwks_client.get_signing_key('NEW') is not None
+
+
+def test_jwks_client_keeps_the_last_known_keys_if_the_fetch_fails():
+    _, jwk = create_signing_key('KEY1')
+    get_mock = create_get_mock([jwk])
+    now = [0]
+    jwks_client = JwksClient(
+        'https://issuer/.well-known/openid-configuration',
+        ttl=JWKS_MIN_REFRESH_INTERVAL,
+        get=get_mock,
+        clock=lambda: now[0],
+    )
+    key = jwks_client.get_signing_key('KEY1')
+
+    now[0] = JWKS_MIN_REFRESH_INTERVAL
+    get_mock.side_effect = requests.ConnectionError('Unreachable')
+
+    assert jwks_client.get_signing_key('KEY1') is key
+    assert jwks_client.get_signing_key('KEY1') is key
+    assert get_mock.call_count == 3
+
+
+def test_jwks_client_does_not_make_the_requests_wait_for_a_fetch():
+    _, jwk = create_signing_key('KEY1')
+    get_mock = create_get_mock([jwk], [jwk])
+    jwks_client = JwksClient(
+        'https://issuer/.well-known/openid-configuration', get=get_mock
+    )
+    key = jwks_client.get_signing_key('KEY1')
+    fetching, release = threading.Event(), threading.Event()
+
+    def slow_get(url, **kwargs):
+        fetching.set()
+        release.wait(1)
+        raise requests.Timeout('Too slow')
+
+    get_mock.side_effect = slow_get
+    jwks_client.fetched_at = -JWKS_TTL
+    fetch = threading.Thread(
+        target=jwks_client.get_signing_key, args=('KEY1',)
+    )
+    fetch.start()
+    fetching.wait(1)
+
+    try:
+        assert jwks_client.get_signing_key('KEY1') is key
+    finally:
+        release.set()
+        fetch.join()
+
+
+def test_tokens_that_cannot_be_verified_are_unauthorized(app):
+    private_key, _ = create_signing_key('KEY1')
+    jwks_client = JwksClient(
+        'https://issuer/.well-known/openid-configuration',
+        get=Mock(side_effect=requests.ConnectionError('Unreachable')),
+    )
+    token = create_token(private_key, 'KEY1')
+
+    with patch(
+        'time_tracker_api.security.jwt_verifier', JwtVerifier(jwks_client)
+    ):
+        with app.test_request_context(
+            headers={'Authorization': 'Bearer %s' % token}
+        ):
+            with pytest.raises(HTTPException) as e:
+                current_user_id()
+
+    assert e.value.code == HTTPStatus.UNAUTHORIZED
@@ -19,7 +19,7 @@ def test_app_exists(app):
 def test_exceptions_are_handled(error_type, client: FlaskClient, mocker: MockFixture):
     from time_tracker_api.time_entries.time_entries_namespace import time_entries_dao
     mocker.patch.object(time_entries_dao,
-                        "get_all",
+                        "iter_all",
                         side_effect=error_type)
 
     response = client.get('/time-entries', follow_redirects=True)
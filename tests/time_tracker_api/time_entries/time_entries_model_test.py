@@ -1,14 +1,20 @@
-from unittest.mock import Mock, patch
+from http import HTTPStatus
+from unittest.mock import AsyncMock, Mock, patch
 import pytest
 from faker import Faker
 
+from commons.data_access_layer.cosmos_db import CustomError
+from commons.data_access_layer.cosmos_db_aio import run_async
+from commons.data_access_layer.cosmos_db_cache import get_cache
 from commons.data_access_layer.database import EventContext
 from time_tracker_api.time_entries.time_entries_model import (
     TimeEntryCosmosDBModel,
 )
 from time_tracker_api.time_entries.time_entries_repository import (
+    AsyncTimeEntryCosmosDBRepository,
     TimeEntryCosmosDBRepository,
 )
+from utils.azure_users import AzureUser
 
 
 def create_time_entry(
@@ -68,6 +74,12 @@ def create_time_entry(
             "2020-10-01T06:00:00.000Z",
             "2020-10-01T07:00:00.000Z",
         ),
+        (
+            "2020-10-01T05:00:00.000Z",
+            "2020-10-01T10:00:00.000Z",
+            "2020-10-01T01:00:00.000-05:00",
+            "2020-10-01T02:00:00.000-05:00",
+        ),
     ],
 )
 def test_find_interception_with_date_range_should_find(
@@ -165,6 +177,33 @@ def test_find_interception_with_date_range_should_not_find(
         )
 
 
+def test_find_interception_with_date_range_should_find_the_running_entry(
+    owner_id: str,
+    time_entry_repository: TimeEntryCosmosDBRepository,
+):
+    tenant_id = Faker().uuid4()
+    event_context = EventContext(
+        "time_entry", "any", user_id=owner_id, tenant_id=tenant_id
+    )
+    running_item = create_time_entry(
+        "2020-10-01T05:00:00.000Z",
+        None,
+        owner_id,
+        tenant_id,
+        event_context,
+        time_entry_repository,
+    )
+
+    result = time_entry_repository.find_interception_with_date_range(
+        "2020-10-02T05:00:00.000Z",
+        "2020-10-02T06:00:00.000Z",
+        owner_id,
+        tenant_id,
+    )
+
+    assert [item.id for item in result] == [running_item.id]
+
+
 def test_find_interception_should_ignore_id_of_existing_item(
     owner_id: str,
     tenant_id: str,
@@ -266,3 +305,410 @@ def test_updated_item_without_deleted_key_should_call_validate_data(
     time_entry_repository.on_update({}, event_context)
     on_update_mock.assert_called_once()
     time_entry_repository.validate_data.assert_called_once()
+
+
+def test_add_complementary_info_fetches_the_lookups_in_the_request(
+    app,
+    owner_id: str,
+    tenant_id: str,
+    valid_header: dict,
+    time_entry_repository: TimeEntryCosmosDBRepository,
+    mocker,
+):
+    from time_tracker_api.activities import activities_model
+    from time_tracker_api.customers import customers_model
+    from time_tracker_api.projects import projects_model
+
+    event_context = EventContext(
+        "time_entry", "any", user_id=owner_id, tenant_id=tenant_id
+    )
+    customer = customers_model.create_dao().repository.create(
+        {"name": Faker().company()}, event_context
+    )
+    project = projects_model.create_dao().repository.create(
+        {"name": Faker().bs(), "customer_id": customer.id}, event_context
+    )
+    activity = activities_model.create_dao().repository.create(
+        {"name": Faker().job()}, event_context
+    )
+    time_entries = [
+        TimeEntryCosmosDBModel(
+            {
+                "id": Faker().uuid4(),
+                "project_id": project.id,
+                "activity_id": activity.id,
+                "owner_id": owner_id,
+                "start_date": "2020-10-03T05:00:00.000Z",
+            }
+        )
+    ]
+    azure_directory_mock = mocker.patch(
+        'time_tracker_api.time_entries.time_entries_repository'
+        '.azure_directory'
+    )
+    azure_directory_mock.users_by_ids.return_value = [
+        AzureUser(owner_id, 'Owner', 'owner@ioet.com', [])
+    ]
+
+    with app.test_request_context(headers=valid_header):
+        time_entry_repository.add_complementary_info(time_entries)
+
+    assert time_entries[0].project_name == project.name
+    assert time_entries[0].customer_name == customer.name
+    assert time_entries[0].activity_name == activity.name
+    assert time_entries[0].owner_email == 'owner@ioet.com'
+
+
+def test_iter_pages_completes_pages_with_more_customers_than_entries(
+    app,
+    owner_id: str,
+    tenant_id: str,
+    valid_header: dict,
+    time_entry_repository: TimeEntryCosmosDBRepository,
+    mocker,
+):
+    from time_tracker_api.customers import customers_model
+    from time_tracker_api.projects import projects_model
+
+    event_context = EventContext(
+        "time_entry", "any", user_id=owner_id, tenant_id=tenant_id
+    )
+    projects = []
+    for _ in range(3):
+        customer = customers_model.create_dao().repository.create(
+            {"name": Faker().company()}, event_context
+        )
+        projects.append(
+            projects_model.create_dao().repository.create(
+                {"name": Faker().bs(), "customer_id": customer.id},
+                event_context,
+            )
+        )
+    project_ids = {project.id for project in projects}
+    for day, project in enumerate(projects, start=1):
+        time_entry_repository.create(
+            {
+                "project_id": project.id,
+                "owner_id": owner_id,
+                "start_date": "2019-03-0%dT10:00:00Z" % day,
+                "end_date": "2019-03-0%dT11:00:00Z" % day,
+            },
+            event_context,
+        )
+    mocker.patch(
+        'time_tracker_api.time_entries.time_entries_repository'
+        '.azure_directory'
+    ).users_by_ids.return_value = []
+    project_cache = get_cache('project')
+    project_misses = project_cache.misses
+
+    with app.test_request_context(headers=valid_header):
+        pages = list(
+            time_entry_repository.iter_pages(
+                event_context,
+                conditions={"owner_id": owner_id},
+                date_range={
+                    "start_date": "2019-03-01T00:00:00Z",
+                    "end_date": "2019-03-31T23:59:59Z",
+                },
+                page_size=1,
+            )
+        )
+
+    time_entries = [
+        time_entry
+        for page in pages
+        for time_entry in page
+        if time_entry.project_id in project_ids
+    ]
+    assert len(time_entries) == 3
+    assert all(time_entry.project_name for time_entry in time_entries)
+    assert all(time_entry.customer_name for time_entry in time_entries)
+    assert project_cache.misses - project_misses <= 1
+
+
+def test_backfill_timestamps_makes_the_old_entries_visible_to_the_filters(
+    owner_id: str,
+    time_entry_repository: TimeEntryCosmosDBRepository,
+):
+    tenant_id = Faker().uuid4()
+    event_context = EventContext(
+        "time_entry", "any", user_id=owner_id, tenant_id=tenant_id
+    )
+    old_time_entry = time_entry_repository.container.create_item(
+        body={
+            "id": Faker().uuid4(),
+            "project_id": Faker().uuid4(),
+            "owner_id": owner_id,
+            "tenant_id": tenant_id,
+            "start_date": "2020-10-01T01:00:00-05:00",
+            "end_date": "2020-10-01T02:00:00-05:00",
+        }
+    )
+    date_range = {
+        "start_date": "2020-10-01T05:30:00Z",
+        "end_date": "2020-10-01T06:30:00Z",
+    }
+
+    assert (
+        time_entry_repository.find_all_entries(
+            event_context, date_range=dict(date_range)
+        )
+        == []
+    )
+    assert time_entry_repository.backfill_timestamps() >= 1
+
+    time_entries = time_entry_repository.find_all_entries(
+        event_context, date_range=dict(date_range)
+    )
+    assert [t.id for t in time_entries] == [old_time_entry['id']]
+    assert time_entry_repository.backfill_timestamps() == 0
+
+
+def test_find_all_entries_uses_the_dates_until_timestamps_are_enabled(
+    owner_id: str,
+    time_entry_repository: TimeEntryCosmosDBRepository,
+    mocker,
+):
+    mocker.patch(
+        'time_tracker_api.time_entries.time_entries_repository'
+        '.timestamps_enabled',
+        False,
+    )
+    tenant_id = Faker().uuid4()
+    event_context = EventContext(
+        "time_entry", "any", user_id=owner_id, tenant_id=tenant_id
+    )
+    old_time_entry = time_entry_repository.container.create_item(
+        body={
+            "id": Faker().uuid4(),
+            "project_id": Faker().uuid4(),
+            "owner_id": owner_id,
+            "tenant_id": tenant_id,
+            "start_date": "2020-10-01T06:00:00Z",
+            "end_date": "2020-10-01T07:00:00Z",
+        }
+    )
+
+    time_entries = time_entry_repository.find_all_entries(
+        event_context,
+        date_range={
+            "start_date": "2020-10-01T05:30:00Z",
+            "end_date": "2020-10-01T06:30:00Z",
+        },
+    )
+
+    assert [t.id for t in time_entries] == [old_time_entry['id']]
+    assert "c.start_date DESC" in (
+        time_entry_repository.create_sql_order_clause()
+    )
+
+
+def test_backfill_timestamps_fixes_the_timestamps_of_the_changed_dates(
+    owner_id: str,
+    time_entry_repository: TimeEntryCosmosDBRepository,
+):
+    tenant_id = Faker().uuid4()
+    event_context = EventContext(
+        "time_entry", "any", user_id=owner_id, tenant_id=tenant_id
+    )
+    time_entry = time_entry_repository.create(
+        {
+            "project_id": Faker().uuid4(),
+            "owner_id": owner_id,
+            "tenant_id": tenant_id,
+            "start_date": "2020-11-01T01:00:00Z",
+            "end_date": "2020-11-01T02:00:00Z",
+        },
+        event_context,
+    )
+    time_entry_repository.container.upsert_item(
+        body={
+            **time_entry_repository.container.read_item(
+                time_entry.id, partition_key=tenant_id
+            ),
+            "start_date": "2020-11-02T01:00:00Z",
+            "end_date": "2020-11-02T02:00:00Z",
+        }
+    )
+    date_range = {
+        "start_date": "2020-11-02T00:00:00Z",
+        "end_date": "2020-11-02T03:00:00Z",
+    }
+
+    assert time_entry_repository.backfill_timestamps() >= 1
+
+    time_entries = time_entry_repository.find_all_entries(
+        event_context, date_range=dict(date_range)
+    )
+    assert [t.id for t in time_entries] == [time_entry.id]
+
+
+def test_bulk_created_entries_are_visible_to_the_filters(
+    owner_id: str,
+    time_entry_repository: TimeEntryCosmosDBRepository,
+):
+    tenant_id = Faker().uuid4()
+    event_context = EventContext(
+        "time_entry", "any", user_id=owner_id, tenant_id=tenant_id
+    )
+    results = time_entry_repository.bulk_create(
+        [
+            {
+                "project_id": Faker().uuid4(),
+                "owner_id": owner_id,
+                "start_date": "2020-12-01T01:00:00-05:00",
+                "end_date": "2020-12-01T02:00:00-05:00",
+            },
+            {
+                "project_id": Faker().uuid4(),
+                "owner_id": owner_id,
+                "start_date": "2020-12-01T03:00:00-05:00",
+            },
+        ],
+        event_context,
+    )
+
+    time_entries = time_entry_repository.find_all_entries(
+        event_context,
+        date_range={
+            "start_date": "2020-12-01T06:30:00Z",
+            "end_date": "2020-12-01T08:30:00Z",
+        },
+    )
+    assert [t.id for t in time_entries] == [
+        results[1].id,
+        results[0].id,
+    ]
+
+
+def test_get_lastest_entries_by_project_queries_the_entries_once(
+    app,
+    valid_header: dict,
+    time_entries_dao,
+    mocker,
+):
+    from time_tracker_api.projects.projects_model import ProjectCosmosDBModel
+
+    projects = [
+        ProjectCosmosDBModel(
+            {'id': project_id, 'name': project_id, 'customer_id': 'c1'}
+        )
+        for project_id in ['p1', 'p2', 'p3']
+    ]
+    for project in projects:
+        project.customer_name = 'Ioet'
+    time_entries = [
+        TimeEntryCosmosDBModel({'id': id, 'project_id': project_id})
+        for id, project_id in [
+            ('latest-of-p2', 'p2'),
+            ('latest-of-p1', 'p1'),
+            ('older-of-p2', 'p2'),
+            ('of-a-deleted-project', 'p4'),
+        ]
+    ]
+    async_repository = time_entries_dao.async_repository
+    mocker.patch.object(
+        async_repository, 'find_projects', AsyncMock(return_value=projects)
+    )
+    mocker.patch.object(
+        async_repository.activity_repository,
+        'find_all',
+        AsyncMock(return_value=[]),
+    )
+    find_all_entries_mock = mocker.patch.object(
+        async_repository,
+        'find_all_entries',
+        AsyncMock(return_value=time_entries),
+    )
+
+    with app.test_request_context(headers=valid_header):
+        result = time_entries_dao.get_lastest_entries_by_project(conditions={})
+
+    find_all_entries_mock.assert_awaited_once()
+    assert [time_entry.id for time_entry in result] == [
+        'latest-of-p1',
+        'latest-of-p2',
+    ]
+    assert result[0].project_name == 'p1'
+
+
+def test_async_create_with_an_interception_should_raise_422(
+    owner_id: str,
+    time_entry_repository: TimeEntryCosmosDBRepository,
+):
+    event_context = EventContext(
+        "time_entry", "any", user_id=owner_id, tenant_id=Faker().uuid4()
+    )
+    create_time_entry(
+        "2020-10-01T05:00:00.000Z",
+        "2020-10-01T10:00:00.000Z",
+        owner_id,
+        event_context.tenant_id,
+        event_context,
+        time_entry_repository,
+    )
+    async_repository = AsyncTimeEntryCosmosDBRepository(time_entry_repository)
+
+    with pytest.raises(CustomError) as custom_error:
+        run_async(
+            async_repository.create(
+                {
+                    "project_id": Faker().uuid4(),
+                    "owner_id": owner_id,
+                    "start_date": "2020-10-01T07:00:00.000Z",
+                    "end_date": "2020-10-01T12:00:00.000Z",
+                },
+                event_context,
+            )
+        )
+
+    assert custom_error.value.code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_get_lastest_entries_by_project_awaits_the_lookups_of_the_tenant(
+    app,
+    owner_id: str,
+    tenant_id: str,
+    valid_header: dict,
+    time_entries_dao,
+):
+    async_repository = time_entries_dao.async_repository
+    event_context = EventContext(
+        "time_entry", "any", user_id=owner_id, tenant_id=tenant_id
+    )
+    customer = async_repository.customer_repository.repository.create(
+        {"name": "Ioet"}, event_context
+    )
+    project = async_repository.project_repository.repository.create(
+        {"name": "Time tracker", "customer_id": customer.id}, event_context
+    )
+    activity = async_repository.activity_repository.repository.create(
+        {"name": "Development"}, event_context
+    )
+    for start_date, end_date in [
+        ("2011-03-01T05:00:00.000Z", "2011-03-01T06:00:00.000Z"),
+        ("2011-03-02T05:00:00.000Z", "2011-03-02T06:00:00.000Z"),
+    ]:
+        time_entries_dao.repository.create(
+            {
+                "project_id": project.id,
+                "activity_id": activity.id,
+                "owner_id": owner_id,
+                "start_date": start_date,
+                "end_date": end_date,
+            },
+            event_context,
+        )
+
+    with app.test_request_context(headers=valid_header):
+        result = time_entries_dao.get_lastest_entries_by_project(
+            conditions={"month": "3", "year": "2011"}
+        )
+
+    assert [time_entry.start_date for time_entry in result] == [
+        "2011-03-02T05:00:00.000Z"
+    ]
+    assert result[0].project_name == "Time tracker"
+    assert result[0].customer_name == "Ioet"
+    assert result[0].activity_name == "Development"
@@ -1,6 +1,7 @@
 from datetime import timedelta
 from unittest.mock import ANY, Mock, patch
 
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError
 from faker import Faker
 from flask import json
 from flask.testing import FlaskClient
@@ -19,8 +20,16 @@ from utils import worked_time
 from time_tracker_api.time_entries.time_entries_model import (
     TimeEntryCosmosDBModel,
 )
+from time_tracker_api.time_entries.time_entries_repository import (
+    TimeEntryCosmosDBRepository,
+)
 
-from werkzeug.exceptions import NotFound, UnprocessableEntity, HTTPException
+from werkzeug.exceptions import (
+    Forbidden,
+    HTTPException,
+    NotFound,
+    UnprocessableEntity,
+)
 
 fake = Faker()
 
@@ -143,8 +152,8 @@ def test_list_all_time_entries(
     valid_header: dict,
     time_entries_dao,
 ):
-    dao_get_all_mock = mocker.patch.object(
-        time_entries_dao, 'get_all', return_value=[]
+    dao_iter_all_mock = mocker.patch.object(
+        time_entries_dao, 'iter_all', return_value=iter([])
     )
 
     response = client.get(
@@ -153,7 +162,7 @@ def test_list_all_time_entries(
 
     assert HTTPStatus.OK == response.status_code
     assert [] == json.loads(response.data)
-    dao_get_all_mock.assert_called_once()
+    dao_iter_all_mock.assert_called_once()
 
 
 def test_list_last_time_entries(
@@ -176,22 +185,6 @@ def test_list_last_time_entries(
     dao_get_all_mock.assert_called_once()
 
 
-def test_get_time_entry_should_succeed_with_valid_id(
-    client: FlaskClient, mocker: MockFixture, valid_header: dict
-):
-    dao_get_all_mock = mocker.patch.object(
-        time_entries_dao, 'get_lastest_entries_by_project', return_value=[]
-    )
-
-    response = client.get(
-        "/time-entries/latest", headers=valid_header, follow_redirects=True
-    )
-
-    assert HTTPStatus.OK == response.status_code
-    assert [] == json.loads(response.data)
-    dao_get_all_mock.assert_called_once()
-
-
 @patch(
     'time_tracker_api.time_entries.time_entries_dao.TimeEntriesCosmosDBDao.create_event_context',
     Mock(),
@@ -206,8 +199,8 @@ def test_get_time_entry_should_succeed_with_valid_id(
 )
 @patch('msal.ConfidentialClientApplication', Mock())
 @patch('utils.azure_users.AzureConnection.get_token', Mock())
-@patch('utils.azure_users.AzureConnection.is_test_user')
-@patch('utils.azure_users.AzureConnection.get_test_user_ids')
+@patch('utils.azure_users.AzureDirectory.is_test_user')
+@patch('utils.azure_users.AzureDirectory.get_test_user_ids')
 @pytest.mark.parametrize(
     'current_user_is_tester, expected_user_ids',
     [
@@ -246,9 +239,9 @@ def test_get_time_entries_by_type_of_user(
     )
 
     find_all_mock = Mock()
-    find_all_mock.return_value = [te1, te2]
+    find_all_mock.return_value = iter([te1, te2])
 
-    time_entries_dao.repository.find_all = find_all_mock
+    time_entries_dao.repository.iter_all = find_all_mock
 
     is_test_user_mock.return_value = current_user_is_tester
     get_test_user_ids_mock.return_value = [test_user_id]
@@ -338,7 +331,7 @@ def test_update_time_entry_calls_partial_update_with_incoming_payload(
 
     assert HTTPStatus.OK == response.status_code
     time_entries_dao.repository.partial_update.assert_called_once_with(
-        valid_id, valid_time_entry_input, ANY
+        valid_id, valid_time_entry_input, ANY, current_item={}
     )
 
     time_entries_dao.repository.find.assert_called_once()
@@ -394,7 +387,7 @@ def test_update_time_entry_raise_not_found(
 
     assert HTTPStatus.NOT_FOUND == response.status_code
     time_entries_dao.repository.partial_update.assert_called_once_with(
-        valid_id, valid_time_entry_input, ANY
+        valid_id, valid_time_entry_input, ANY, current_item={}
     )
 
     time_entries_dao.repository.find.assert_called_once()
@@ -409,8 +402,7 @@ def test_delete_time_entry_calls_delete(
     time_entries_dao,
 ):
     time_entries_dao.repository.delete = Mock(return_value=None)
-    time_entries_dao.repository.find = Mock()
-    time_entries_dao.check_whether_current_user_owns_item = Mock()
+    time_entries_dao.repository.find = Mock(return_value={})
     response = client.delete(
         f'/time-entries/{valid_id}',
         headers=valid_header,
@@ -419,9 +411,10 @@ def test_delete_time_entry_calls_delete(
 
     assert HTTPStatus.NO_CONTENT == response.status_code
     assert b'' == response.data
-    time_entries_dao.repository.delete.assert_called_once_with(valid_id, ANY)
-    time_entries_dao.repository.find.assert_called_once()
-    time_entries_dao.check_whether_current_user_owns_item.assert_called_once()
+    time_entries_dao.repository.delete.assert_called_once_with(
+        valid_id, ANY, filter_predicate=ANY
+    )
+    time_entries_dao.repository.find.assert_not_called()
 
 
 @pytest.mark.parametrize(
@@ -441,8 +434,6 @@ def test_delete_time_entry_raise_http_exception(
     time_entries_dao,
 ):
     time_entries_dao.repository.delete = Mock(side_effect=http_exception)
-    time_entries_dao.repository.find = Mock()
-    time_entries_dao.check_whether_current_user_owns_item = Mock()
 
     response = client.delete(
         f"/time-entries/{valid_id}",
@@ -451,23 +442,59 @@ def test_delete_time_entry_raise_http_exception(
     )
 
     assert http_status == response.status_code
-    time_entries_dao.repository.delete.assert_called_once_with(valid_id, ANY)
-    time_entries_dao.repository.find.assert_called_once()
-    time_entries_dao.check_whether_current_user_owns_item.assert_called_once()
+    time_entries_dao.repository.delete.assert_called_once_with(
+        valid_id, ANY, filter_predicate=ANY
+    )
 
 
-def test_stop_time_entry_calls_partial_update(
+def test_delete_time_entry_of_another_user_is_forbidden(
     client: FlaskClient,
     mocker: MockFixture,
     valid_header: dict,
     valid_id: str,
     time_entries_dao,
 ):
-    time_entries_dao.repository.partial_update = Mock(return_value={})
+    from azure.cosmos.exceptions import CosmosAccessConditionFailedError
 
+    time_entries_dao.repository.delete = Mock(
+        side_effect=CosmosAccessConditionFailedError(status_code=412)
+    )
     time_entries_dao.repository.find = Mock(return_value={})
-    time_entries_dao.check_time_entry_is_not_stopped = Mock()
+    time_entries_dao.check_whether_current_user_owns_item = Mock(
+        side_effect=Forbidden
+    )
+
+    response = client.delete(
+        f"/time-entries/{valid_id}",
+        headers=valid_header,
+        follow_redirects=True,
+    )
+
+    assert HTTPStatus.FORBIDDEN == response.status_code
+    time_entries_dao.repository.find.assert_called_once()
+    time_entries_dao.check_whether_current_user_owns_item.assert_called_once()
+
+
+def test_stop_time_entry_calls_patch(
+    client: FlaskClient,
+    mocker: MockFixture,
+    valid_header: dict,
+    valid_id: str,
+    time_entries_dao,
+):
+    time_entries_dao.repository.patch = Mock(
+        return_value=TimeEntryCosmosDBModel(fake_time_entry)
+    )
+    time_entries_dao.repository.find = Mock(
+        return_value={
+            'start_date': '2020-10-01T05:00:00-05:00',
+            '_etag': 'etag',
+        }
+    )
     time_entries_dao.check_whether_current_user_owns_item = Mock()
+    time_entries_dao.repository.find_interception_with_date_range = Mock(
+        return_value=[]
+    )
 
     response = client.post(
         f'/time-entries/{valid_id}/stop',
@@ -476,29 +503,59 @@ def test_stop_time_entry_calls_partial_update(
     )
 
     assert HTTPStatus.OK == response.status_code
-    time_entries_dao.repository.partial_update.assert_called_once_with(
-        valid_id, {"end_date": ANY}, ANY
+    time_entries_dao.repository.patch.assert_called_once_with(
+        valid_id,
+        ANY,
+        set_values={"end_date": ANY},
+        filter_predicate=ANY,
+        etag='etag',
     )
-    time_entries_dao.check_time_entry_is_not_stopped.assert_called_once()
+    assert time_entries_dao.repository.patch.call_args[1][
+        'filter_predicate'
+    ].startswith('c.start_ts < ')
     time_entries_dao.check_whether_current_user_owns_item.assert_called_once()
 
 
-def test_stop_time_entry_raise_unprocessable_entity(
+def test_stop_time_entry_raise_unprocessable_entity_if_already_stopped(
     client: FlaskClient,
     mocker: MockFixture,
     valid_header: dict,
     valid_id: str,
     time_entries_dao,
 ):
-    from werkzeug.exceptions import UnprocessableEntity
+    time_entries_dao.repository.patch = Mock()
+    time_entries_dao.repository.find = Mock(
+        return_value={'end_date': current_datetime_str()}
+    )
+    time_entries_dao.check_whether_current_user_owns_item = Mock()
 
-    time_entries_dao.repository.partial_update = Mock(
-        side_effect=UnprocessableEntity
+    response = client.post(
+        f'/time-entries/{valid_id}/stop',
+        headers=valid_header,
+        follow_redirects=True,
     )
 
-    time_entries_dao.repository.find = Mock(return_value={})
-    time_entries_dao.check_time_entry_is_not_stopped = Mock()
+    assert HTTPStatus.UNPROCESSABLE_ENTITY == response.status_code
+    time_entries_dao.repository.find.assert_called_once()
+    time_entries_dao.repository.patch.assert_not_called()
+
+
+def test_stop_time_entry_is_not_patched_if_it_overlaps_another_one(
+    client: FlaskClient,
+    mocker: MockFixture,
+    valid_header: dict,
+    valid_id: str,
+    time_entries_dao,
+):
+    time_entries_dao.repository.patch = Mock()
+    time_entries_dao.repository.find = Mock(
+        return_value={'start_date': '2020-10-01T05:00:00-05:00'}
+    )
     time_entries_dao.check_whether_current_user_owns_item = Mock()
+    time_entries_dao.repository.find_interception_with_date_range = Mock(
+        return_value=[fake_time_entry]
+    )
+
     response = client.post(
         f'/time-entries/{valid_id}/stop',
         headers=valid_header,
@@ -506,23 +563,134 @@ def test_stop_time_entry_raise_unprocessable_entity(
     )
 
     assert HTTPStatus.UNPROCESSABLE_ENTITY == response.status_code
-    time_entries_dao.repository.partial_update.assert_called_once_with(
-        valid_id, {"end_date": ANY}, ANY
+    time_entries_dao.repository.patch.assert_not_called()
+
+
+def mock_stop_dependencies(mocker: MockFixture, time_entries_dao, *found):
+    mocker.patch.object(
+        time_entries_dao.repository, 'find', side_effect=list(found)
+    )
+    mocker.patch.object(
+        time_entries_dao, 'check_whether_current_user_owns_item'
+    )
+    mocker.patch.object(
+        time_entries_dao.repository,
+        'find_interception_with_date_range',
+        return_value=[],
     )
-    time_entries_dao.check_whether_current_user_owns_item.assert_called_once()
-    time_entries_dao.check_time_entry_is_not_stopped.assert_called_once()
 
 
-def test_restart_time_entry_calls_partial_update(
+def test_stop_time_entry_changed_by_another_request_is_a_conflict(
     client: FlaskClient,
     mocker: MockFixture,
     valid_header: dict,
     valid_id: str,
     time_entries_dao,
 ):
-    time_entries_dao.repository.partial_update = Mock(return_value={})
+    start_date = '2020-10-01T05:00:00-05:00'
+    mock_stop_dependencies(
+        mocker,
+        time_entries_dao,
+        {'start_date': start_date, '_etag': 'etag'},
+        {'start_date': start_date, '_etag': 'another-etag'},
+    )
+    patch_mock = mocker.patch.object(
+        time_entries_dao.repository,
+        'patch',
+        side_effect=CosmosAccessConditionFailedError(status_code=412),
+    )
 
-    time_entries_dao.repository.find = Mock(return_value={})
+    response = client.post(
+        f'/time-entries/{valid_id}/stop',
+        headers=valid_header,
+        follow_redirects=True,
+    )
+
+    assert HTTPStatus.CONFLICT == response.status_code
+    patch_mock.assert_called_once()
+
+
+def test_stop_time_entry_that_started_later_is_unprocessable(
+    client: FlaskClient,
+    mocker: MockFixture,
+    valid_header: dict,
+    valid_id: str,
+    time_entries_dao,
+):
+    start_date = datetime_str(current_datetime() + timedelta(hours=1))
+    mock_stop_dependencies(
+        mocker,
+        time_entries_dao,
+        {'start_date': start_date, '_etag': 'etag'},
+        {'start_date': start_date, '_etag': 'etag'},
+    )
+    patch_mock = mocker.patch.object(
+        time_entries_dao.repository,
+        'patch',
+        side_effect=CosmosAccessConditionFailedError(status_code=412),
+    )
+
+    response = client.post(
+        f'/time-entries/{valid_id}/stop',
+        headers=valid_header,
+        follow_redirects=True,
+    )
+
+    assert HTTPStatus.UNPROCESSABLE_ENTITY == response.status_code
+    assert (
+        json.loads(response.data)['message']
+        == 'You must end the time entry after it started'
+    )
+    patch_mock.assert_called_once()
+
+
+def test_stop_time_entry_without_timestamps_is_patched_by_its_etag(
+    client: FlaskClient,
+    mocker: MockFixture,
+    valid_header: dict,
+    valid_id: str,
+    time_entries_dao,
+):
+    start_date = '2020-10-01T05:00:00-05:00'
+    mock_stop_dependencies(
+        mocker,
+        time_entries_dao,
+        {'start_date': start_date, '_etag': 'etag'},
+        {'start_date': start_date, '_etag': 'etag'},
+    )
+    patch_mock = mocker.patch.object(
+        time_entries_dao.repository,
+        'patch',
+        side_effect=[
+            CosmosAccessConditionFailedError(status_code=412),
+            TimeEntryCosmosDBModel(fake_time_entry),
+        ],
+    )
+
+    response = client.post(
+        f'/time-entries/{valid_id}/stop',
+        headers=valid_header,
+        follow_redirects=True,
+    )
+
+    assert HTTPStatus.OK == response.status_code
+    assert patch_mock.call_args == (
+        (valid_id, ANY),
+        {'set_values': {'end_date': ANY}, 'etag': 'etag'},
+    )
+
+
+def test_restart_time_entry_calls_patch(
+    client: FlaskClient,
+    mocker: MockFixture,
+    valid_header: dict,
+    valid_id: str,
+    time_entries_dao,
+):
+    time_entries_dao.repository.patch = Mock(return_value={})
+
+    time_entries_dao.repository.find = Mock(return_value={'_etag': 'etag'})
+    time_entries_dao.repository.validate_data = Mock()
     time_entries_dao.check_time_entry_is_not_started = Mock()
     time_entries_dao.check_whether_current_user_owns_item = Mock()
 
@@ -533,9 +701,10 @@ def test_restart_time_entry_calls_partial_update(
     )
 
     assert HTTPStatus.OK == response.status_code
-    time_entries_dao.repository.partial_update.assert_called_once_with(
-        valid_id, {"end_date": None}, ANY
+    time_entries_dao.repository.patch.assert_called_once_with(
+        valid_id, ANY, set_values={"end_date": None}, etag='etag'
     )
+    time_entries_dao.repository.validate_data.assert_called_once()
     time_entries_dao.check_time_entry_is_not_started.assert_called_once()
     time_entries_dao.check_whether_current_user_owns_item.assert_called_once()
 
@@ -549,11 +718,10 @@ def test_restart_time_entry_raise_unprocessable_entity(
 ):
     from werkzeug.exceptions import UnprocessableEntity
 
-    time_entries_dao.repository.partial_update = Mock(
-        side_effect=UnprocessableEntity
-    )
+    time_entries_dao.repository.patch = Mock(side_effect=UnprocessableEntity)
 
     time_entries_dao.repository.find = Mock(return_value={})
+    time_entries_dao.repository.validate_data = Mock()
     time_entries_dao.check_time_entry_is_not_started = Mock()
     time_entries_dao.check_whether_current_user_owns_item = Mock()
 
@@ -564,8 +732,8 @@ def test_restart_time_entry_raise_unprocessable_entity(
     )
 
     assert HTTPStatus.UNPROCESSABLE_ENTITY == response.status_code
-    time_entries_dao.repository.partial_update.assert_called_once_with(
-        valid_id, {"end_date": None}, ANY
+    time_entries_dao.repository.patch.assert_called_once_with(
+        valid_id, ANY, set_values={"end_date": None}, etag=None
     )
     time_entries_dao.check_time_entry_is_not_started.assert_called_once()
     time_entries_dao.check_whether_current_user_owns_item.assert_called_once()
@@ -676,7 +844,7 @@ def test_create_with_valid_uuid_format_should_return_created(
 @patch('msal.ConfidentialClientApplication', Mock())
 @patch('utils.azure_users.AzureConnection.get_token', Mock())
 @patch(
-    'utils.azure_users.AzureConnection.is_test_user', Mock(return_value=True)
+    'utils.azure_users.AzureDirectory.is_test_user', Mock(return_value=True)
 )
 @pytest.mark.parametrize(
     'url',
@@ -696,12 +864,12 @@ def test_get_all_passes_date_range_built_from_params_to_find_all(
     url: str,
     time_entries_dao,
 ):
-    time_entries_dao.repository.find_all = Mock(return_value=[])
+    time_entries_dao.repository.iter_all = Mock(return_value=iter([]))
 
     response = client.get(url, headers=valid_header)
 
-    time_entries_dao.repository.find_all.assert_called_once()
-    _, kwargs = time_entries_dao.repository.find_all.call_args
+    time_entries_dao.repository.iter_all.assert_called_once()
+    _, kwargs = time_entries_dao.repository.iter_all.call_args
     assert 'date_range' in kwargs
     assert 'start_date' in kwargs['date_range']
     assert 'end_date' in kwargs['date_range']
@@ -710,7 +878,7 @@ def test_get_all_passes_date_range_built_from_params_to_find_all(
 @patch('msal.ConfidentialClientApplication', Mock())
 @patch('utils.azure_users.AzureConnection.get_token', Mock())
 @patch(
-    'utils.azure_users.AzureConnection.is_test_user', Mock(return_value=True)
+    'utils.azure_users.AzureDirectory.is_test_user', Mock(return_value=True)
 )
 @pytest.mark.parametrize(
     'url,start_date,end_date',
@@ -735,12 +903,12 @@ def test_get_all_passes_date_range_to_find_all_with_default_tz_offset(
     start_date: str,
     end_date: str,
 ):
-    time_entries_dao.repository.find_all = Mock(return_value=[])
+    time_entries_dao.repository.iter_all = Mock(return_value=iter([]))
 
     response = client.get(url, headers=valid_header)
 
-    time_entries_dao.repository.find_all.assert_called_once()
-    _, kwargs = time_entries_dao.repository.find_all.call_args
+    time_entries_dao.repository.iter_all.assert_called_once()
+    _, kwargs = time_entries_dao.repository.iter_all.call_args
     assert 'date_range' in kwargs
     assert 'start_date' in kwargs['date_range']
     assert 'end_date' in kwargs['date_range']
@@ -751,7 +919,7 @@ def test_get_all_passes_date_range_to_find_all_with_default_tz_offset(
 @patch('msal.ConfidentialClientApplication', Mock())
 @patch('utils.azure_users.AzureConnection.get_token', Mock())
 @patch(
-    'utils.azure_users.AzureConnection.is_test_user', Mock(return_value=True)
+    'utils.azure_users.AzureDirectory.is_test_user', Mock(return_value=True)
 )
 @pytest.mark.parametrize(
     'url,start_date,end_date',
@@ -796,12 +964,12 @@ def test_get_all_passes_date_range_to_find_all_with_given_tz_offset(
     start_date: str,
     end_date: str,
 ):
-    time_entries_dao.repository.find_all = Mock(return_value=[])
+    time_entries_dao.repository.iter_all = Mock(return_value=iter([]))
 
     response = client.get(url, headers=valid_header)
 
-    time_entries_dao.repository.find_all.assert_called_once()
-    _, kwargs = time_entries_dao.repository.find_all.call_args
+    time_entries_dao.repository.iter_all.assert_called_once()
+    _, kwargs = time_entries_dao.repository.iter_all.call_args
     assert 'date_range' in kwargs
     assert 'start_date' in kwargs['date_range']
     assert 'end_date' in kwargs['date_range']
@@ -872,7 +1040,7 @@ def test_paginated_sends_max_count_and_offset_on_call_to_repository(
     time_entries_dao.repository.find_all = Mock(return_value=[])
 
     response = client.get(
-        '/time-entries/paginated?start_date=2020-09-10T00:00:00-05:00&end_date=2020-09-10T23:59:59-05:00&timezone_offset=300&start=0&length=5',
+        '/time-entries/paginated?start_date=2020-09-10T00:00:00-05:00&end_date=2020-09-10T23:59:59-05:00&timezone_offset=300&start=5&length=5',
         headers=valid_header,
     )
 
@@ -881,3 +1049,97 @@ def test_paginated_sends_max_count_and_offset_on_call_to_repository(
     _, kwargs = time_entries_dao.repository.find_all.call_args
     assert 'max_count' in kwargs and kwargs['max_count'] is not None
     assert 'offset' in kwargs and kwargs['offset'] is not None
+
+
+def test_paginated_sends_continuation_token_on_call_to_repository(
+    client: FlaskClient, valid_header: dict, time_entries_dao
+):
+    time_entries_dao.repository.find_page = Mock(
+        return_value=([], 'next-page-token')
+    )
+
+    response = client.get(
+        '/time-entries/paginated?start_date=2020-09-10T00:00:00-05:00&end_date=2020-09-10T23:59:59-05:00&timezone_offset=300&length=5&continuation_token=page-token',
+        headers=valid_header,
+    )
+
+    assert HTTPStatus.OK == response.status_code
+    assert json.loads(response.data)['continuation_token'] == 'next-page-token'
+
+    time_entries_dao.repository.find_page.assert_called_once_with(
+        ANY,
+        conditions=ANY,
+        custom_sql_conditions=ANY,
+        date_range=ANY,
+        page_size=5,
+        continuation_token='page-token',
+    )
+
+
+def test_paginated_counts_the_records_once_for_every_page(
+    client: FlaskClient,
+    mocker: MockFixture,
+    valid_header: dict,
+    event_context,
+    time_entries_dao,
+):
+    from time_tracker_api.time_entries.time_entries_dao import (
+        records_total_cache,
+    )
+
+    records_total_cache.clear()
+    count_mock = mocker.patch.object(
+        time_entries_dao.repository, 'count', return_value=42
+    )
+    mocker.patch.object(
+        time_entries_dao.repository,
+        'find_page',
+        return_value=([], 'next-page-token'),
+    )
+    url = (
+        '/time-entries/paginated?start_date=2020-09-10T00:00:00-05:00'
+        '&end_date=2020-09-10T23:59:59-05:00&timezone_offset=300&length=5'
+    )
+
+    for continuation_token in ['', 'page-2', 'page-3']:
+        response = client.get(
+            url + '&continuation_token=' + continuation_token,
+            headers=valid_header,
+        )
+        assert json.loads(response.data)['records_total'] == 42
+
+    count_mock.assert_called_once()
+
+    mocker.patch.object(
+        time_entries_dao.repository,
+        'find_interception_with_date_range',
+        return_value=[],
+    )
+    mocker.patch.object(
+        time_entries_dao.repository.container,
+        'create_item',
+        return_value=fake_time_entry,
+    )
+    client.post(
+        "/time-entries",
+        json=valid_time_entry_input,
+        headers=valid_header,
+        follow_redirects=True,
+    )
+    client.get(url, headers=valid_header)
+
+    assert count_mock.call_count == 2
+
+    # Any other write, like stopping a time entry, forgets the totals too
+    repository = TimeEntryCosmosDBRepository()
+    mocker.patch.object(
+        repository.container, 'patch_item', return_value=fake_time_entry
+    )
+    repository.patch(
+        fake_time_entry['id'],
+        event_context,
+        set_values={'end_date': current_datetime_str()},
+    )
+    client.get(url, headers=valid_header)
+
+    assert count_mock.call_count == 3
@@ -0,0 +1,223 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from faker import Faker
+from flask import Flask
+
+from commons.data_access_layer.cosmos_db_change_feed import ContinuationStore
+from commons.data_access_layer.database import EventContext
+from time_tracker_api.time_entries.time_entries_repository import (
+    TimeEntryCosmosDBRepository,
+)
+from time_tracker_api.time_entries.worked_time_rollup import (
+    WorkedTimeRollup,
+    WorkedTimeRollupProcessor,
+    container_definition,
+    seconds_per_day,
+)
+
+fake = Faker()
+ecuador = timezone(timedelta(hours=-5))
+
+
+@pytest.fixture(scope="module")
+def worked_time_rollup(
+    app: Flask, time_entry_repository: TimeEntryCosmosDBRepository
+) -> WorkedTimeRollup:
+    from commons.data_access_layer.cosmos_db import cosmos_helper
+
+    cosmos_helper.create_container_if_not_exists(container_definition)
+    return WorkedTimeRollup(
+        cosmos_helper.db.get_container_client(container_definition['id'])
+    )
+
+
+@pytest.fixture
+def rollup_event_context() -> EventContext:
+    return EventContext(
+        "test",
+        "worked-time-rollup",
+        user_id=fake.uuid4(),
+        tenant_id=fake.uuid4(),
+    )
+
+
+def test_seconds_per_day_splits_the_entries_at_local_midnight():
+    start = datetime(2020, 10, 1, 22, 0, tzinfo=ecuador)
+
+    assert seconds_per_day(start, start + timedelta(hours=3), ecuador) == {
+        '2020-10-01': 7200,
+        '2020-10-02': 3600,
+    }
+    assert seconds_per_day(start, start, ecuador) == {}
+
+
+def test_rollup_follows_the_edits_and_deletes_from_the_change_feed(
+    worked_time_rollup: WorkedTimeRollup,
+    time_entry_repository: TimeEntryCosmosDBRepository,
+    rollup_event_context: EventContext,
+):
+    owner_id = rollup_event_context.user_id
+    processor = WorkedTimeRollupProcessor(
+        worked_time_rollup,
+        time_entry_repository.container.wrapped_container,
+        ContinuationStore(),
+    )
+    processor.poll()
+
+    def day_totals():
+        return worked_time_rollup.find_day_totals(
+            rollup_event_context.tenant_id,
+            owner_id,
+            '2020-10-01',
+            '2020-11-01',
+        )
+
+    time_entry = time_entry_repository.create(
+        {
+            'project_id': fake.uuid4(),
+            'owner_id': owner_id,
+            'start_date': '2020-10-01T22:00:00-05:00',
+            'end_date': '2020-10-02T01:00:00-05:00',
+        },
+        rollup_event_context,
+        mapper=dict,
+    )
+    assert processor.poll() == 1
+    assert day_totals() == {'2020-10-01': 7200, '2020-10-02': 3600}
+
+    time_entry_repository.patch(
+        time_entry['id'],
+        rollup_event_context,
+        set_values={
+            'start_date': '2020-10-03T08:00:00-05:00',
+            'end_date': '2020-10-03T08:30:00-05:00',
+        },
+    )
+    processor.poll()
+    assert day_totals() == {
+        '2020-10-01': 0,
+        '2020-10-02': 0,
+        '2020-10-03': 1800,
+    }
+
+    # Reading the same change again doesn't count it twice
+    assert (
+        worked_time_rollup.apply(
+            time_entry_repository.find(
+                time_entry['id'], rollup_event_context, mapper=dict
+            )
+        )
+        is False
+    )
+
+    time_entry_repository.delete(time_entry['id'], rollup_event_context)
+    processor.poll()
+    assert day_totals()['2020-10-03'] == 0
+
+
+def test_summary_adds_today_and_the_running_entry_to_the_past_days(
+    worked_time_rollup: WorkedTimeRollup,
+    rollup_event_context: EventContext,
+):
+    owner_id, tenant_id = (
+        rollup_event_context.user_id,
+        rollup_event_context.tenant_id,
+    )
+    # Wednesday, the week started on Monday 2020-09-28
+    now = datetime(2020, 9, 30, 10, 0, tzinfo=ecuador)
+    past_time_entries = [
+        ('2020-09-28T09:00:00-05:00', '2020-09-28T11:00:00-05:00'),
+        ('2020-09-25T09:00:00-05:00', '2020-09-25T10:00:00-05:00'),
+        ('2020-08-31T09:00:00-05:00', '2020-08-31T12:00:00-05:00'),
+    ]
+    for start_date, end_date in past_time_entries:
+        worked_time_rollup.apply(
+            {
+                'id': fake.uuid4(),
+                'tenant_id': tenant_id,
+                'owner_id': owner_id,
+                'start_date': start_date,
+                'end_date': end_date,
+            }
+        )
+    todays_time_entries = [
+        {
+            'start_date': '2020-09-29T23:00:00-05:00',
+            'end_date': '2020-09-30T00:30:00-05:00',
+        },
+        {'start_date': '2020-09-30T09:00:00-05:00', 'end_date': None},
+    ]
+    dates = []
+
+    def find_entries_ending_after(date):
+        dates.append(date)
+        return todays_time_entries
+
+    summary = worked_time_rollup.summary(
+        tenant_id, owner_id, find_entries_ending_after, now=now
+    )
+
+    assert dates == [datetime(2020, 9, 30, tzinfo=ecuador)]
+    assert summary == {
+        'day': {'hours': 1, 'minutes': 30, 'seconds': 0},
+        'week': {'hours': 3, 'minutes': 30, 'seconds': 0},
+        'month': {'hours': 4, 'minutes': 30, 'seconds': 0},
+    }
+
+
+def test_summary_counts_the_running_entry_since_it_started(
+    worked_time_rollup: WorkedTimeRollup,
+    rollup_event_context: EventContext,
+):
+    # Thursday, the running entry started on Wednesday night, the last day
+    # of the month
+    now = datetime(2020, 10, 1, 2, 0, tzinfo=ecuador)
+
+    summary = worked_time_rollup.summary(
+        rollup_event_context.tenant_id,
+        rollup_event_context.user_id,
+        lambda date: [
+            {'start_date': '2020-09-30T22:00:00-05:00', 'end_date': None}
+        ],
+        now=now,
+    )
+
+    assert summary == {
+        'day': {'hours': 2, 'minutes': 0, 'seconds': 0},
+        'week': {'hours': 4, 'minutes': 0, 'seconds': 0},
+        'month': {'hours': 2, 'minutes': 0, 'seconds': 0},
+    }
+
+
+def test_find_entries_ending_after_includes_the_running_entry(
+    time_entry_repository: TimeEntryCosmosDBRepository,
+    rollup_event_context: EventContext,
+):
+    owner_id = rollup_event_context.user_id
+    dates = [
+        ('2020-09-29T09:00:00-05:00', '2020-09-29T10:00:00-05:00'),
+        ('2020-09-29T23:00:00-05:00', '2020-09-30T00:30:00-05:00'),
+        ('2020-09-30T09:00:00-05:00', None),
+    ]
+    for start_date, end_date in dates:
+        time_entry_repository.create(
+            {
+                'project_id': fake.uuid4(),
+                'owner_id': owner_id,
+                'start_date': start_date,
+                'end_date': end_date,
+            },
+            rollup_event_context,
+        )
+
+    time_entries = time_entry_repository.find_entries_ending_after(
+        rollup_event_context,
+        owner_id,
+        datetime(2020, 9, 30, tzinfo=ecuador),
+    )
+
+    assert [t['start_date'] for t in time_entries] == [
+        '2020-09-30T09:00:00-05:00',
+        '2020-09-29T23:00:00-05:00',
+    ]
@@ -8,9 +8,9 @@ from pytest import mark
 @patch('utils.azure_users.AzureConnection.get_msal_client', Mock())
 @patch('utils.azure_users.AzureConnection.get_token', Mock())
 @patch(
-    'utils.azure_users.AzureConnection.is_test_user', Mock(return_value=True)
+    'utils.azure_users.AzureDirectory.is_test_user', Mock(return_value=True)
 )
-@patch('utils.azure_users.AzureConnection.users')
+@patch('utils.azure_users.AzureDirectory.users')
 def test_users_response_contains_expected_props(
     users_mock, client: FlaskClient, valid_header: dict,
 ):
@@ -1,11 +1,16 @@
 from unittest.mock import Mock, patch
-from utils.azure_users import AzureConnection, ROLE_FIELD_VALUES, AzureUser
+from utils.azure_users import (
+    AzureConnection,
+    AzureDirectory,
+    AzureUser,
+    ROLE_FIELD_VALUES,
+)
 from pytest import mark
 
 
 @patch('utils.azure_users.AzureConnection.get_msal_client', Mock())
 @patch('utils.azure_users.AzureConnection.get_token', Mock())
-@patch('requests.get')
+@patch('utils.azure_users.http_session.get')
 @mark.parametrize(
     'field_name,field_value,is_test_user_expected_value',
     [
@@ -28,7 +33,7 @@ def test_azure_connection_is_test_user(
 
 @patch('utils.azure_users.AzureConnection.get_msal_client', Mock())
 @patch('utils.azure_users.AzureConnection.get_token', Mock())
-@patch('requests.get')
+@patch('utils.azure_users.http_session.get')
 def test_azure_connection_get_test_user_ids(get_mock):
     response_mock = Mock()
     response_mock.status_code = 200
@@ -56,3 +61,156 @@ def test_azure_connection_get_non_test_users(
     non_test_users = [non_test_user]
     az_conn = AzureConnection()
     assert az_conn.get_non_test_users() == non_test_users
+
+
+@patch('utils.azure_users.AzureConnection.get_msal_client')
+def test_azure_connection_reuses_the_cached_token(get_msal_client_mock):
+    client_mock = get_msal_client_mock.return_value
+    client_mock.acquire_token_silent.return_value = {'access_token': 'TOKEN'}
+
+    az_conn = AzureConnection()
+
+    assert az_conn.access_token == 'TOKEN'
+    client_mock.acquire_token_for_client.assert_not_called()
+
+
+def test_azure_directory_serves_the_users_from_memory():
+    connection_mock = Mock()
+    test_user = AzureUser('ID1', None, None, [])
+    non_test_user = AzureUser('ID2', None, None, [])
+    connection_mock.users.return_value = [test_user, non_test_user]
+    connection_mock.get_test_user_ids.return_value = ['ID1']
+    directory = AzureDirectory(
+        connection_factory=Mock(return_value=connection_mock),
+        refresh_interval=3600,
+    )
+
+    assert directory.users() == [test_user, non_test_user]
+    assert directory.get_non_test_users() == [non_test_user]
+    assert directory.is_test_user('ID1')
+    assert not directory.is_test_user('ID2')
+    assert directory.get_test_user_ids() == ['ID1']
+    connection_mock.users.assert_called_once()
+    connection_mock.get_test_user_ids.assert_called_once()
+
+
+def test_azure_directory_applies_the_role_updates_to_the_snapshot():
+    connection_mock = Mock()
+    connection_mock.users.return_value = [AzureUser('ID1', None, None, [])]
+    connection_mock.get_test_user_ids.return_value = []
+    updated_user = AzureUser('ID1', None, None, ['time-tracker-tester'])
+    connection_mock.update_role.return_value = updated_user
+    directory = AzureDirectory(
+        connection_factory=Mock(return_value=connection_mock),
+        refresh_interval=3600,
+    )
+    assert not directory.is_test_user('ID1')
+
+    directory.update_role('ID1', 'test', is_grant=True)
+
+    assert directory.is_test_user('ID1')
+    assert directory.users() == [updated_user]
+
+
+@patch('utils.azure_users.AzureConnection.get_msal_client', Mock())
+@patch('utils.azure_users.AzureConnection.get_token', Mock())
+@patch('utils.azure_users.http_session.get')
+def test_azure_connection_users_follows_the_next_links(get_mock):
+    first_page, last_page = Mock(status_code=200), Mock(status_code=200)
+    first_page.json.return_value = {
+        'value': [{'objectId': 'ID1', 'displayName': 'A', 'otherMails': []}],
+        'odata.nextLink': 'directoryObjects/$/Users?$skiptoken=X',
+    }
+    last_page.json.return_value = {
+        'value': [{'objectId': 'ID2', 'displayName': 'B', 'otherMails': []}]
+    }
+    get_mock.side_effect = [first_page, last_page]
+
+    users = AzureConnection().users()
+
+    assert [user.id for user in users] == ['ID1', 'ID2']
+    assert get_mock.call_args[0][0].endswith(
+        '/directoryObjects/$/Users?$skiptoken=X&api-version=1.6'
+    )
+
+
+@patch('utils.azure_users.AzureConnection.get_msal_client', Mock())
+@patch('utils.azure_users.AzureConnection.get_token', Mock())
+@patch('utils.azure_users.http_session.post')
+def test_azure_connection_update_role_sends_a_single_batch(post_mock):
+    field_name, field_value = ROLE_FIELD_VALUES['admin']
+    post_mock.return_value = Mock(
+        status_code=202,
+        headers={'Content-Type': 'multipart/mixed; boundary=batchresponse_1'},
+        text='\r\n'.join(
+            [
+                '--batchresponse_1',
+                'Content-Type: multipart/mixed; boundary=changesetresponse_1',
+                '',
+                '--changesetresponse_1',
+                'Content-Type: application/http',
+                'Content-Transfer-Encoding: binary',
+                '',
+                'HTTP/1.1 204 No Content',
+                '',
+                '',
+                '--changesetresponse_1--',
+                '--batchresponse_1',
+                'Content-Type: application/http',
+                'Content-Transfer-Encoding: binary',
+                '',
+                'HTTP/1.1 200 OK',
+                'Content-Type: application/json',
+                '',
+                '{"objectId": "ID1", "displayName": "A", "otherMails": [], '
+                '"%s": "%s"}' % (field_name, field_value),
+                '--batchresponse_1--',
+            ]
+        ),
+    )
+
+    user = AzureConnection().update_role('ID1', 'admin', is_grant=True)
+
+    post_mock.assert_called_once()
+    batch_body = post_mock.call_args[1]['data']
+    assert batch_body.index('PATCH ') < batch_body.index('GET ')
+    assert user.id == 'ID1'
+    assert user.roles == [field_value]
+
+
+@patch('utils.azure_users.AzureConnection.get_msal_client', Mock())
+@patch('utils.azure_users.AzureConnection.get_token', Mock())
+@patch('utils.azure_users.http_session.get')
+def test_azure_connection_users_by_ids_filters_the_ids_in_chunks(get_mock):
+    response_mock = Mock(status_code=200)
+    response_mock.json.return_value = {'value': []}
+    get_mock.return_value = response_mock
+
+    AzureConnection().users_by_ids(['ID%s' % i for i in range(20)])
+
+    assert get_mock.call_count == 2
+    first_endpoint = get_mock.call_args_list[0][0][0]
+    assert "$filter=objectId in ('ID0','ID1'," in first_endpoint
+    assert "'ID14')" in first_endpoint
+    assert "$filter=objectId in ('ID15'," in get_mock.call_args[0][0]
+
+
+def test_azure_directory_users_by_ids_only_fetches_the_missing_users():
+    connection_mock = Mock()
+    first_user = AzureUser('ID1', None, 'one@ioet.com', [])
+    second_user = AzureUser('ID2', None, 'two@ioet.com', [])
+    connection_mock.users_by_ids.side_effect = [[first_user], [second_user]]
+    directory = AzureDirectory(
+        connection_factory=Mock(return_value=connection_mock),
+        refresh_interval=3600,
+    )
+
+    assert directory.users_by_ids(['ID1']) == [first_user]
+    users = directory.users_by_ids(['ID1', 'ID2', None])
+
+    assert sorted(users, key=lambda user: user.id) == [
+        first_user,
+        second_user,
+    ]
+    connection_mock.users_by_ids.assert_called_with(['ID2'])
+    connection_mock.users.assert_not_called()
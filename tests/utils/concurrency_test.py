@@ -0,0 +1,105 @@
+import time
+from concurrent.futures import TimeoutError
+
+import flask
+from flask import Flask
+from pytest import raises
+
+from utils.concurrency import fan_out, in_background
+
+
+def sleep_and_return(seconds: float, value):
+    def call():
+        time.sleep(seconds)
+        return value
+
+    return call
+
+
+def test_fan_out_runs_the_calls_at_the_same_time_and_keeps_their_order():
+    started_at = time.monotonic()
+
+    results = fan_out(
+        (sleep_and_return(0.2, 'projects'), 1),
+        (sleep_and_return(0.1, 'activities'), 1),
+        (sleep_and_return(0.2, 'users'), 1),
+    )
+
+    assert results == ['projects', 'activities', 'users']
+    assert time.monotonic() - started_at < 0.4
+
+
+def test_fan_out_raises_timeout_error_if_a_call_takes_too_long():
+    with raises(TimeoutError):
+        fan_out(
+            (sleep_and_return(0, 'projects'), 1),
+            (sleep_and_return(0.5, 'users'), 0.1),
+        )
+
+
+def test_fan_out_raises_the_error_of_a_failed_call():
+    def fail():
+        raise ValueError('Unavailable')
+
+    with raises(ValueError):
+        fan_out((sleep_and_return(0, 'projects'), 1), (fail, 1))
+
+
+def test_fan_out_calls_share_the_request_and_flask_g(app: Flask):
+    def read_request():
+        flask.g.setdefault('calls', []).append(flask.request.path)
+        return flask.request.args['name']
+
+    with app.test_request_context('/time-entries?name=entries'):
+        results = fan_out((read_request, 1), (read_request, 1))
+
+        assert results == ['entries', 'entries']
+        assert flask.g.calls == ['/time-entries', '/time-entries']
+
+
+def test_in_background_runs_the_call_while_the_caller_makes_its_own(
+    app: Flask,
+):
+    def read_request():
+        time.sleep(0.2)
+        return flask.request.args['name']
+
+    with app.test_request_context('/time-entries?name=count'):
+        started_at = time.monotonic()
+        count = in_background(read_request)
+        page = sleep_and_return(0.2, 'page')()
+
+        assert (page, count.result(1)) == ('page', 'count')
+        assert time.monotonic() - started_at < 0.35
+
+
+def test_pooled_calls_do_not_count_the_request_again():
+    from commons.data_access_layer import cosmos_db_metrics
+    from commons.data_access_layer.cosmos_db_metrics import (
+        CosmosDBCallRecord,
+        endpoint_metrics,
+    )
+
+    app = Flask(__name__)
+    cosmos_db_metrics.init_app(app)
+
+    def query():
+        cosmos_db_metrics.notify(
+            CosmosDBCallRecord('time_entry', 'query_items', 2.5, 3.0)
+        )
+        return 'page'
+
+    @app.route('/pooled')
+    def pooled():
+        background_query = in_background(query)
+        pages = fan_out((query, 1), (query, 1))
+        return ','.join(pages + [background_query.result(1)])
+
+    endpoint_metrics.clear()
+    response = app.test_client().get('/pooled')
+
+    assert response.headers['X-Request-Charge'] == '7.50'
+    [metrics] = endpoint_metrics.snapshot()
+    assert metrics['endpoint'] == 'GET /pooled'
+    assert metrics['requests'] == 1
+    assert metrics['calls'] == 3
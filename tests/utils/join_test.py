@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+from utils.extend_model import add_complementary_info_to_time_entries
+from utils.join import Join, index_by, join
+
+
+def test_index_by_keeps_the_last_item_of_each_key():
+    first, last = SimpleNamespace(id='1'), SimpleNamespace(id='1')
+
+    assert index_by([first, last]) == {'1': last}
+
+
+def test_join_applies_several_joins_to_each_entity():
+    entities = [
+        SimpleNamespace(project_id='p1', owner_id='u1'),
+        SimpleNamespace(project_id='p2', owner_id='unknown'),
+    ]
+    projects = [
+        SimpleNamespace(id='p1', name='Ioet'),
+        SimpleNamespace(id='p2', name='Time Tracker'),
+    ]
+    users = [SimpleNamespace(id='u1', email='u1@ioet.com')]
+
+    join(
+        entities,
+        Join(projects, 'project_id', {'project_name': 'name'}),
+        Join(
+            users,
+            'owner_id',
+            {'owner_email': lambda user: user.email.upper()},
+        ),
+    )
+
+    assert entities[0].project_name == 'Ioet'
+    assert entities[0].owner_email == 'U1@IOET.COM'
+    assert entities[1].project_name == 'Time Tracker'
+    assert not hasattr(entities[1], 'owner_email')
+
+
+def test_add_complementary_info_to_time_entries_marks_archived_items():
+    time_entry = SimpleNamespace(
+        project_id='p1', activity_id='a1', owner_id='u1'
+    )
+    project = SimpleNamespace(
+        id='p1',
+        name='Ioet',
+        customer_id='c1',
+        customer_name='Customer',
+        is_deleted=lambda: True,
+    )
+    activity = SimpleNamespace(
+        id='a1', name='Development', is_deleted=lambda: False
+    )
+    user = SimpleNamespace(id='u1', email='u1@ioet.com')
+
+    add_complementary_info_to_time_entries(
+        [time_entry], [project], [activity], [user]
+    )
+
+    assert time_entry.project_name == 'Ioet (archived)'
+    assert time_entry.customer_id == 'c1'
+    assert time_entry.customer_name == 'Customer'
+    assert time_entry.activity_name == 'Development'
+    assert time_entry.owner_email == 'u1@ioet.com'
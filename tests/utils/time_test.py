@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytz
+
+from utils.time import datetime_str, str_to_datetime
+
+
+@pytest.mark.parametrize(
+    'value,expected',
+    [
+        (
+            '2020-09-30T09:00:00-05:00',
+            datetime(2020, 9, 30, 14, tzinfo=timezone.utc),
+        ),
+        (
+            '2020-09-30T14:00:00.123Z',
+            datetime(2020, 9, 30, 14, 0, 0, 123000, tzinfo=timezone.utc),
+        ),
+        (
+            '2020-09-30T14:00:00.1234567Z',
+            datetime(2020, 9, 30, 14, 0, 0, 123456, tzinfo=timezone.utc),
+        ),
+        ('2020-09-30T14:00:00', datetime(2020, 9, 30, 14, tzinfo=pytz.UTC)),
+    ],
+)
+def test_str_to_datetime_parses_the_stored_formats(value, expected):
+    parsed = str_to_datetime(value)
+
+    assert parsed == expected
+    assert parsed.tzinfo is not None
+
+
+def test_str_to_datetime_parses_back_the_dates_of_datetime_str():
+    date = datetime(
+        2020, 9, 30, 9, 0, 0, 5, tzinfo=timezone(timedelta(hours=-5))
+    )
+
+    assert str_to_datetime(datetime_str(date)) == date
+    assert datetime_str(str_to_datetime(datetime_str(date))) == datetime_str(
+        date
+    )
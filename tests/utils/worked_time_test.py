@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from utils import worked_time
+from utils.worked_time import (
+    DayDateRange,
+    WeekDateRange,
+    summary,
+    time_entries_to_arrays,
+    worked_seconds,
+)
+
+ecuador = timezone(timedelta(hours=-5))
+
+
+@pytest.mark.parametrize('numpy', [worked_time.np, None])
+def test_worked_seconds_cuts_the_time_entries_to_the_range(numpy):
+    # Wednesday, the week started on Monday 2020-09-28
+    now = datetime(2020, 9, 30, 10, 0, tzinfo=ecuador)
+    time_entries = [
+        SimpleNamespace(
+            start_date='2020-09-29T23:00:00-05:00',
+            end_date='2020-09-30T00:30:00-05:00',
+        ),
+        SimpleNamespace(
+            start_date='2020-09-30T14:00:00+00:00',
+            end_date='2020-09-30T14:15:00+00:00',
+        ),
+        SimpleNamespace(start_date='2020-09-30T09:00:00-05:00', end_date=None),
+        SimpleNamespace(
+            start_date='2020-09-27T09:00:00-05:00',
+            end_date='2020-09-27T10:00:00-05:00',
+        ),
+    ]
+
+    with patch.object(worked_time, 'np', numpy):
+        starts, ends = time_entries_to_arrays(time_entries, now)
+
+        assert worked_seconds(starts, ends, DayDateRange(ecuador, now)) == 6300
+        assert (
+            worked_seconds(starts, ends, WeekDateRange(ecuador, now)) == 9900
+        )
+
+
+def test_summary_of_no_time_entries_is_zero():
+    assert summary([], 300) == {
+        'day': {'hours': 0, 'minutes': 0, 'seconds': 0},
+        'week': {'hours': 0, 'minutes': 0, 'seconds': 0},
+        'month': {'hours': 0, 'minutes': 0, 'seconds': 0},
+    }
@@ -36,6 +36,10 @@ def init_app_config(app: Flask, config_path: str, config_data: dict = None):
 
 
 def init_app(app: Flask):
+    from time_tracker_api.security import init_app as init_security
+
+    init_security(app)
+
     from time_tracker_api.database import init_app as init_database
 
     init_database(app)
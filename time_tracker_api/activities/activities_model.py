@@ -2,7 +2,8 @@ from dataclasses import dataclass
 
 from azure.cosmos import PartitionKey
 
-from commons.data_access_layer.cosmos_db import CosmosDBModel, CosmosDBDao, CosmosDBRepository
+from commons.data_access_layer.cosmos_db import CosmosDBModel, CosmosDBDao
+from commons.data_access_layer.cosmos_db_cache import CachedCosmosDBRepository
 from time_tracker_api.database import CRUDDao, APICosmosDBDao
 
 
@@ -40,8 +41,8 @@ class ActivityCosmosDBModel(CosmosDBModel):
 
 
 def create_dao() -> ActivityDao:
-    repository = CosmosDBRepository.from_definition(container_definition,
-                                                    mapper=ActivityCosmosDBModel)
+    repository = CachedCosmosDBRepository.from_definition(container_definition,
+                                                          mapper=ActivityCosmosDBModel)
 
     class ActivityCosmosDBDao(APICosmosDBDao, ActivityDao):
         def __init__(self):
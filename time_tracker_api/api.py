@@ -3,9 +3,13 @@ from azure.cosmos.exceptions import (
     CosmosResourceNotFoundError,
     CosmosHttpResponseError,
 )
+import concurrent.futures
+from typing import Iterable
+
 from faker import Faker
-from flask import current_app as app, Flask
-from flask_restplus import Api, fields, Model
+from flask import current_app as app, Flask, json, Response
+from flask import stream_with_context
+from flask_restplus import Api, fields, marshal, Model
 from flask_restplus import namespace
 from flask_restplus._http import HTTPStatus
 from flask_restplus.reqparse import RequestParser
@@ -56,6 +60,30 @@ def create_attributes_filter(
     return attribs_parser
 
 
+def stream_list(items: Iterable, model: Model) -> Response:
+    """
+    Responds with the marshalled items as a JSON array that is serialized
+    while it is sent, so the items don't need to be in memory all at once.
+    The first item is read in advance, so any error of the query is still
+    handled by the error handlers.
+    """
+    items = iter(items)
+    first_item = next(items, None)
+
+    def generate():
+        if first_item is None:
+            yield '[]'
+            return
+        yield '[' + json.dumps(marshal(first_item, model))
+        for item in items:
+            yield ',' + json.dumps(marshal(item, model))
+        yield ']'
+
+    return Response(
+        stream_with_context(generate()), mimetype='application/json'
+    )
+
+
 # Custom fields
 class NullableString(fields.String):
     __schema_type__ = ['string', 'null']
@@ -122,6 +150,10 @@ def init_app(app: Flask):
 
     api.add_namespace(users_namespace.ns)
 
+    from time_tracker_api.metrics import metrics_namespace
+
+    api.add_namespace(metrics_namespace.ns)
+
 
 """
 Error handlers
@@ -150,6 +182,15 @@ def handle_cosmos_http_response_error(error):
     )
 
 
+@api.errorhandler(concurrent.futures.TimeoutError)
+def handle_timeout_error(error):
+    app.logger.error(error)
+    return (
+        {'message': 'A service took too long to respond'},
+        HTTPStatus.GATEWAY_TIMEOUT,
+    )
+
+
 @api.errorhandler(AttributeError)
 def handle_attribute_error(error):
     app.logger.error(error)
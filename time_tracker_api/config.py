@@ -13,6 +13,14 @@ class Config:
     DEBUG = True
     CORS_ORIGINS = "*"
     ERROR_404_HELP = False
+    JWT_VERIFICATION_ENABLED = (
+        os.environ.get('JWT_VERIFICATION_ENABLED', "false").lower()
+        not in DISABLE_STR_VALUES
+    )
+    JWT_OPENID_CONFIGURATION_URL = os.environ.get(
+        'JWT_OPENID_CONFIGURATION_URL'
+    )
+    JWT_AUDIENCE = os.environ.get('JWT_AUDIENCE')
 
 
 class DevelopmentConfig(Config):
@@ -33,12 +41,28 @@ class CosmosDB(Config):
     DATABASE_ACCOUNT_URI = os.environ.get('DATABASE_ACCOUNT_URI')
     DATABASE_MASTER_KEY = os.environ.get('DATABASE_MASTER_KEY')
     DATABASE_NAME = os.environ.get('DATABASE_NAME')
+    CHANGE_FEED_ENABLED = (
+        os.environ.get('CHANGE_FEED_ENABLED', "false").lower()
+        not in DISABLE_STR_VALUES
+    )
+    CHANGE_FEED_CONTINUATION_PATH = os.environ.get(
+        'CHANGE_FEED_CONTINUATION_PATH'
+    )
+    WORKED_TIME_ROLLUP_ENABLED = (
+        os.environ.get('WORKED_TIME_ROLLUP_ENABLED', "false").lower()
+        not in DISABLE_STR_VALUES
+    )
+    TIME_ENTRY_TIMESTAMPS_ENABLED = (
+        os.environ.get('TIME_ENTRY_TIMESTAMPS_ENABLED', "false").lower()
+        not in DISABLE_STR_VALUES
+    )
 
 
 class TestConfig(CosmosDB, SQLConfig):
     TESTING = True
     FLASK_DEBUG = True
     TEST_TABLE = 'tests'
+    TIME_ENTRY_TIMESTAMPS_ENABLED = True
     SQL_DATABASE_URI = os.environ.get('SQL_DATABASE_URI')
     SQLALCHEMY_DATABASE_URI = SQL_DATABASE_URI or 'sqlite:///:memory:'
 
@@ -2,7 +2,8 @@ from dataclasses import dataclass
 
 from azure.cosmos import PartitionKey
 
-from commons.data_access_layer.cosmos_db import CosmosDBModel, CosmosDBRepository, CosmosDBDao
+from commons.data_access_layer.cosmos_db import CosmosDBModel, CosmosDBDao
+from commons.data_access_layer.cosmos_db_cache import CachedCosmosDBRepository
 from time_tracker_api.database import CRUDDao, APICosmosDBDao
 
 
@@ -40,8 +41,8 @@ class CustomerCosmosDBModel(CosmosDBModel):
 
 
 def create_dao() -> CustomerDao:
-    repository = CosmosDBRepository.from_definition(container_definition,
-                                                    mapper=CustomerCosmosDBModel)
+    repository = CachedCosmosDBRepository.from_definition(container_definition,
+                                                          mapper=CustomerCosmosDBModel)
 
     class CustomerCosmosDBDao(APICosmosDBDao, CustomerDao):
         def __init__(self):
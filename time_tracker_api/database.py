@@ -53,7 +53,9 @@ class ApiEventContext(EventContext):
 
     @property
     def user_role(self) -> str:
-        return self._user_role if self._user_role else current_role_user()
+        if self._user_role is None:
+            self._user_role = current_role_user()
+        return self._user_role
 
     @property
     def tenant_id(self) -> str:
@@ -69,6 +71,11 @@ class ApiEventContext(EventContext):
     def is_admin(self):
         return True if self.user_role == roles.get("admin").get("name") else False
 
+    def resolve(self):
+        # Each property keeps the claim of the token of the request it reads
+        self.user_id, self.user_role, self.tenant_id
+        return self
+
 
 class APICosmosDBDao(CosmosDBDao):
     def create_event_context(self, action: str = None, description: str = None):
@@ -86,5 +93,18 @@ def init_sql(app: Flask) -> None:
 
 
 def init_cosmos_db(app: Flask) -> None:
-    from commons.data_access_layer.cosmos_db import init_app
-    init_app(app)
+    from commons.data_access_layer import (
+        cosmos_db,
+        cosmos_db_aio,
+        cosmos_db_change_feed,
+    )
+    cosmos_db.init_app(app)
+    cosmos_db_aio.init_app(app)
+    cosmos_db_change_feed.init_app(app)
+
+    from time_tracker_api.time_entries import (
+        time_entries_repository,
+        worked_time_rollup,
+    )
+    time_entries_repository.init_app(app)
+    worked_time_rollup.init_app(app)
@@ -0,0 +1,104 @@
+from flask_restplus import abort, fields, Resource
+from flask_restplus._http import HTTPStatus
+
+from commons.data_access_layer.cosmos_db_cache import cache_stats
+from commons.data_access_layer.cosmos_db_metrics import endpoint_metrics
+from time_tracker_api.api import api
+from time_tracker_api.security import current_role_user, roles
+
+ns = api.namespace(
+    'metrics', description='Namespace of the API for the usage metrics'
+)
+
+# Endpoint metrics Model
+endpoint_metrics_fields = ns.model(
+    'EndpointMetrics',
+    {
+        'endpoint': fields.String(
+            title='Endpoint',
+            description='Method and route of the endpoint',
+            example='GET /time-entries',
+        ),
+        'requests': fields.Integer(
+            title='Requests', description='Requests made to the endpoint'
+        ),
+        'calls': fields.Integer(
+            title='Calls',
+            description='Calls to Cosmos DB made by those requests',
+        ),
+        'request_charge': fields.Float(
+            title='Request charge',
+            description='Request units charged for all the calls',
+        ),
+        'average_request_charge': fields.Float(
+            title='Average request charge',
+            description='Request units charged per request',
+        ),
+        'max_request_charge': fields.Float(
+            title='Maximum request charge',
+            description='Request units charged for the most expensive request',
+        ),
+        'latency_ms': fields.Float(
+            title='Latency',
+            description='Milliseconds spent in the calls to Cosmos DB',
+        ),
+    },
+)
+
+# Cache metrics Model
+cache_metrics_fields = ns.model(
+    'CacheMetrics',
+    {
+        'container': fields.String(
+            title='Container',
+            description='Container whose queries are cached',
+            example='project',
+        ),
+        'hits': fields.Integer(
+            title='Hits', description='Queries answered by the cache'
+        ),
+        'misses': fields.Integer(
+            title='Misses', description='Queries sent to Cosmos DB'
+        ),
+        'hit_ratio': fields.Float(
+            title='Hit ratio', description='Hits out of all the queries'
+        ),
+        'size': fields.Integer(
+            title='Size', description='Results currently in the cache'
+        ),
+    },
+)
+
+
+def check_current_user_is_admin():
+    if current_role_user() != roles['admin']['name']:
+        abort(HTTPStatus.FORBIDDEN, "You don't have enough permissions.")
+
+
+@ns.route('/cosmos-db')
+class CosmosDBMetrics(Resource):
+    @ns.doc('list_cosmos_db_metrics')
+    @ns.marshal_list_with(endpoint_metrics_fields)
+    def get(self):
+        """
+        Cosmos DB usage of every endpoint since the process started, the
+        most RU-heavy endpoints first
+        """
+        check_current_user_is_admin()
+        return endpoint_metrics.snapshot()
+
+
+@ns.route('/cache')
+class CacheMetrics(Resource):
+    @ns.doc('list_cache_metrics')
+    @ns.marshal_list_with(cache_metrics_fields)
+    def get(self):
+        """
+        Hits and misses of the cache of every container since the process
+        started
+        """
+        check_current_user_is_admin()
+        return [
+            dict(stats, container=container_id)
+            for container_id, stats in sorted(cache_stats().items())
+        ]
@@ -5,6 +5,7 @@ from commons.data_access_layer.cosmos_db import (
     CosmosDBDao,
     CosmosDBRepository,
 )
+from commons.data_access_layer.cosmos_db_cache import CachedCosmosDBRepository
 from time_tracker_api.database import CRUDDao, APICosmosDBDao
 from time_tracker_api.customers.customers_model import (
     create_dao as customers_create_dao,
@@ -54,7 +55,7 @@ class ProjectCosmosDBModel(CosmosDBModel):
         return "the project \"%s\"" % self.name  # pragma: no cover
 
 
-class ProjectCosmosDBRepository(CosmosDBRepository):
+class ProjectCosmosDBRepository(CachedCosmosDBRepository):
     def __init__(self):
         CosmosDBRepository.__init__(
             self,
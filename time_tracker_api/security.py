@@ -2,16 +2,30 @@
 This is where we handle everything regarding to authorization
 and authentication. Also stores helper functions related to it.
 """
+import json
+import logging
 import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
 
 import jwt
+import requests
 from faker import Faker
-from flask import request
+from flask import Flask, g, request
 from flask_restplus import abort
 from flask_restplus._http import HTTPStatus
-from jwt import DecodeError, ExpiredSignatureError
+from jwt import (
+    DecodeError,
+    ExpiredSignatureError,
+    InvalidTokenError,
+    PyJWTError,
+)
+from jwt.algorithms import RSAAlgorithm
 
 fake = Faker()
+logger = logging.getLogger(__name__)
 
 dev_secret_key: str = None
 
@@ -38,9 +52,45 @@ roles = {
     "client": {"name": "client-role"},
 }
 
+# Seconds the signing keys are kept before they are fetched again
+JWKS_TTL = 3600
+# Seconds between the fetches caused by tokens signed with unknown keys
+JWKS_MIN_REFRESH_INTERVAL = 60
+JWKS_REQUEST_TIMEOUT = 10
+VERIFIED_TOKENS_MAX_SIZE = 1024
+
+
+class TokenClaims:
+    """
+    Claims of the JWT of a request, along with the values derived from them
+    """
+
+    def __init__(self, authorization: Optional[str], claims: Optional[dict]):
+        self.authorization = authorization
+        self.claims = claims
+        iss_claim = claims.get("iss") if claims else None
+        self.tenant_id = (
+            parse_tenant_id_from_iss_claim(iss_claim) if iss_claim else None
+        )
+        role_user = claims.get("extension_role") if claims else None
+        self.role = role_user if role_user else roles.get("client").get("name")
+
+
+def get_token_claims() -> TokenClaims:
+    """
+    The claims of the current request, decoded only once per request and
+    kept in `flask.g`
+    """
+    authorization = request.headers.get('Authorization')
+    token_claims = g.get('token_claims')
+    if token_claims is None or token_claims.authorization != authorization:
+        token_claims = TokenClaims(authorization, get_token_json())
+        g.token_claims = token_claims
+    return token_claims
+
 
 def current_user_id() -> str:
-    oid_claim = get_token_json().get("oid")
+    oid_claim = get_token_claims().claims.get("oid")
     if oid_claim is None:
         abort(
             message='The claim "oid" is missing in the JWT',
@@ -51,7 +101,7 @@ def current_user_id() -> str:
 
 
 def current_user_email() -> str:
-    email_list_claim = get_token_json().get("emails")
+    email_list_claim = get_token_claims().claims.get("emails")
     if email_list_claim is None:
         abort(
             message='The claim "emails" is missing in the JWT',
@@ -63,19 +113,18 @@ def current_user_email() -> str:
 
 
 def current_role_user() -> str:
-    role_user = get_token_json().get("extension_role", None)
-    return role_user if role_user else roles.get("client").get("name")
+    return get_token_claims().role
 
 
 def current_user_tenant_id() -> str:
-    iss_claim = get_token_json().get("iss")
-    if iss_claim is None:
+    token_claims = get_token_claims()
+    if token_claims.claims.get("iss") is None:
         abort(
             message='The claim "iss" is missing in the JWT',
             code=HTTPStatus.UNAUTHORIZED,
         )
 
-    tenant_id = parse_tenant_id_from_iss_claim(iss_claim)
+    tenant_id = token_claims.tenant_id
     if tenant_id is None:
         abort(
             message='The format of the claim "iss" cannot be understood. '
@@ -109,11 +158,159 @@ def get_or_generate_dev_secret_key():
     return dev_secret_key
 
 
+class JwksClient:
+    """
+    Signing keys of the issuer, taken from the `jwks_uri` of its OpenID
+    configuration. They are fetched again once `ttl` seconds have passed, or
+    when a token is signed with an unknown key, e.g. after a key rotation,
+    at most every `JWKS_MIN_REFRESH_INTERVAL` seconds.
+
+    Only one thread fetches them at a time, without holding the lock of the
+    keys, so the other requests keep verifying with the keys they have.
+    When the fetch fails, the last known keys are kept until the next try.
+    """
+
+    def __init__(
+        self,
+        openid_configuration_url: str,
+        ttl: float = JWKS_TTL,
+        get: Callable = requests.get,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.openid_configuration_url = openid_configuration_url
+        self.ttl = ttl
+        self.get = get
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+        self.keys: Dict[str, object] = {}
+        self.fetched_at: Optional[float] = None
+        self.attempted_at: Optional[float] = None
+
+    def fetch_keys(self) -> Dict[str, object]:
+        openid_configuration = self.get(
+            self.openid_configuration_url, timeout=JWKS_REQUEST_TIMEOUT
+        ).json()
+        jwks = self.get(
+            openid_configuration['jwks_uri'], timeout=JWKS_REQUEST_TIMEOUT
+        ).json()
+        return {
+            jwk['kid']: RSAAlgorithm.from_jwk(json.dumps(jwk))
+            for jwk in jwks['keys']
+            if jwk.get('kty') == 'RSA'
+        }
+
+    def needs_fetch(self, kid: str) -> bool:
+        with self.lock:
+            now = self.clock()
+            if (
+                self.attempted_at is not None
+                and now - self.attempted_at < JWKS_MIN_REFRESH_INTERVAL
+            ):
+                return False
+            return (
+                self.fetched_at is None
+                or now - self.fetched_at >= self.ttl
+                or kid not in self.keys
+            )
+
+    def refresh(self, kid: str) -> None:
+        # Without keys there is nothing to verify with, so the thread waits
+        # for the one that is fetching them
+        if not self.fetch_lock.acquire(blocking=not self.keys):
+            return
+        try:
+            if not self.needs_fetch(kid):
+                return
+            with self.lock:
+                self.attempted_at = self.clock()
+            try:
+                keys = self.fetch_keys()
+            except Exception as e:
+                logger.warning("JWT signing keys could not be fetched: %s", e)
+                return
+            with self.lock:
+                self.keys = keys
+                self.fetched_at = self.clock()
+        finally:
+            self.fetch_lock.release()
+
+    def get_signing_key(self, kid: str):
+        if self.needs_fetch(kid):
+            self.refresh(kid)
+        with self.lock:
+            key = self.keys.get(kid)
+        if key is None:
+            raise InvalidTokenError('The signing key is unknown')
+        return key
+
+
+class JwtVerifier:
+    """
+    Verifies the signature, the expiration and the audience of the tokens
+    with the keys of `jwks_client`. The claims of the verified tokens are
+    kept until the tokens expire, so each token is verified only once.
+    """
+
+    def __init__(
+        self,
+        jwks_client: JwksClient,
+        audience: str = None,
+        max_size: int = VERIFIED_TOKENS_MAX_SIZE,
+    ):
+        self.jwks_client = jwks_client
+        self.audience = audience
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.verified_tokens: OrderedDict = OrderedDict()
+
+    def verify(self, token: str) -> dict:
+        with self.lock:
+            entry = self.verified_tokens.get(token)
+            if entry is not None and entry[0] > time.time():
+                self.verified_tokens.move_to_end(token)
+                return entry[1]
+
+        key = self.jwks_client.get_signing_key(
+            jwt.get_unverified_header(token).get('kid')
+        )
+        claims = jwt.decode(
+            token,
+            key=key,
+            algorithms=['RS256'],
+            audience=self.audience,
+            options={'require_exp': True, 'verify_aud': bool(self.audience)},
+        )
+
+        with self.lock:
+            self.verified_tokens[token] = (claims['exp'], claims)
+            self.verified_tokens.move_to_end(token)
+            while len(self.verified_tokens) > self.max_size:
+                self.verified_tokens.popitem(last=False)
+        return claims
+
+
+jwt_verifier: JwtVerifier = None
+
+
+def init_app(app: Flask) -> None:
+    global jwt_verifier
+    if app.config.get('JWT_VERIFICATION_ENABLED'):
+        jwt_verifier = JwtVerifier(
+            JwksClient(app.config['JWT_OPENID_CONFIGURATION_URL']),
+            audience=app.config.get('JWT_AUDIENCE'),
+        )
+    else:
+        jwt_verifier = None
+
+
 def parse_jwt(authentication_header_content):
     if authentication_header_content is not None:
         parsed_content = authentication_header_content.split("Bearer ")
 
         if len(parsed_content) > 1:
+            if jwt_verifier is not None:
+                return jwt_verifier.verify(parsed_content[1])
             return jwt.decode(parsed_content[1], verify=False)
 
     return None
@@ -131,6 +328,8 @@ def get_token_json():
         abort(message='Malformed token', code=HTTPStatus.UNAUTHORIZED)
     except ExpiredSignatureError:
         abort(message='Expired token', code=HTTPStatus.UNAUTHORIZED)
+    except PyJWTError:
+        abort(message='Invalid token', code=HTTPStatus.UNAUTHORIZED)
 
 
 def parse_tenant_id_from_iss_claim(iss_claim: str) -> str:
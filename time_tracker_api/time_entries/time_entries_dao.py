@@ -1,8 +1,18 @@
 import abc
+import asyncio
+import json
+from functools import partial
+from itertools import islice
+from typing import Iterator
+
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+
 from commons.data_access_layer.cosmos_db import (
     CosmosDBDao,
     CustomError,
+    sql_literal,
 )
+from commons.data_access_layer.cosmos_db_aio import run_async
 from utils.extend_model import (
     add_project_info_to_time_entries,
     add_activity_name_to_time_entries,
@@ -11,6 +21,7 @@ from utils.extend_model import (
 from utils.time import (
     datetime_str,
     str_to_datetime,
+    str_to_timestamp,
     get_current_year,
     get_current_month,
     get_date_range_of_month,
@@ -18,17 +29,26 @@ from utils.time import (
 )
 from flask_restplus import abort
 from flask_restplus._http import HTTPStatus
-from time_tracker_api.activities import activities_model
-
 from time_tracker_api.projects import projects_model
 from utils import worked_time
+from utils.concurrency import in_background
 from datetime import timedelta
+from time_tracker_api.time_entries.time_entries_model import (
+    TimeEntryCosmosDBModel,
+)
 from time_tracker_api.time_entries.time_entries_repository import (
+    COSMOS_DB_LOOKUP_TIMEOUT,
+    AsyncTimeEntryCosmosDBRepository,
     TimeEntryCosmosDBRepository,
+    records_total_cache,
 )
+from time_tracker_api.time_entries import worked_time_rollup
 from time_tracker_api.database import CRUDDao, APICosmosDBDao
 from time_tracker_api.security import current_user_id
-from utils.azure_users import AzureConnection
+from utils.azure_users import azure_directory
+
+# Seconds counting the records of the paginated time entries can take
+RECORDS_TOTAL_TIMEOUT = 10
 
 
 class TimeEntriesDao(CRUDDao):
@@ -46,8 +66,13 @@ class TimeEntriesDao(CRUDDao):
 
 
 class TimeEntriesCosmosDBDao(APICosmosDBDao, TimeEntriesDao):
-    def __init__(self, repository):
+    def __init__(
+        self,
+        repository: TimeEntryCosmosDBRepository,
+        async_repository: AsyncTimeEntryCosmosDBRepository = None,
+    ):
         CosmosDBDao.__init__(self, repository)
+        self.async_repository = async_repository
 
     def check_whether_current_user_owns_item(self, data):
         if data.owner_id is not None and data.owner_id != current_user_id():
@@ -63,6 +88,13 @@ class TimeEntriesCosmosDBDao(APICosmosDBDao, TimeEntriesDao):
                 "The specified time entry is already stopped",
             )
 
+    def check_time_entry_is_unchanged(self, data: dict, current_data: dict):
+        if data.get('_etag') != current_data.get('_etag'):
+            raise CustomError(
+                HTTPStatus.CONFLICT,
+                "The time entry was changed by another request, try again",
+            )
+
     def check_time_entry_is_not_started(self, data):
         if data.end_date is None:
             raise CustomError(
@@ -92,6 +124,9 @@ class TimeEntriesCosmosDBDao(APICosmosDBDao, TimeEntriesDao):
         return custom_query
 
     def get_all(self, conditions: dict = None, **kwargs) -> list:
+        return list(self.iter_all(conditions, **kwargs))
+
+    def iter_all(self, conditions: dict = None, **kwargs) -> Iterator:
         event_ctx = self.create_event_context("read-many")
         conditions.update({"owner_id": event_ctx.user_id})
         is_complete_query = conditions.get("user_id") == '*'
@@ -102,32 +137,32 @@ class TimeEntriesCosmosDBDao(APICosmosDBDao, TimeEntriesDao):
         date_range = self.handle_date_filter_args(args=conditions)
         limit = conditions.get("limit", None)
         conditions.pop("limit", None)
-        azure_connection = AzureConnection()
-        current_user_is_tester = azure_connection.is_test_user(
+        current_user_is_tester = azure_directory.is_test_user(
             event_ctx.user_id
         )
-        time_entries_list = self.repository.find_all(
+        time_entries = self.repository.iter_all(
             event_ctx,
             conditions=conditions,
             custom_sql_conditions=custom_query,
             date_range=date_range,
-            max_count=limit,
+            page_size=limit,
         )
+        if limit:
+            time_entries = islice(time_entries, limit)
         if not current_user_is_tester and is_complete_query:
-            test_user_ids = azure_connection.get_test_user_ids()
-            time_entries_list = [
+            test_user_ids = azure_directory.get_test_user_ids()
+            return (
                 time_entry
-                for time_entry in time_entries_list
+                for time_entry in time_entries
                 if time_entry.owner_id not in test_user_ids
-            ]
-            return time_entries_list
+            )
         else:
-            return time_entries_list
+            return time_entries
 
     def get_lastest_entries_by_project(
         self, conditions: dict = None, **kwargs
     ) -> list:
-        event_ctx = self.create_event_context("read-many")
+        event_ctx = self.create_event_context("read-many").resolve()
         conditions.update({"owner_id": event_ctx.user_id})
         custom_query = self.build_custom_query(
             is_admin=event_ctx.is_admin,
@@ -135,78 +170,132 @@ class TimeEntriesCosmosDBDao(APICosmosDBDao, TimeEntriesDao):
         )
         date_range = self.handle_date_filter_args(args=conditions)
 
-        project_dao = projects_model.create_dao()
-        projects = project_dao.get_all()
-        projects_ids = [project.id for project in projects]
-
-        activity_dao = activities_model.create_dao()
-        activities = activity_dao.get_all(
-            visible_only=False,
+        projects, activities, time_entries = run_async(
+            self.find_latest_entries_lookups(
+                event_ctx, conditions, custom_query, date_range
+            ),
+            COSMOS_DB_LOOKUP_TIMEOUT,
         )
 
-        result = []
-        for id_project in projects_ids:
-            conditions.update({"project_id": id_project})
-
-            limit = 1
-            latest = self.repository.find_all_entries(
-                event_ctx,
-                conditions=conditions,
-                custom_sql_conditions=custom_query,
-                date_range=date_range,
-                max_count=limit,
-            )
-
-            if len(latest) > 0:
-                result.append(latest[0])
+        latest_by_project = {}
+        for time_entry in time_entries:
+            latest_by_project.setdefault(time_entry.project_id, time_entry)
+        result = [
+            latest_by_project[project.id]
+            for project in projects
+            if project.id in latest_by_project
+        ]
 
         add_activity_name_to_time_entries(result, activities)
         add_project_info_to_time_entries(result, projects)
 
         return result
 
+    async def find_latest_entries_lookups(
+        self,
+        event_ctx,
+        conditions: dict,
+        custom_query: list,
+        date_range: dict,
+    ) -> list:
+        """
+        The active projects, the activities and the time entries in the
+        range, awaited at the same time. There is one query for the entries
+        of every project, instead of one per project, newest first, so the
+        first entry of each project is its latest.
+        """
+        return await asyncio.gather(
+            self.async_repository.find_projects(event_ctx),
+            self.async_repository.activity_repository.find_all(
+                event_ctx, visible_only=False
+            ),
+            self.async_repository.find_all_entries(
+                event_ctx,
+                conditions=conditions,
+                custom_sql_conditions=custom_query,
+                date_range=date_range,
+            ),
+        )
+
     def get_all_paginated(self, conditions: dict = None, **kwargs) -> list:
-        get_all_conditions = dict(conditions)
-        get_all_conditions.pop("length")
-        get_all_conditions.pop("start")
         event_ctx = self.create_event_context("read-many")
-        get_all_conditions.update({"owner_id": event_ctx.user_id})
-        custom_query = self.build_custom_query(
-            is_admin=event_ctx.is_admin,
-            conditions=get_all_conditions,
-        )
-        date_range = self.handle_date_filter_args(args=get_all_conditions)
-        records_total = self.repository.count(
-            event_ctx,
-            conditions=get_all_conditions,
-            custom_sql_conditions=custom_query,
-            date_range=date_range,
-        )
+        length = conditions.pop("length")
+        start = conditions.pop("start", None)
+        continuation_token = conditions.pop("continuation_token", None)
         conditions.update({"owner_id": event_ctx.user_id})
         custom_query = self.build_custom_query(
             is_admin=event_ctx.is_admin,
             conditions=conditions,
         )
         date_range = self.handle_date_filter_args(args=conditions)
-        length = conditions.get("length", None)
-        conditions.pop("length", None)
-        start = conditions.get("start", None)
-        conditions.pop("start", None)
-
-        time_entries = self.repository.find_all(
-            event_ctx,
-            conditions=conditions,
-            custom_sql_conditions=custom_query,
-            date_range=date_range,
-            max_count=length,
-            offset=start,
+        # The total is counted while the page is found. The repository
+        # extends the custom conditions it is given, so each query gets
+        # its own copy.
+        records_total = in_background(
+            partial(
+                self.count_records,
+                event_ctx,
+                dict(conditions),
+                list(custom_query),
+                dict(date_range),
+            )
         )
 
+        if start and not continuation_token:
+            # Offset paging is kept for the clients that don't send the
+            # continuation token yet
+            time_entries = self.repository.find_all(
+                event_ctx,
+                conditions=conditions,
+                custom_sql_conditions=list(custom_query),
+                date_range=date_range,
+                max_count=length,
+                offset=start,
+            )
+        else:
+            time_entries, continuation_token = self.repository.find_page(
+                event_ctx,
+                conditions=conditions,
+                custom_sql_conditions=list(custom_query),
+                date_range=date_range,
+                page_size=length,
+                continuation_token=continuation_token,
+            )
+
         return {
-            'records_total': records_total,
+            'records_total': records_total.result(RECORDS_TOTAL_TIMEOUT),
             'data': time_entries,
+            'continuation_token': continuation_token,
         }
 
+    def count_records(
+        self,
+        event_ctx,
+        conditions: dict,
+        custom_query: list,
+        date_range: dict,
+    ) -> int:
+        """
+        Number of time entries that match the filters. It is kept for
+        `RECORDS_TOTAL_TTL` seconds, as the tables ask for it again with
+        every page, and forgotten when the repository writes a time entry of
+        the tenant.
+        """
+        key = json.dumps(
+            [conditions, custom_query, date_range], sort_keys=True, default=str
+        )
+        return records_total_cache.get_or_load(
+            event_ctx.tenant_id,
+            key,
+            partial(
+                self.repository.count,
+                event_ctx,
+                conditions=conditions,
+                custom_sql_conditions=list(custom_query),
+                date_range=date_range,
+            ),
+        )
+
     def get(self, id):
         event_ctx = self.create_event_context("read")
 
@@ -223,52 +312,120 @@ class TimeEntriesCosmosDBDao(APICosmosDBDao, TimeEntriesDao):
         data['owner_id'] = event_ctx.user_id
         return self.repository.create(data, event_ctx)
 
+    def find_own_item(self, id, event_ctx) -> dict:
+        """
+        The stored time entry, as it is needed to update it, after checking
+        that it belongs to the current user
+        """
+        time_entry_data = self.repository.find(id, event_ctx, mapper=dict)
+        self.check_whether_current_user_owns_item(
+            TimeEntryCosmosDBModel(time_entry_data)
+        )
+        return time_entry_data
+
     def update(self, id, data: dict, description=None):
         event_ctx = self.create_event_context("update", description)
 
-        time_entry = self.repository.find(id, event_ctx)
-        self.check_whether_current_user_owns_item(time_entry)
+        time_entry_data = self.find_own_item(id, event_ctx)
 
         return self.repository.partial_update(
             id,
             data,
             event_ctx,
+            current_item=time_entry_data,
+        )
+
+    @staticmethod
+    def create_sql_owner_condition(owner_id: str) -> str:
+        return (
+            '(NOT IS_DEFINED(c.owner_id) OR c.owner_id = null OR '
+            'c.owner_id = %s)' % sql_literal(owner_id)
         )
 
     def stop(self, id):
         event_ctx = self.create_event_context("update", "Stop time entry")
+        end_date = current_datetime_str()
 
-        time_entry = self.repository.find(id, event_ctx)
-        self.check_whether_current_user_owns_item(time_entry)
-        self.check_time_entry_is_not_stopped(time_entry)
-
-        return self.repository.partial_update(
-            id,
-            {'end_date': current_datetime_str()},
-            event_ctx,
+        time_entry_data = self.find_own_item(id, event_ctx)
+        self.check_time_entry_is_not_stopped(
+            TimeEntryCosmosDBModel(time_entry_data)
+        )
+        collision = self.repository.find_interception_with_date_range(
+            start_date=time_entry_data.get('start_date'),
+            end_date=end_date,
+            owner_id=event_ctx.user_id,
+            tenant_id=event_ctx.tenant_id,
+            ignore_id=id,
         )
+        self.repository.check_no_collision(collision)
+
+        # Stopped only if it didn't change since it was checked, so no one
+        # sees it overlapping another time entry
+        end_ts = str_to_timestamp(end_date)
+        try:
+            return self.repository.patch(
+                id,
+                event_ctx,
+                set_values={'end_date': end_date},
+                filter_predicate='c.start_ts < %s' % sql_literal(end_ts),
+                etag=time_entry_data.get('_etag'),
+            )
+        except CosmosAccessConditionFailedError:
+            current_data = self.repository.find(id, event_ctx, mapper=dict)
+        self.check_time_entry_is_unchanged(time_entry_data, current_data)
+        if str_to_timestamp(current_data['start_date']) >= end_ts:
+            raise CustomError(
+                HTTPStatus.UNPROCESSABLE_ENTITY,
+                "You must end the time entry after it started",
+            )
+
+        # It was stored before `start_ts` existed, so the filter can't
+        # match it, but its dates were just checked
+        try:
+            return self.repository.patch(
+                id,
+                event_ctx,
+                set_values={'end_date': end_date},
+                etag=current_data.get('_etag'),
+            )
+        except CosmosAccessConditionFailedError:
+            self.check_time_entry_is_unchanged(
+                current_data, self.repository.find(id, event_ctx, mapper=dict)
+            )
+            raise
 
     def restart(self, id):
         event_ctx = self.create_event_context("update", "Restart time entry")
 
-        time_entry = self.repository.find(id, event_ctx)
-        self.check_whether_current_user_owns_item(time_entry)
-        self.check_time_entry_is_not_started(time_entry)
+        time_entry_data = self.find_own_item(id, event_ctx)
+        self.check_time_entry_is_not_started(
+            TimeEntryCosmosDBModel(time_entry_data)
+        )
+        self.repository.validate_data(
+            dict(time_entry_data, end_date=None), event_ctx
+        )
 
-        return self.repository.partial_update(
+        return self.repository.patch(
             id,
-            {'end_date': None},
             event_ctx,
+            set_values={'end_date': None},
+            etag=time_entry_data.get('_etag'),
         )
 
     def delete(self, id):
         event_ctx = self.create_event_context("delete")
-        time_entry = self.repository.find(id, event_ctx)
-        self.check_whether_current_user_owns_item(time_entry)
-        self.repository.delete(
-            id,
-            event_ctx,
-        )
+        try:
+            self.repository.delete(
+                id,
+                event_ctx,
+                filter_predicate=self.create_sql_owner_condition(
+                    event_ctx.user_id
+                ),
+            )
+        except CosmosAccessConditionFailedError:
+            time_entry = self.repository.find(id, event_ctx)
+            self.check_whether_current_user_owns_item(time_entry)
+            raise
 
     def find_running(self):
         event_ctx = self.create_event_context("find_running")
@@ -282,6 +439,19 @@ class TimeEntriesCosmosDBDao(APICosmosDBDao, TimeEntriesDao):
             "read", "Summary of worked time in the current month"
         )
 
+        time_offset = (
+            args.get('time_offset') or worked_time.DEFAULT_TIME_OFFSET
+        )
+        rollup = worked_time_rollup.rollup
+        if rollup is not None and rollup.time_offset == time_offset:
+            return rollup.summary(
+                event_ctx.tenant_id,
+                event_ctx.user_id,
+                lambda date: self.repository.find_entries_ending_after(
+                    event_ctx, event_ctx.user_id, date
+                ),
+            )
+
         conditions = {"owner_id": event_ctx.user_id}
         time_entries = self.repository.find_all_entries(
             event_ctx,
@@ -315,4 +485,6 @@ class TimeEntriesCosmosDBDao(APICosmosDBDao, TimeEntriesDao):
 def create_dao() -> TimeEntriesDao:
     repository = TimeEntryCosmosDBRepository()
 
-    return TimeEntriesCosmosDBDao(repository)
+    return TimeEntriesCosmosDBDao(
+        repository, AsyncTimeEntryCosmosDBRepository(repository)
+    )
@@ -45,6 +45,25 @@ container_definition = {
     'unique_key_policy': {
         'uniqueKeys': [{'paths': ['/owner_id', '/end_date', '/deleted']}]
     },
+    'indexing_policy': {
+        'indexingMode': 'consistent',
+        'includedPaths': [{'path': '/*'}],
+        'excludedPaths': [{'path': '/"_etag"/?'}],
+        'compositeIndexes': [
+            [
+                {'path': '/owner_id', 'order': 'ascending'},
+                {'path': '/start_ts', 'order': 'descending'},
+            ],
+            [
+                {'path': '/tenant_id', 'order': 'ascending'},
+                {'path': '/start_ts', 'order': 'descending'},
+            ],
+            [
+                {'path': '/owner_id', 'order': 'ascending'},
+                {'path': '/end_ts', 'order': 'ascending'},
+            ],
+        ],
+    },
 }
 
 
@@ -15,6 +15,7 @@ from time_tracker_api.api import (
     UUID,
     NullableString,
     remove_required_constraint,
+    stream_list,
 )
 from time_tracker_api.time_entries.time_entries_dao import create_dao
 
@@ -231,12 +232,14 @@ attributes_filter.add_argument(
 class TimeEntries(Resource):
     @ns.doc('list_time_entries')
     @ns.expect(attributes_filter)
-    @ns.marshal_list_with(time_entry)
+    @ns.response(HTTPStatus.OK, 'Success', [time_entry])
     @ns.response(HTTPStatus.NOT_FOUND, 'Time entry not found')
     def get(self):
         """List all time entries"""
         conditions = attributes_filter.parse_args()
-        return time_entries_dao.get_all(conditions=conditions)
+        return stream_list(
+            time_entries_dao.iter_all(conditions=conditions), time_entry
+        )
 
     @ns.doc('create_time_entry')
     @ns.expect(time_entry_input)
@@ -376,6 +379,10 @@ time_entry_paginated = ns.model(
             description='Total number of entries.',
         ),
         'data': fields.List(fields.Nested(time_entry)),
+        'continuation_token': fields.String(
+            title='Continuation token',
+            description='Token to request the next page. It is null on the last page.',
+        ),
     },
 )
 
@@ -390,9 +397,18 @@ paginated_attribs_parser.add_argument(
 
 paginated_attribs_parser.add_argument(
     'start',
-    required=True,
+    required=False,
+    store_missing=False,
     type=int,
-    help="(Filter) The number of rows to be removed from the query. (aka offset)",
+    help="(Filter) The number of rows to be removed from the query. (aka offset). Prefer continuation_token",
+    location='args',
+)
+
+paginated_attribs_parser.add_argument(
+    'continuation_token',
+    required=False,
+    store_missing=False,
+    help="(Filter) The continuation_token returned with the previous page",
     location='args',
 )
 
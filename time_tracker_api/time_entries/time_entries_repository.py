@@ -1,40 +1,86 @@
+import asyncio
+from functools import partial
+
+import azure.cosmos.exceptions as exceptions
+from azure.core import MatchConditions
+
 from commons.data_access_layer.cosmos_db import (
     CosmosDBRepository,
     CustomError,
 )
+from commons.data_access_layer.cosmos_db_aio import (
+    AsyncCachedCosmosDBRepository,
+    AsyncCosmosDBFacade,
+    AsyncCosmosDBRepository,
+)
+from commons.data_access_layer.cosmos_db_cache import (
+    InvalidateOnWriteMixin,
+    ReadThroughCache,
+)
 
 from time_tracker_api.time_entries.time_entries_model import (
     container_definition,
     TimeEntryCosmosDBModel,
 )
 
+from utils.concurrency import fan_out
 from utils.time import (
     current_datetime_str,
+    str_to_timestamp,
 )
 
 from utils.extend_model import (
-    add_project_info_to_time_entries,
-    add_activity_name_to_time_entries,
-    create_in_condition,
-    add_user_email_to_time_entries,
+    add_complementary_info_to_time_entries,
+    add_customer_name_to_projects,
 )
 
+from flask import Flask
 from flask_restplus import abort
 from flask_restplus._http import HTTPStatus
-from utils.azure_users import AzureConnection
+from utils.azure_users import azure_directory
 from time_tracker_api.activities import activities_model
 from commons.data_access_layer.database import EventContext
-from typing import List, Callable
+from typing import List, Callable, Tuple
 from time_tracker_api.projects import projects_model
+from time_tracker_api.customers import customers_model
+from datetime import datetime
+
+# The dates are also stored as milliseconds since the epoch, in `start_ts`
+# and `end_ts`, for the range queries. The running entries end at the
+# largest timestamp, so their overlaps are found by the same range query.
+RUNNING_END_TS = 2**53 - 1
+TIMESTAMP_FIELDS = {'start_date': 'start_ts', 'end_date': 'end_ts'}
+
+# The date range filters and the order of the time entries only use
+# `start_ts` and `end_ts` with `TIME_ENTRY_TIMESTAMPS_ENABLED`, once the 04
+# migration added them to the time entries stored before. Until then they
+# use the dates, which every time entry has.
+timestamps_enabled = False
+
+# Seconds the lookups that complete the time entries can take
+COSMOS_DB_LOOKUP_TIMEOUT = 10
+USERS_TIMEOUT = 20
 
+# Seconds the totals of records of the paginated time entries are kept.
+# The repository forgets the totals of a tenant when it writes any of its
+# time entries.
+RECORDS_TOTAL_TTL = 10
 
-class TimeEntryCosmosDBRepository(CosmosDBRepository):
+records_total_cache = ReadThroughCache(ttl=RECORDS_TOTAL_TTL)
+
+
+def init_app(app: Flask) -> None:
+    global timestamps_enabled
+    timestamps_enabled = bool(app.config.get('TIME_ENTRY_TIMESTAMPS_ENABLED'))
+
+
+class TimeEntryCosmosDBRepository(InvalidateOnWriteMixin, CosmosDBRepository):
     def __init__(self):
         CosmosDBRepository.__init__(
             self,
             container_id=container_definition['id'],
             partition_key_attribute='tenant_id',
-            order_fields=['start_date DESC'],
+            order_fields=['start_ts DESC'],
             mapper=TimeEntryCosmosDBModel,
         )
 
@@ -45,16 +91,43 @@ class TimeEntryCosmosDBRepository(CosmosDBRepository):
         else:
             return "AND c.id!=@ignore_id"
 
+    def create_sql_order_clause(self):
+        if not timestamps_enabled:
+            return "ORDER BY c.start_date DESC"
+        return CosmosDBRepository.create_sql_order_clause(self)
+
     @staticmethod
     def create_sql_date_range_filter(date_range: dict) -> str:
         if 'start_date' and 'end_date' in date_range:
+            if not timestamps_enabled:
+                return """
+                ((c.start_date BETWEEN @start_date AND @end_date) OR
+                 (c.end_date BETWEEN @start_date AND @end_date))
+                """
             return """
-            ((c.start_date BETWEEN @start_date AND @end_date) OR
-             (c.end_date BETWEEN @start_date AND @end_date))
+            ((c.start_ts BETWEEN @start_ts AND @end_ts) OR
+             (c.end_ts BETWEEN @start_ts AND @end_ts))
             """
         else:
             return ''
 
+    @staticmethod
+    def generate_date_range_params(date_range: dict) -> list:
+        if not timestamps_enabled:
+            return [
+                {"name": "@%s" % date_field, "value": value}
+                for date_field, value in date_range.items()
+                if date_field in TIMESTAMP_FIELDS
+            ]
+        return [
+            {
+                "name": "@%s" % TIMESTAMP_FIELDS[date_field],
+                "value": str_to_timestamp(value),
+            }
+            for date_field, value in date_range.items()
+            if date_field in TIMESTAMP_FIELDS
+        ]
+
     def find_all_entries(
         self,
         event_context: EventContext,
@@ -73,7 +146,7 @@ class TimeEntryCosmosDBRepository(CosmosDBRepository):
             self.create_sql_date_range_filter(date_range)
         )
 
-        custom_params = self.generate_params(date_range)
+        custom_params = self.generate_date_range_params(date_range)
         time_entries = CosmosDBRepository.find_all(
             self,
             event_context=event_context,
@@ -103,7 +176,7 @@ class TimeEntryCosmosDBRepository(CosmosDBRepository):
             self.create_sql_date_range_filter(date_range)
         )
 
-        custom_params = self.generate_params(date_range)
+        custom_params = self.generate_date_range_params(date_range)
         counter = CosmosDBRepository.count(
             self,
             event_context=event_context,
@@ -131,7 +204,7 @@ class TimeEntryCosmosDBRepository(CosmosDBRepository):
             self.create_sql_date_range_filter(date_range)
         )
 
-        custom_params = self.generate_params(date_range)
+        custom_params = self.generate_date_range_params(date_range)
         time_entries = CosmosDBRepository.find_all(
             self,
             event_context=event_context,
@@ -143,50 +216,250 @@ class TimeEntryCosmosDBRepository(CosmosDBRepository):
         )
 
         if time_entries:
-            custom_conditions = create_in_condition(time_entries, "project_id")
-            custom_conditions_activity = create_in_condition(
-                time_entries, "activity_id"
-            )
+            self.add_complementary_info(time_entries)
+        elif not time_entries and len(conditions) > 1:
+            abort(HTTPStatus.NOT_FOUND, "Time entry not found")
+        return time_entries
 
-            project_dao = projects_model.create_dao()
-            projects = project_dao.get_all(
-                custom_sql_conditions=[custom_conditions],
-                visible_only=False,
-                max_count=kwargs.get("max_count", None),
-            )
+    def find_page(
+        self,
+        event_context: EventContext,
+        conditions: dict = None,
+        custom_sql_conditions: List[str] = None,
+        date_range: dict = None,
+        **kwargs,
+    ):
+        conditions = conditions if conditions else {}
+        custom_sql_conditions = (
+            custom_sql_conditions if custom_sql_conditions else []
+        )
+        date_range = date_range if date_range else {}
 
-            add_project_info_to_time_entries(time_entries, projects)
+        custom_sql_conditions.append(
+            self.create_sql_date_range_filter(date_range)
+        )
 
-            activity_dao = activities_model.create_dao()
-            activities = activity_dao.get_all(
-                custom_sql_conditions=[custom_conditions_activity],
-                visible_only=False,
-                max_count=kwargs.get("max_count", None),
-            )
-            add_activity_name_to_time_entries(time_entries, activities)
+        custom_params = self.generate_date_range_params(date_range)
+        time_entries, continuation_token = CosmosDBRepository.find_page(
+            self,
+            event_context=event_context,
+            conditions=conditions,
+            custom_sql_conditions=custom_sql_conditions,
+            custom_params=custom_params,
+            page_size=kwargs.get("page_size", None),
+            continuation_token=kwargs.get("continuation_token", None),
+        )
 
-            users = AzureConnection().users()
-            add_user_email_to_time_entries(time_entries, users)
-        elif not time_entries and len(conditions) > 1:
+        if time_entries:
+            self.add_complementary_info(time_entries)
+        return time_entries, continuation_token
+
+    def iter_pages(
+        self,
+        event_context: EventContext,
+        conditions: dict = None,
+        custom_sql_conditions: List[str] = None,
+        date_range: dict = None,
+        **kwargs,
+    ):
+        conditions = conditions if conditions else {}
+        custom_sql_conditions = (
+            custom_sql_conditions if custom_sql_conditions else []
+        )
+        date_range = date_range if date_range else {}
+
+        custom_sql_conditions.append(
+            self.create_sql_date_range_filter(date_range)
+        )
+
+        custom_params = self.generate_date_range_params(date_range)
+        pages = CosmosDBRepository.iter_pages(
+            self,
+            event_context=event_context,
+            conditions=conditions,
+            custom_sql_conditions=custom_sql_conditions,
+            custom_params=custom_params,
+            page_size=kwargs.get("page_size", None),
+        )
+
+        found_any = False
+        for time_entries in pages:
+            if time_entries:
+                found_any = True
+                self.add_complementary_info(time_entries)
+            yield time_entries
+
+        if not found_any and len(conditions) > 1:
             abort(HTTPStatus.NOT_FOUND, "Time entry not found")
-        return time_entries
+
+    def add_complementary_info(self, time_entries: list, users: list = None):
+        """
+        Adds the project, customer, activity and owner info to the time
+        entries. The projects, customers and activities are the cached
+        lists of the whole tenant, so the pages after the first one don't
+        query them again.
+        """
+        activity_dao = activities_model.create_dao()
+        calls = [
+            (self.find_projects, COSMOS_DB_LOOKUP_TIMEOUT),
+            (
+                partial(activity_dao.get_all, visible_only=False),
+                COSMOS_DB_LOOKUP_TIMEOUT,
+            ),
+        ]
+        if users is None:
+            calls.append(
+                (
+                    partial(
+                        azure_directory.users_by_ids,
+                        {time_entry.owner_id for time_entry in time_entries},
+                    ),
+                    USERS_TIMEOUT,
+                )
+            )
+        projects, activities, *fetched_users = fan_out(*calls)
+        users = fetched_users[0] if fetched_users else users
+        add_complementary_info_to_time_entries(
+            time_entries, projects, activities, users
+        )
+
+    @staticmethod
+    def find_projects() -> list:
+        """
+        The projects of the tenant whose customer is active, with the name
+        of the customer, as `ProjectCosmosDBDao.get_all` returns them
+        """
+        project_dao = projects_model.create_dao()
+        projects = project_dao.repository.find_all(
+            project_dao.create_event_context("read-many"),
+            visible_only=False,
+        )
+        if not projects:
+            return []
+        customers = customers_model.create_dao().get_all()
+        customers_id = {customer.id for customer in customers}
+        projects = [
+            project
+            for project in projects
+            if project.customer_id in customers_id
+        ]
+        add_customer_name_to_projects(projects, customers)
+        return projects
 
     def on_create(self, new_item_data: dict, event_context: EventContext):
+        self.prepare_new_item(new_item_data, event_context)
+        self.validate_data(new_item_data, event_context)
+
+    def prepare_new_item(
+        self, new_item_data: dict, event_context: EventContext
+    ):
+        """
+        The part of `on_create` that doesn't query Cosmos DB
+        """
         CosmosDBRepository.on_create(self, new_item_data, event_context)
 
         if new_item_data.get("start_date") is None:
             new_item_data['start_date'] = current_datetime_str()
 
-        self.validate_data(new_item_data, event_context)
+        self.add_timestamps(new_item_data)
+        new_item_data.setdefault('end_ts', RUNNING_END_TS)
 
     def on_update(self, updated_item_data: dict, event_context: EventContext):
         CosmosDBRepository.on_update(self, updated_item_data, event_context)
         is_update_to_delete = 'deleted' in updated_item_data
         if not is_update_to_delete:
             self.validate_data(updated_item_data, event_context)
+        self.prepare_updated_item(updated_item_data)
+
+    def prepare_updated_item(self, updated_item_data: dict):
+        """
+        The part of `on_update` that runs after the validation
+        """
         self.replace_empty_value_per_none(updated_item_data)
+        self.add_timestamps(updated_item_data)
 
-    def find_interception_with_date_range(
+    def on_bulk_write(self, item_data: dict, event_context: EventContext):
+        CosmosDBRepository.on_bulk_write(self, item_data, event_context)
+        self.add_timestamps(item_data)
+        item_data.setdefault('end_ts', RUNNING_END_TS)
+
+    @staticmethod
+    def add_timestamps(data: dict) -> None:
+        if data.get('start_date'):
+            data['start_ts'] = str_to_timestamp(data['start_date'])
+        if 'end_date' in data:
+            data['end_ts'] = (
+                str_to_timestamp(data['end_date'])
+                if data['end_date']
+                else RUNNING_END_TS
+            )
+
+    def backfill_timestamps(self) -> int:
+        """
+        Sets `start_ts` and `end_ts` of the time entries that lack them or
+        whose timestamps no longer match their dates, e.g. the entries
+        written by the instances that ran before the timestamps existed.
+        An entry that changes while it is being patched is left for the
+        next run, so it can be run again after the last of those instances
+        is stopped.
+
+        :return: The number of time entries updated
+        """
+        time_entries = self.container.query_items(
+            query="""
+            SELECT c.id, c.tenant_id, c.start_date, c.end_date,
+                   c.start_ts, c.end_ts, c._etag FROM c
+            """,
+            enable_cross_partition_query=True,
+            tags=self.call_tags('backfill_timestamps'),
+        )
+        updated = 0
+        for time_entry in time_entries:
+            timestamps = {
+                'start_date': time_entry.get('start_date'),
+                'end_date': time_entry.get('end_date'),
+            }
+            self.add_timestamps(timestamps)
+            patch_operations = [
+                {
+                    'op': 'set',
+                    'path': '/%s' % field,
+                    'value': timestamps[field],
+                }
+                for field in TIMESTAMP_FIELDS.values()
+                if field in timestamps
+                and time_entry.get(field) != timestamps[field]
+            ]
+            if not patch_operations:
+                continue
+            try:
+                self.container.patch_item(
+                    time_entry['id'],
+                    time_entry['tenant_id'],
+                    patch_operations,
+                    etag=time_entry['_etag'],
+                    match_condition=MatchConditions.IfNotModified,
+                    tags=self.call_tags('backfill_timestamps'),
+                )
+            except exceptions.CosmosAccessConditionFailedError:
+                continue
+            updated += 1
+        return updated
+
+    @property
+    def invalidated_cache(self) -> ReadThroughCache:
+        return records_total_cache
+
+    def patch(
+        self, id: str, event_context: EventContext, set_values=None, **kwargs
+    ):
+        set_values = dict(set_values or {})
+        self.add_timestamps(set_values)
+        return InvalidateOnWriteMixin.patch(
+            self, id, event_context, set_values=set_values, **kwargs
+        )
+
+    def create_sql_interception_query(
         self,
         start_date,
         end_date,
@@ -194,48 +467,88 @@ class TimeEntryCosmosDBRepository(CosmosDBRepository):
         tenant_id,
         ignore_id=None,
         visible_only=True,
-        mapper: Callable = None,
-    ):
+    ) -> Tuple[str, list]:
+        """
+        Query of the time entries of the owner that overlap the range, i.e.
+        that start before it ends and end after it starts. Both bounds are
+        served by the composite indexes on `(owner_id, start_ts)` and
+        `(owner_id, end_ts)`, so the cost doesn't grow with the number of
+        entries of the owner.
+        """
         conditions = {
             "owner_id": owner_id,
             "tenant_id": tenant_id,
         }
         params = [
-            {"name": "@start_date", "value": start_date},
-            {"name": "@end_date", "value": end_date or current_datetime_str()},
+            {"name": "@start_ts", "value": str_to_timestamp(start_date)},
+            {
+                "name": "@end_ts",
+                "value": str_to_timestamp(end_date or current_datetime_str()),
+            },
             {"name": "@ignore_id", "value": ignore_id},
         ]
         params.extend(self.generate_params(conditions))
-        result = self.container.query_items(
-            query="""
+        query_str = """
             SELECT * FROM c
-            WHERE (((c.start_date BETWEEN @start_date AND @end_date)
-                  OR (c.end_date BETWEEN @start_date AND @end_date))
-                  OR ((@start_date BETWEEN c.start_date AND c.end_date)
-                  OR (@end_date BETWEEN c.start_date AND c.end_date)))
-                  AND c.start_date!= @end_date
-                  AND c.end_date!= @start_date
+            WHERE c.start_ts < @end_ts AND c.end_ts > @start_ts
             {conditions_clause}
             {ignore_id_condition}
             {visibility_condition}
-            {order_clause}
             """.format(
-                ignore_id_condition=self.create_sql_ignore_id_condition(
-                    ignore_id
-                ),
-                visibility_condition=self.create_sql_condition_for_visibility(
-                    visible_only
-                ),
-                conditions_clause=self.create_sql_where_conditions(conditions),
-                order_clause=self.create_sql_order_clause(),
+            ignore_id_condition=self.create_sql_ignore_id_condition(ignore_id),
+            visibility_condition=self.create_sql_condition_for_visibility(
+                visible_only
             ),
+            conditions_clause=self.create_sql_where_conditions(conditions),
+        )
+        return query_str, params
+
+    def find_interception_with_date_range(
+        self,
+        start_date,
+        end_date,
+        owner_id,
+        tenant_id,
+        ignore_id=None,
+        visible_only=True,
+        mapper: Callable = None,
+    ):
+        query_str, params = self.create_sql_interception_query(
+            start_date,
+            end_date,
+            owner_id,
+            tenant_id,
+            ignore_id=ignore_id,
+            visible_only=visible_only,
+        )
+        result = self.container.query_items(
+            query=query_str,
             parameters=params,
             partition_key=tenant_id,
+            tags=self.call_tags('find_interception_with_date_range'),
         )
 
         function_mapper = self.get_mapper_or_dict(mapper)
         return list(map(function_mapper, result))
 
+    def find_entries_ending_after(
+        self, event_context: EventContext, owner_id: str, date: datetime
+    ) -> List[dict]:
+        """
+        Time entries of the owner that end after the date, including the
+        running one
+        """
+        return CosmosDBRepository.find_all(
+            self,
+            event_context,
+            conditions={"owner_id": owner_id},
+            custom_sql_conditions=["c.end_ts > @end_ts"],
+            custom_params=[
+                {"name": "@end_ts", "value": int(date.timestamp() * 1000)}
+            ],
+            mapper=dict,
+        )
+
     def find_running(
         self, tenant_id: str, owner_id: str, mapper: Callable = None
     ):
@@ -259,12 +572,14 @@ class TimeEntryCosmosDBRepository(CosmosDBRepository):
             parameters=self.generate_params(conditions),
             partition_key=tenant_id,
             max_item_count=1,
+            tags=self.call_tags('find_running'),
         )
 
         function_mapper = self.get_mapper_or_dict(mapper)
         return function_mapper(next(result))
 
-    def validate_data(self, data, event_context: EventContext):
+    @staticmethod
+    def validate_dates(data):
         start_date = data.get('start_date')
 
         if data.get('end_date') is not None:
@@ -279,15 +594,159 @@ class TimeEntryCosmosDBRepository(CosmosDBRepository):
                     description="You cannot end a time entry in the future",
                 )
 
+    @staticmethod
+    def check_no_collision(collision: list):
+        if len(collision) > 0:
+            raise CustomError(
+                HTTPStatus.UNPROCESSABLE_ENTITY,
+                description="There is another time entry in that date range",
+            )
+
+    def validate_data(self, data, event_context: EventContext):
+        self.validate_dates(data)
+
         collision = self.find_interception_with_date_range(
-            start_date=start_date,
+            start_date=data.get('start_date'),
             end_date=data.get('end_date'),
             owner_id=event_context.user_id,
             tenant_id=event_context.tenant_id,
             ignore_id=data.get('id'),
         )
-        if len(collision) > 0:
-            raise CustomError(
-                HTTPStatus.UNPROCESSABLE_ENTITY,
-                description="There is another time entry in that date range",
-            )
+        self.check_no_collision(collision)
+
+
+class AsyncTimeEntryCosmosDBRepository(AsyncCosmosDBRepository):
+    """
+    Awaitable `find`, `find_all_entries`, `count`, `create` and
+    `partial_update` of the time entries of `repository`, and of the
+    projects, customers and activities that complete them. The overlap
+    query of the validation is awaited too.
+    """
+
+    repository: TimeEntryCosmosDBRepository
+
+    def __init__(
+        self,
+        repository: TimeEntryCosmosDBRepository,
+        custom_cosmos_helper: AsyncCosmosDBFacade = None,
+    ):
+        AsyncCosmosDBRepository.__init__(
+            self, repository, custom_cosmos_helper=custom_cosmos_helper
+        )
+        self.project_repository = AsyncCachedCosmosDBRepository(
+            projects_model.create_dao().repository,
+            custom_cosmos_helper=custom_cosmos_helper,
+        )
+        self.customer_repository = AsyncCachedCosmosDBRepository(
+            customers_model.create_dao().repository,
+            custom_cosmos_helper=custom_cosmos_helper,
+        )
+        self.activity_repository = AsyncCachedCosmosDBRepository(
+            activities_model.create_dao().repository,
+            custom_cosmos_helper=custom_cosmos_helper,
+        )
+
+    async def find_all_entries(
+        self,
+        event_context: EventContext,
+        conditions: dict = None,
+        custom_sql_conditions: List[str] = None,
+        date_range: dict = None,
+        **kwargs,
+    ):
+        custom_sql_conditions = (
+            custom_sql_conditions if custom_sql_conditions else []
+        )
+        date_range = date_range if date_range else {}
+
+        custom_sql_conditions.append(
+            self.repository.create_sql_date_range_filter(date_range)
+        )
+        return await AsyncCosmosDBRepository.find_all(
+            self,
+            event_context,
+            conditions=conditions,
+            custom_sql_conditions=custom_sql_conditions,
+            custom_params=self.repository.generate_date_range_params(
+                date_range
+            ),
+            max_count=kwargs.get("max_count", None),
+            offset=kwargs.get("offset", 0),
+        )
+
+    async def count(
+        self,
+        event_context: EventContext,
+        conditions: dict = None,
+        custom_sql_conditions: List[str] = None,
+        date_range: dict = None,
+        **kwargs,
+    ):
+        custom_sql_conditions = (
+            custom_sql_conditions if custom_sql_conditions else []
+        )
+        date_range = date_range if date_range else {}
+
+        custom_sql_conditions.append(
+            self.repository.create_sql_date_range_filter(date_range)
+        )
+        return await AsyncCosmosDBRepository.count(
+            self,
+            event_context,
+            conditions=conditions,
+            custom_sql_conditions=custom_sql_conditions,
+            custom_params=self.repository.generate_date_range_params(
+                date_range
+            ),
+        )
+
+    async def find_projects(self, event_context: EventContext) -> list:
+        """
+        The projects whose customer is active, with the name of the
+        customer, as `ProjectCosmosDBDao.get_all` returns them. The
+        customers and the projects are found at the same time.
+        """
+        customers, projects = await asyncio.gather(
+            self.customer_repository.find_all(event_context),
+            self.project_repository.find_all(event_context),
+        )
+        customers_id = {customer.id for customer in customers}
+        projects = [
+            project
+            for project in projects
+            if project.customer_id in customers_id
+        ]
+        add_customer_name_to_projects(projects, customers)
+        return projects
+
+    async def on_create(
+        self, new_item_data: dict, event_context: EventContext
+    ):
+        self.repository.prepare_new_item(new_item_data, event_context)
+        await self.validate_data(new_item_data, event_context)
+
+    async def on_update(
+        self, updated_item_data: dict, event_context: EventContext
+    ):
+        is_update_to_delete = 'deleted' in updated_item_data
+        if not is_update_to_delete:
+            await self.validate_data(updated_item_data, event_context)
+        self.repository.prepare_updated_item(updated_item_data)
+
+    async def validate_data(self, data, event_context: EventContext):
+        self.repository.validate_dates(data)
+
+        query_str, params = self.repository.create_sql_interception_query(
+            start_date=data.get('start_date'),
+            end_date=data.get('end_date'),
+            owner_id=event_context.user_id,
+            tenant_id=event_context.tenant_id,
+            ignore_id=data.get('id'),
+        )
+        result = self.container.query_items(
+            query=query_str,
+            parameters=params,
+            partition_key=event_context.tenant_id,
+            tags=self.call_tags('validate_data', event_context),
+        )
+        self.repository.check_no_collision([item async for item in result])
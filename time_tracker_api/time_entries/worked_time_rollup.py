@@ -0,0 +1,327 @@
+"""
+Worked time of every owner per local day, kept in the `worked_time_rollup`
+container from the change feed of the time entries
+
+With `WORKED_TIME_ROLLUP_ENABLED`, the summary of the worked time reads the
+totals of the past days of the week and the month, at most 30 small
+documents, instead of every time entry of the month. Today is still
+computed from the time entries that end after it started, so the running
+entry and the ones that cross midnight are counted up to the current time.
+
+Every finished time entry has an `entry` document with the seconds it adds
+to each day, and every day has a `day` document with the seconds of each of
+its entries. A change of an entry replaces its seconds in the days it used
+to add to and in the ones it adds to now, with a transactional batch that
+only succeeds if none of those documents changed since they were read.
+Applying the same change twice does nothing, so the feed can be read again,
+e.g. by the process that takes over the lease of the feed. The past days of
+the summary lag behind the time entries by up to
+`WORKED_TIME_ROLLUP_POLL_INTERVAL` seconds.
+
+The days are those of the time zone `ROLLUP_TIME_OFFSET` minutes behind UTC,
+the default of the summary. The summary for any other offset is computed
+from the time entries.
+"""
+from datetime import datetime, time, timedelta, timezone, tzinfo
+from typing import Callable, Dict, List, Optional
+
+from azure.cosmos import PartitionKey
+from azure.cosmos.exceptions import (
+    CosmosBatchOperationError,
+    CosmosResourceNotFoundError,
+)
+from flask import Flask
+
+from commons.data_access_layer import cosmos_db
+from commons.data_access_layer.cosmos_db_change_feed import (
+    ChangeFeedPoller,
+    ChangeFeedReader,
+    ContinuationStore,
+    LeaseContinuationStore,
+    lease_container_definition,
+)
+from utils.time import str_to_datetime
+from utils.worked_time import DEFAULT_TIME_OFFSET, seconds_summary
+
+ROLLUP_TIME_OFFSET = DEFAULT_TIME_OFFSET
+ROLLUP_MAX_RETRIES = 5
+WORKED_TIME_ROLLUP_POLL_INTERVAL = 5
+CHANGE_FEED_KEY = 'time_entry:worked_time_rollup'
+
+container_definition = {
+    'id': 'worked_time_rollup',
+    'partition_key': PartitionKey(path='/tenant_id'),
+}
+
+
+def seconds_per_day(
+    start: datetime, end: datetime, tz: tzinfo
+) -> Dict[str, float]:
+    """
+    Seconds from `start` to `end` in each day of the time zone, by ISO date
+    """
+    result = {}
+    start, end = start.astimezone(tz), end.astimezone(tz)
+    while start < end:
+        next_day = datetime.combine(
+            start.date() + timedelta(days=1), time(), tz
+        )
+        cut = min(end, next_day)
+        day = start.date().isoformat()
+        result[day] = result.get(day, 0) + (cut - start).total_seconds()
+        start = cut
+    return result
+
+
+def day_document_id(owner_id: str, day: str) -> str:
+    return 'day:%s:%s' % (owner_id, day)
+
+
+def entry_document_id(time_entry_id: str) -> str:
+    return 'entry:%s' % time_entry_id
+
+
+class WorkedTimeRollup:
+    def __init__(self, container, time_offset: int = ROLLUP_TIME_OFFSET):
+        self.container = container
+        self.time_offset = time_offset
+        self.tz = timezone(timedelta(minutes=-time_offset))
+
+    def days_of(self, time_entry: dict) -> Dict[str, float]:
+        """
+        Seconds that the time entry adds to each day, by ISO date. Running
+        and deleted entries add nothing.
+        """
+        if (
+            time_entry.get('deleted')
+            or not time_entry.get('start_date')
+            or not time_entry.get('end_date')
+        ):
+            return {}
+        return seconds_per_day(
+            str_to_datetime(time_entry['start_date']),
+            str_to_datetime(time_entry['end_date']),
+            self.tz,
+        )
+
+    def read(self, id: str, tenant_id: str) -> Optional[dict]:
+        try:
+            return self.container.read_item(id, partition_key=tenant_id)
+        except CosmosResourceNotFoundError:
+            return None
+
+    @staticmethod
+    def write_operation(document: dict) -> tuple:
+        if document.get('_etag'):
+            return (
+                'replace',
+                (document['id'], document),
+                {'if_match_etag': document['_etag']},
+            )
+        return ('create', (document,))
+
+    def apply(self, time_entry: dict) -> bool:
+        """
+        Updates the days of the time entry with its latest version and
+        returns whether anything changed
+        """
+        tenant_id, owner_id = time_entry['tenant_id'], time_entry['owner_id']
+        days = {
+            day_document_id(owner_id, day): (day, seconds)
+            for day, seconds in self.days_of(time_entry).items()
+        }
+        retries = 0
+        while True:
+            entry = self.read(entry_document_id(time_entry['id']), tenant_id)
+            if entry is None:
+                entry = {
+                    'id': entry_document_id(time_entry['id']),
+                    'tenant_id': tenant_id,
+                    'owner_id': owner_id,
+                    'time_entry_id': time_entry['id'],
+                    'days': {},
+                }
+            previous_days = entry['days']
+            new_days = {id: seconds for id, (_, seconds) in days.items()}
+            if previous_days == new_days:
+                return False
+
+            operations = []
+            for day_id in sorted(previous_days.keys() | new_days.keys()):
+                seconds = new_days.get(day_id)
+                if previous_days.get(day_id) == seconds:
+                    continue
+                day = self.read(day_id, tenant_id)
+                if day is None:
+                    if seconds is None:
+                        continue
+                    day = {
+                        'id': day_id,
+                        'tenant_id': tenant_id,
+                        'owner_id': owner_id,
+                        'day': days[day_id][0],
+                        'time_entries': {},
+                    }
+                if seconds is None:
+                    day['time_entries'].pop(time_entry['id'], None)
+                else:
+                    day['time_entries'][time_entry['id']] = seconds
+                day['total_seconds'] = sum(day['time_entries'].values())
+                operations.append(self.write_operation(day))
+            entry['days'] = new_days
+            operations.append(self.write_operation(entry))
+
+            try:
+                self.container.execute_item_batch(
+                    operations, partition_key=tenant_id
+                )
+                return True
+            except CosmosBatchOperationError:
+                # A document was written by someone else since it was read
+                if retries >= ROLLUP_MAX_RETRIES:
+                    raise
+                retries += 1
+
+    def rebuild(self, time_entries_container) -> int:
+        """
+        Applies every time entry, e.g. to fill the rollup of the entries
+        made before it was enabled, and returns how many changed it
+        """
+        return sum(
+            self.apply(time_entry)
+            for time_entry in time_entries_container.read_all_items()
+        )
+
+    def find_day_totals(
+        self, tenant_id: str, owner_id: str, start_day: str, end_day: str
+    ) -> Dict[str, float]:
+        """
+        Worked seconds of the owner in the days from `start_day` until
+        `end_day`, not included
+        """
+        days = self.container.query_items(
+            query="""
+            SELECT c.day, c.total_seconds FROM c
+            WHERE c.owner_id = @owner_id
+            AND c.day >= @start_day AND c.day < @end_day
+            """,
+            parameters=[
+                {"name": "@owner_id", "value": owner_id},
+                {"name": "@start_day", "value": start_day},
+                {"name": "@end_day", "value": end_day},
+            ],
+            partition_key=tenant_id,
+        )
+        return {day['day']: day['total_seconds'] for day in days}
+
+    def summary(
+        self,
+        tenant_id: str,
+        owner_id: str,
+        find_entries_ending_after: Callable[[datetime], List[dict]],
+        now: datetime = None,
+    ) -> dict:
+        """
+        Worked time of the owner today, this week and this month. The past
+        days come from the rollup, and today and the running entry from the
+        time entries that `find_entries_ending_after` the start of the day.
+        """
+        now = (now or datetime.now(self.tz)).astimezone(self.tz)
+        today = datetime.combine(now.date(), time(), self.tz)
+        week_start = (today - timedelta(days=today.weekday())).date()
+        month_start = today.replace(day=1).date()
+        day_totals = self.find_day_totals(
+            tenant_id,
+            owner_id,
+            min(week_start, month_start).isoformat(),
+            today.date().isoformat(),
+        )
+
+        # The finished entries are in the rollup until today, the running
+        # one is not in it at all
+        live_totals: Dict[str, float] = {}
+        for time_entry in find_entries_ending_after(today):
+            start = str_to_datetime(time_entry['start_date'])
+            if time_entry.get('end_date'):
+                start = max(start, today)
+                end = min(str_to_datetime(time_entry['end_date']), now)
+            else:
+                end = now
+            for day, seconds in seconds_per_day(start, end, self.tz).items():
+                live_totals[day] = live_totals.get(day, 0) + seconds
+        today_seconds = live_totals.get(today.date().isoformat(), 0)
+
+        def total_since(first_day) -> float:
+            return sum(
+                seconds
+                for totals in (day_totals, live_totals)
+                for day, seconds in totals.items()
+                if day >= first_day.isoformat()
+            )
+
+        return {
+            'day': seconds_summary(today_seconds),
+            'week': seconds_summary(total_since(week_start)),
+            'month': seconds_summary(total_since(month_start)),
+        }
+
+
+class WorkedTimeRollupProcessor(ChangeFeedPoller):
+    """
+    Applies the changes of the time entries to the rollup, from the
+    beginning of the feed the first time. With a `LeaseContinuationStore`,
+    every process runs the processor but only the owner of the lease reads
+    the feed.
+    """
+
+    thread_name = 'worked-time-rollup'
+    poll_on_start = False
+
+    def __init__(
+        self,
+        rollup: WorkedTimeRollup,
+        time_entries_container,
+        store: ContinuationStore,
+        poll_interval: float = WORKED_TIME_ROLLUP_POLL_INTERVAL,
+    ):
+        super().__init__(
+            [
+                ChangeFeedReader(
+                    time_entries_container,
+                    rollup.apply,
+                    store,
+                    key=CHANGE_FEED_KEY,
+                    start_from_beginning=True,
+                )
+            ],
+            poll_interval,
+        )
+
+
+rollup: WorkedTimeRollup = None
+rollup_processor: WorkedTimeRollupProcessor = None
+
+
+def init_app(app: Flask) -> None:
+    """
+    Like the change feed invalidator, the processor starts on the first
+    request, in every worker forked by the server. The continuation is
+    leased in the `change_feed_lease` container, so a single worker of the
+    deployment applies the changes and another one takes over if it stops.
+    """
+    global rollup, rollup_processor
+    if not app.config.get('WORKED_TIME_ROLLUP_ENABLED'):
+        return
+
+    db = cosmos_db.cosmos_helper.db
+    rollup = WorkedTimeRollup(
+        db.get_container_client(container_definition['id'])
+    )
+    rollup_processor = WorkedTimeRollupProcessor(
+        rollup,
+        db.get_container_client('time_entry'),
+        LeaseContinuationStore(
+            db.get_container_client(lease_container_definition['id'])
+        ),
+    )
+    app.before_first_request(rollup_processor.start)
@@ -4,7 +4,7 @@ from flask_restplus import fields, Resource
 from time_tracker_api.api import common_fields, api
 from time_tracker_api.security import current_user_id
 
-from utils.azure_users import AzureConnection
+from utils.azure_users import azure_directory
 
 ns = api.namespace('users', description='Namespace of the API for users')
 
@@ -46,14 +46,13 @@ class Users(Resource):
     @ns.marshal_list_with(user_response_fields)
     def get(self):
         """List all users"""
-        azure_connection = AzureConnection()
-        is_current_user_a_tester = azure_connection.is_test_user(
+        is_current_user_a_tester = azure_directory.is_test_user(
             current_user_id()
         )
         return (
-            azure_connection.users()
+            azure_directory.users()
             if is_current_user_a_tester
-            else azure_connection.get_non_test_users()
+            else azure_directory.get_non_test_users()
         )
 
 
@@ -72,7 +71,7 @@ class GrantRole(Resource):
             - admin
         ```
         """
-        return AzureConnection().update_role(user_id, role_id, is_grant=True)
+        return azure_directory.update_role(user_id, role_id, is_grant=True)
 
 
 @ns.route('/<string:user_id>/roles/<string:role_id>/revoke')
@@ -83,4 +82,4 @@ class RevokeRole(Resource):
     @ns.marshal_with(user_response_fields)
     def post(self, user_id, role_id):
         """Revoke role to user"""
-        return AzureConnection().update_role(user_id, role_id, is_grant=False)
+        return azure_directory.update_role(user_id, role_id, is_grant=False)
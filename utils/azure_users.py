@@ -1,8 +1,16 @@
 import msal
 import os
+import re
 import requests
 import json
-from typing import List
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from typing import Iterable, List, Optional, Set, Tuple
+from urllib3.util.retry import Retry
 
 
 class MSConfig:
@@ -45,11 +53,6 @@ class AzureUser:
         self.roles = roles
 
 
-HTTP_PATCH_HEADERS = {
-    'Content-type': 'application/json',
-    'Accept': 'application/json',
-}
-
 ROLE_FIELD_VALUES = {
     'admin': (
         'extension_1d76efa96f604499acc0c0ee116a1453_role',
@@ -62,24 +65,145 @@ ROLE_FIELD_VALUES = {
 }
 
 
+DIRECTORY_REFRESH_INTERVAL = 300
+HTTP_POOL_SIZE = 20
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+# IDs per `$filter=objectId in (...)` query, the most Azure AD takes
+USERS_FILTER_CHUNK_SIZE = 15
+USERS_CACHE_MAX_SIZE = 4096
+
+logger = logging.getLogger(__name__)
+
+
+def create_http_session() -> requests.Session:
+    """
+    Session whose connections are kept alive and reused by all the
+    requests to Azure AD. The requests that fail with 429 or 5xx are retried
+    with exponential backoff, honoring the Retry-After header.
+    """
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=HTTP_RETRY_STATUSES,
+        method_whitelist=frozenset(['GET', 'PATCH', 'POST']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+http_session = create_http_session()
+
+
+class BatchResponse:
+    def __init__(self, status_code: int, body: Optional[dict]):
+        self.status_code = status_code
+        self.body = body
+
+
+def create_batch_body(
+    operations: List[Tuple[str, str, Optional[dict]]], boundary: str
+) -> str:
+    """
+    Multipart body of an OData batch. Each write goes in its own changeset,
+    as the protocol requires, and the operations run in the given order.
+    """
+    lines = []
+    for method, url, data in operations:
+        lines.append('--%s' % boundary)
+        changeset = None
+        if method != 'GET':
+            changeset = 'changeset_%s' % uuid.uuid4()
+            lines.extend(
+                [
+                    'Content-Type: multipart/mixed; boundary=%s' % changeset,
+                    '',
+                    '--%s' % changeset,
+                ]
+            )
+        lines.extend(
+            [
+                'Content-Type: application/http',
+                'Content-Transfer-Encoding: binary',
+                '',
+                '%s %s HTTP/1.1' % (method, url),
+                'Accept: application/json',
+            ]
+        )
+        if data is not None:
+            lines.extend(
+                ['Content-Type: application/json', '', json.dumps(data)]
+            )
+        lines.append('')
+        if changeset:
+            lines.append('--%s--' % changeset)
+    lines.append('--%s--' % boundary)
+    return '\r\n'.join(lines)
+
+
+def parse_batch_response(content: str, content_type: str) -> list:
+    boundary = re.search(r'boundary=([^;\s]+)', content_type).group(1)
+    responses = []
+    content = content.replace('\r\n', '\n')
+    for part in content.split('--%s' % boundary.strip('"'))[1:]:
+        if part.startswith('--'):
+            break
+        part_headers, _, part_body = part.strip('\n').partition('\n\n')
+        changeset = re.search(
+            r'content-type:\s*(multipart/mixed;.*)', part_headers, re.I
+        )
+        if changeset:
+            responses.extend(
+                parse_batch_response(part_body, changeset.group(1))
+            )
+            continue
+        status_line, _, http_response = part_body.partition('\n')
+        _, _, body = http_response.partition('\n\n')
+        responses.append(
+            BatchResponse(
+                int(status_line.split()[1]),
+                json.loads(body) if body.strip() else None,
+            )
+        )
+    return responses
+
+
+# One MSAL client per configuration, so its token cache outlives the
+# connections
+msal_clients = {}
+msal_clients_lock = threading.Lock()
+
+
 class AzureConnection:
     def __init__(self, config=MSConfig):
         self.config = config
+        self.session = http_session
         self.client = self.get_msal_client()
         self.access_token = self.get_token()
 
     def get_msal_client(self):
-        client = msal.ConfidentialClientApplication(
-            self.config.CLIENT_ID,
-            authority=self.config.AUTHORITY,
-            client_credential=self.config.SECRET,
-        )
-        return client
+        with msal_clients_lock:
+            if self.config not in msal_clients:
+                msal_clients[self.config] = msal.ConfidentialClientApplication(
+                    self.config.CLIENT_ID,
+                    authority=self.config.AUTHORITY,
+                    client_credential=self.config.SECRET,
+                )
+            return msal_clients[self.config]
 
     def get_token(self):
-        response = self.client.acquire_token_for_client(
-            scopes=self.config.SCOPE
+        # The token of the cache is used until it expires
+        scopes = self.config.SCOPE
+        response = self.client.acquire_token_silent(
+            [scopes] if isinstance(scopes, str) else scopes, account=None
         )
+        if not response or "access_token" not in response:
+            response = self.client.acquire_token_for_client(scopes=scopes)
         if "access_token" in response:
             return response['access_token']
         else:
@@ -94,11 +218,77 @@ class AzureConnection:
             endpoint=self.config.ENDPOINT,
             role_fields_params=role_fields_params,
         )
-        response = requests.get(endpoint, auth=BearerAuth(self.access_token))
+        return [self.to_azure_user(item) for item in self.get_all(endpoint)]
 
-        assert 200 == response.status_code
-        assert 'value' in response.json()
-        return [self.to_azure_user(item) for item in response.json()['value']]
+    def users_by_ids(self, ids: List[str]) -> List[AzureUser]:
+        """
+        Only the users with the given IDs, queried in chunks of
+        `USERS_FILTER_CHUNK_SIZE` IDs
+        """
+        role_fields_params = ','.join(
+            [field_name for field_name, _ in ROLE_FIELD_VALUES.values()]
+        )
+        users = []
+        for i in range(0, len(ids), USERS_FILTER_CHUNK_SIZE):
+            ids_params = ','.join(
+                "'{}'".format(user_id)
+                for user_id in ids[i : i + USERS_FILTER_CHUNK_SIZE]
+            )
+            endpoint = "{endpoint}/users?api-version=1.6&$filter=objectId in ({ids_params})&$select=displayName,otherMails,objectId,{role_fields_params}".format(
+                endpoint=self.config.ENDPOINT,
+                ids_params=ids_params,
+                role_fields_params=role_fields_params,
+            )
+            users.extend(
+                self.to_azure_user(item) for item in self.get_all(endpoint)
+            )
+        return users
+
+    def get_all(self, endpoint: str) -> list:
+        """
+        Items of every page of a collection, following `odata.nextLink`
+        """
+        items = []
+        while endpoint:
+            response = self.session.get(
+                endpoint, auth=BearerAuth(self.access_token)
+            )
+            assert 200 == response.status_code
+            assert 'value' in response.json()
+            items.extend(response.json()['value'])
+            next_link = response.json().get('odata.nextLink')
+            endpoint = (
+                "{endpoint}/{next_link}&api-version=1.6".format(
+                    endpoint=self.config.ENDPOINT, next_link=next_link
+                )
+                if next_link
+                else None
+            )
+        return items
+
+    def batch(
+        self, operations: List[Tuple[str, str, Optional[dict]]]
+    ) -> List[BatchResponse]:
+        """
+        Sends the `(method, url, data)` operations in a single `$batch`
+        request and returns their responses in the same order
+        """
+        boundary = 'batch_%s' % uuid.uuid4()
+        response = self.session.post(
+            "{endpoint}/$batch?api-version=1.6".format(
+                endpoint=self.config.ENDPOINT
+            ),
+            auth=BearerAuth(self.access_token),
+            data=create_batch_body(operations, boundary),
+            headers={
+                'Content-Type': 'multipart/mixed; boundary=%s' % boundary,
+                'Accept': 'multipart/mixed',
+            },
+        )
+        assert 202 == response.status_code or 200 == response.status_code
+        return parse_batch_response(
+            response.text, response.headers['Content-Type']
+        )
 
     def to_azure_user(self, item) -> AzureUser:
         there_is_email = len(item['otherMails']) > 0
@@ -119,18 +309,13 @@ class AzureConnection:
         )
 
         data = self.get_role_data(role_id, is_grant)
-        response = requests.patch(
-            endpoint,
-            auth=BearerAuth(self.access_token),
-            data=json.dumps(data),
-            headers=HTTP_PATCH_HEADERS,
+        patch_response, get_response = self.batch(
+            [('PATCH', endpoint, data), ('GET', endpoint, None)]
         )
-        assert 204 == response.status_code
+        assert 204 == patch_response.status_code
+        assert 200 == get_response.status_code
 
-        response = requests.get(endpoint, auth=BearerAuth(self.access_token))
-        assert 200 == response.status_code
-
-        return self.to_azure_user(response.json())
+        return self.to_azure_user(get_response.body)
 
     def get_non_test_users(self) -> List[AzureUser]:
         test_user_ids = self.get_test_user_ids()
@@ -148,7 +333,9 @@ class AzureConnection:
         endpoint = "{endpoint}/users/{user_id}?api-version=1.6".format(
             endpoint=self.config.ENDPOINT, user_id=user_id
         )
-        response = requests.get(endpoint, auth=BearerAuth(self.access_token))
+        response = self.session.get(
+            endpoint, auth=BearerAuth(self.access_token)
+        )
         assert 200 == response.status_code
         item = response.json()
         field_name, field_value = ROLE_FIELD_VALUES['test']
@@ -161,7 +348,160 @@ class AzureConnection:
             field_name=field_name,
             field_value=field_value,
         )
-        response = requests.get(endpoint, auth=BearerAuth(self.access_token))
-        assert 200 == response.status_code
-        assert 'value' in response.json()
-        return [item['objectId'] for item in response.json()['value']]
+        return [item['objectId'] for item in self.get_all(endpoint)]
+
+
+class DirectorySnapshot:
+    def __init__(self, users: List[AzureUser], test_user_ids: Set[str]):
+        self.users = users
+        self.test_user_ids = test_user_ids
+
+
+class AzureDirectory:
+    """
+    Users of the directory and IDs of the test users, kept in memory by the
+    whole process. They are downloaded on first use and then refreshed in
+    a background thread every `refresh_interval` seconds, so the requests
+    don't wait for Azure AD. The role updates are applied to the snapshot
+    right away.
+
+    `users_by_ids` doesn't download the directory. Until the snapshot is
+    loaded, it queries the missing users only and keeps them in an LRU
+    cache for `refresh_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        connection_factory=AzureConnection,
+        refresh_interval: float = DIRECTORY_REFRESH_INTERVAL,
+        users_cache_max_size: int = USERS_CACHE_MAX_SIZE,
+        clock=time.monotonic,
+    ):
+        self.connection_factory = connection_factory
+        self.refresh_interval = refresh_interval
+        self.snapshot: Optional[DirectorySnapshot] = None
+        self.lock = threading.Lock()
+        self.users_cache: OrderedDict = OrderedDict()
+        self.users_cache_max_size = users_cache_max_size
+        self.users_cache_lock = threading.Lock()
+        self.clock = clock
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def refresh(self) -> DirectorySnapshot:
+        connection = self.connection_factory()
+        snapshot = DirectorySnapshot(
+            connection.users(), set(connection.get_test_user_ids())
+        )
+        self.snapshot = snapshot
+        return snapshot
+
+    def get_snapshot(self) -> DirectorySnapshot:
+        snapshot = self.snapshot
+        if snapshot is not None:
+            return snapshot
+        with self.lock:
+            if self.snapshot is None:
+                self.refresh()
+                self.start()
+            return self.snapshot
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, name='azure-directory', daemon=True
+            )
+            self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("Azure AD users could not be refreshed: %s", e)
+
+    def clear(self) -> None:
+        self.snapshot = None
+        with self.users_cache_lock:
+            self.users_cache.clear()
+
+    def users(self) -> List[AzureUser]:
+        return list(self.get_snapshot().users)
+
+    def users_by_ids(self, ids: Iterable[str]) -> List[AzureUser]:
+        ids = {user_id for user_id in ids if user_id}
+        snapshot = self.snapshot
+        if snapshot is not None:
+            return [user for user in snapshot.users if user.id in ids]
+
+        users, missing_ids = [], []
+        with self.users_cache_lock:
+            now = self.clock()
+            for user_id in ids:
+                entry = self.users_cache.get(user_id)
+                if entry is not None and entry[0] > now:
+                    self.users_cache.move_to_end(user_id)
+                    users.append(entry[1])
+                else:
+                    missing_ids.append(user_id)
+        if not missing_ids:
+            return users
+
+        fetched_users = self.connection_factory().users_by_ids(
+            sorted(missing_ids)
+        )
+        self.cache_users(fetched_users)
+        return users + fetched_users
+
+    def cache_users(self, users: List[AzureUser]) -> None:
+        with self.users_cache_lock:
+            expires_at = self.clock() + self.refresh_interval
+            for user in users:
+                self.users_cache[user.id] = (expires_at, user)
+                self.users_cache.move_to_end(user.id)
+            while len(self.users_cache) > self.users_cache_max_size:
+                self.users_cache.popitem(last=False)
+
+    def get_test_user_ids(self) -> List[str]:
+        return list(self.get_snapshot().test_user_ids)
+
+    def is_test_user(self, user_id) -> bool:
+        return user_id in self.get_snapshot().test_user_ids
+
+    def get_non_test_users(self) -> List[AzureUser]:
+        snapshot = self.get_snapshot()
+        return [
+            user
+            for user in snapshot.users
+            if user.id not in snapshot.test_user_ids
+        ]
+
+    def update_role(self, user_id, role_id, is_grant) -> AzureUser:
+        updated_user = self.connection_factory().update_role(
+            user_id, role_id, is_grant=is_grant
+        )
+        snapshot = self.snapshot
+        if snapshot is not None:
+            test_user_ids = set(snapshot.test_user_ids)
+            if role_id == 'test':
+                if is_grant:
+                    test_user_ids.add(user_id)
+                else:
+                    test_user_ids.discard(user_id)
+            self.snapshot = DirectorySnapshot(
+                [
+                    updated_user if user.id == user_id else user
+                    for user in snapshot.users
+                ],
+                test_user_ids,
+            )
+        with self.users_cache_lock:
+            if user_id in self.users_cache:
+                self.users_cache[user_id] = (
+                    self.users_cache[user_id][0],
+                    updated_user,
+                )
+        return updated_user
+
+
+azure_directory = AzureDirectory()
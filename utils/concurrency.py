@@ -0,0 +1,79 @@
+"""
+Thread pool shared by all the requests to make independent I/O calls, like
+the lookups that complete the time entries, at the same time. It is bounded,
+so a burst of requests queues its calls instead of opening more and more
+connections to Cosmos DB and Azure AD.
+"""
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import wraps
+from typing import Callable, Tuple
+
+import flask
+
+FAN_OUT_MAX_WORKERS = 16
+
+executor = ThreadPoolExecutor(
+    max_workers=FAN_OUT_MAX_WORKERS, thread_name_prefix='fan-out'
+)
+
+
+def in_current_context(function: Callable) -> Callable:
+    """
+    Makes the function run with the request and the `flask.g` of the
+    current request. Their contexts are only bound to the worker, not
+    pushed as a new request, so the teardown functions of the request, like
+    the one that aggregates its metrics, don't run again when the call ends.
+    """
+    if not flask.has_request_context():
+        return function
+
+    app_context = flask._app_ctx_stack.top
+    request_context = flask._request_ctx_stack.top
+
+    @wraps(function)
+    def run_in_context(*args, **kwargs):
+        flask._app_ctx_stack.push(app_context)
+        flask._request_ctx_stack.push(request_context)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            flask._request_ctx_stack.pop()
+            flask._app_ctx_stack.pop()
+
+    return run_in_context
+
+
+def fan_out(*calls: Tuple[Callable, float]) -> list:
+    """
+    Runs the `(function, timeout)` calls at the same time in the shared pool
+    and returns their results in the same order. Each timeout, in seconds,
+    counts from the moment the calls are submitted, so the time waiting for
+    a free worker is included.
+
+    :raises concurrent.futures.TimeoutError: if a call does not finish in time
+    :raises Exception: the error of the first call that failed, in order
+    """
+    submitted_at = time.monotonic()
+    futures = [
+        (executor.submit(in_current_context(function)), timeout)
+        for function, timeout in calls
+    ]
+    try:
+        return [
+            future.result(max(0, submitted_at + timeout - time.monotonic()))
+            for future, timeout in futures
+        ]
+    finally:
+        for future, _ in futures:
+            future.cancel()
+
+
+def in_background(function: Callable) -> Future:
+    """
+    Starts the function in the shared pool, with the current request,
+    while the caller makes its own call in its thread. Unlike with
+    `fan_out`, that call can fan out in turn without holding a worker of the
+    pool while it waits for the others.
+    """
+    return executor.submit(in_current_context(function))
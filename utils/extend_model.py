@@ -1,5 +1,35 @@
 import re
 
+from utils.join import Join, join
+
+
+def archived_name(item) -> str:
+    return item.name + " (archived)" if item.is_deleted() else item.name
+
+
+def customer_name_join(customers) -> Join:
+    return Join(customers, 'customer_id', {'customer_name': 'name'})
+
+
+def project_info_join(projects) -> Join:
+    return Join(
+        projects,
+        'project_id',
+        {
+            'project_name': archived_name,
+            'customer_id': 'customer_id',
+            'customer_name': 'customer_name',
+        },
+    )
+
+
+def activity_name_join(activities) -> Join:
+    return Join(activities, 'activity_id', {'activity_name': archived_name})
+
+
+def user_email_join(users) -> Join:
+    return Join(users, 'owner_id', {'owner_email': 'email'})
+
 
 def add_customer_name_to_projects(projects, customers):
     """
@@ -7,13 +37,8 @@ def add_customer_name_to_projects(projects, customers):
     project
     :param (list) projects: projects retrieved from project repository
     :param (list) customers: customers retrieved from customer repository
-
-    TODO : check if we can improve this by using the overwritten __add__ method
     """
-    for project in projects:
-        for customer in customers:
-            if project.customer_id == customer.id:
-                setattr(project, 'customer_name', customer.name)
+    join(projects, customer_name_join(customers))
 
 
 def add_project_info_to_time_entries(time_entries, projects):
@@ -22,31 +47,31 @@ def add_project_info_to_time_entries(time_entries, projects):
     time_entry
     :param (list) time_entries: time_entries retrieved from time-entry repository
     :param (list) projects: projects retrieved from project repository
-
-    TODO : check if we can improve this by using the overwritten __add__ method
     """
-    for time_entry in time_entries:
-        for project in projects:
-            if time_entry.project_id == project.id:
-                name = project.name + " (archived)" if project.is_deleted() else project.name
-                setattr(time_entry, 'project_name', name)
-                setattr(time_entry, 'customer_id', project.customer_id)
-                setattr(time_entry, 'customer_name', project.customer_name)
+    join(time_entries, project_info_join(projects))
 
 
 def add_activity_name_to_time_entries(time_entries, activities):
-    for time_entry in time_entries:
-        for activity in activities:
-            if time_entry.activity_id == activity.id:
-                name = activity.name + " (archived)" if activity.is_deleted() else activity.name
-                setattr(time_entry, 'activity_name', name)
+    join(time_entries, activity_name_join(activities))
 
 
 def add_user_email_to_time_entries(time_entries, users):
-    for time_entry in time_entries:
-        for user in users:
-            if time_entry.owner_id == user.id:
-                setattr(time_entry, 'owner_email', user.email)
+    join(time_entries, user_email_join(users))
+
+
+def add_complementary_info_to_time_entries(
+    time_entries, projects, activities, users
+):
+    """
+    Add the project info, the activity name and the owner email to the
+    time entries in a single pass
+    """
+    join(
+        time_entries,
+        project_info_join(projects),
+        activity_name_join(activities),
+        user_email_join(users),
+    )
 
 
 def create_in_condition(
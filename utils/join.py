@@ -0,0 +1,53 @@
+"""
+Hash joins between the lists of models retrieved from different containers
+
+The items of each list to join are indexed by their key once, so copying
+their attributes to the entities takes a single pass over the entities,
+whatever the number of joins, instead of comparing every entity with every
+item.
+"""
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Union
+
+
+@dataclass
+class Join:
+    """
+    Copies to each entity the attributes of the item whose `key` is equal
+    to the `foreign_key` of the entity. `attributes` maps the name of the
+    attribute set in the entity to the name of the attribute of the item or
+    to a function that takes the item and returns the value.
+    """
+
+    items: Iterable
+    foreign_key: str
+    attributes: Dict[str, Union[str, Callable]] = field(default_factory=dict)
+    key: str = 'id'
+
+    def __post_init__(self):
+        self.index = index_by(self.items, self.key)
+
+    def apply(self, entity) -> None:
+        item = self.index.get(getattr(entity, self.foreign_key, None))
+        if item is None:
+            return
+        for attribute, value in self.attributes.items():
+            setattr(
+                entity,
+                attribute,
+                value(item) if callable(value) else getattr(item, value),
+            )
+
+
+def index_by(items: Iterable, key: str = 'id') -> dict:
+    """
+    Indexes the items by the value of their `key` attribute. The last item
+    wins if several have the same value.
+    """
+    return {getattr(item, key): item for item in items}
+
+
+def join(entities: Iterable, *joins: Join) -> None:
+    for entity in entities:
+        for entity_join in joins:
+            entity_join.apply(entity)
@@ -1,9 +1,17 @@
 import pytz
+from dateutil.parser import isoparse
+from functools import lru_cache
 from typing import Dict
 from datetime import datetime, timezone
 
+# Distinct date strings whose parsed dates are kept
+DATETIME_CACHE_SIZE = 4096
+
 
 def datetime_str(value: datetime) -> str:
+    """
+    ISO 8601 format of the date, the one `str_to_datetime` parses fastest
+    """
     if value is not None:
         return value.isoformat()
     else:
@@ -52,18 +60,29 @@ def get_date_range_of_month(year: int, month: int):
     return start_date, end_date
 
 
-def str_to_datetime(value: str) -> datetime:
-    def to_utc(date: datetime) -> datetime:
-        from pytz import timezone
-
-        _tz = timezone('UTC')
-        localized = _tz.localize(date)
-        return localized
+def str_to_timestamp(value: str) -> int:
+    """
+    Milliseconds since the epoch of the date, so the dates with different
+    offsets can be stored and compared as numbers
+    """
+    return round(str_to_datetime(value).timestamp() * 1000)
 
-    from dateutil.parser import isoparse
 
-    no_timezone_info = isoparse(value).tzinfo is None
-    if no_timezone_info:
-        return to_utc(isoparse(value))
-    else:
-        return isoparse(value)
+@lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def str_to_datetime(value: str) -> datetime:
+    """
+    Parses an ISO 8601 date, as UTC if it has no offset. The formats of
+    `datetime.fromisoformat`, which include the ones of `datetime_str`, take
+    the fast path, also with a trailing `Z`; any other, like a fraction of
+    seven digits, is parsed by dateutil. The dates of the latest distinct
+    values are kept, so parsing the same value again is a lookup.
+    """
+    try:
+        date = datetime.fromisoformat(
+            value[:-1] + '+00:00' if value.endswith('Z') else value
+        )
+    except ValueError:
+        date = isoparse(value)
+    if date.tzinfo is None:
+        return pytz.UTC.localize(date)
+    return date
@@ -1,24 +1,40 @@
 import pytz
 from datetime import datetime, timedelta, timezone
+from typing import Sequence, Tuple
 from utils.time import datetime_str, str_to_datetime
-from copy import deepcopy
+
+# NumPy is optional, it has no wheels for the Alpine image, where the
+# summary is computed in pure Python
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+DEFAULT_TIME_OFFSET = 300
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
 
 
 class DateRange:
-    def __init__(self, _timezone):
+    def __init__(self, _timezone, now: datetime = None):
         self.tz = _timezone
+        self.fixed_now = now
+
+    def now(self):
+        return self.fixed_now or datetime.now(self.tz)
 
     def start(self):
         raise NotImplementedError
 
     def end(self):
-        return datetime.now(self.tz)
+        return self.now()
 
 
 class MonthDateRange(DateRange):
     def start(self):
         return (
-            datetime.now(self.tz)
+            self.now()
             .replace(hour=0, minute=0, second=0, microsecond=0)
             .replace(day=1)
         )
@@ -26,18 +42,14 @@ class MonthDateRange(DateRange):
 
 class WeekDateRange(DateRange):
     def start(self):
-        result = datetime.now(self.tz).replace(
-            hour=0, minute=0, second=0, microsecond=0
-        )
+        result = self.now().replace(hour=0, minute=0, second=0, microsecond=0)
         result = result - timedelta(days=result.weekday())
         return result
 
 
 class DayDateRange(DateRange):
     def start(self):
-        return datetime.now(self.tz).replace(
-            hour=0, minute=0, second=0, microsecond=0
-        )
+        return self.now().replace(hour=0, minute=0, second=0, microsecond=0)
 
 
 def date_range():
@@ -49,103 +61,76 @@ def date_range():
     }
 
 
-class WorkedTime:
-    def __init__(self, time_entries):
-        self.time_entries = time_entries
-
-    def total_time_in_seconds(self):
-        times = [t.elapsed_time for t in self.time_entries]
-        total_time = sum(times, timedelta())
-        return total_time.total_seconds()
-
-    def hours(self):
-        return self.total_time_in_seconds() // 3600
-
-    def minutes(self):
-        return (self.total_time_in_seconds() % 3600) // 60
-
-    def seconds(self):
-        return (self.total_time_in_seconds() % 3600) % 60
-
-    def summary(self):
-        return {
-            "hours": self.hours(),
-            "minutes": self.minutes(),
-            "seconds": round(self.seconds(), 2),
-        }
+def seconds_summary(total_seconds: float) -> dict:
+    return {
+        "hours": total_seconds // 3600,
+        "minutes": (total_seconds % 3600) // 60,
+        "seconds": round((total_seconds % 3600) % 60, 2),
+    }
 
 
-def filter_time_entries(time_entries, dr: DateRange):
-    start, end = dr.start(), dr.end()
-    result = []
-    for t in time_entries:
-        te_start, te_end = (
-            str_to_datetime(t.start_date),
-            str_to_datetime(t.end_date),
-        )
-        in_range = start <= te_start <= end or start <= te_end <= end
-        if in_range:
-            result.append(deepcopy(t))
-    return result
-
-
-def cut_time_entries_out_of_range(time_entries, dr):
-    start, end = dr.start(), dr.end()
-    for t in time_entries:
-        te_start, te_end = (
-            str_to_datetime(t.start_date),
-            str_to_datetime(t.end_date),
+def to_microseconds(value: datetime) -> int:
+    return (value - EPOCH) // MICROSECOND
+
+
+def time_entries_to_arrays(
+    time_entries, now: datetime
+) -> Tuple[Sequence[int], Sequence[int]]:
+    """
+    Start and end of every time entry, in microseconds since the epoch, so
+    the dates are parsed only once. The running entries end now.
+    """
+    now_in_microseconds = to_microseconds(now)
+    starts = [
+        to_microseconds(str_to_datetime(t.start_date)) for t in time_entries
+    ]
+    ends = [
+        now_in_microseconds
+        if t.end_date is None
+        else to_microseconds(str_to_datetime(t.end_date))
+        for t in time_entries
+    ]
+    if np is None:
+        return starts, ends
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+def worked_seconds(
+    starts: Sequence[int], ends: Sequence[int], dr: DateRange
+) -> float:
+    """
+    Seconds of the time entries that start or end in the range, cut to it
+    """
+    start, end = to_microseconds(dr.start()), to_microseconds(dr.end())
+    if np is None:
+        return (
+            sum(
+                min(entry_end, end) - max(entry_start, start)
+                for entry_start, entry_end in zip(starts, ends)
+                if start <= entry_start <= end or start <= entry_end <= end
+            )
+            / 10**6
         )
-        if te_start < start:
-            t.start_date = datetime_str(start)
-        if end < te_end:
-            t.end_date = datetime_str(end)
-
-
-def worked_time_in_day(time_entries, tz):
-    dr = DayDateRange(tz)
-    day_time_entries = filter_time_entries(time_entries, dr)
-    cut_time_entries_out_of_range(day_time_entries, dr)
-    return WorkedTime(day_time_entries).summary()
-
-
-def worked_time_in_week(time_entries, tz):
-    dr = WeekDateRange(tz)
-    week_time_entries = filter_time_entries(time_entries, dr)
-    cut_time_entries_out_of_range(week_time_entries, dr)
-    return WorkedTime(week_time_entries).summary()
-
-
-def worked_time_in_month(time_entries, tz):
-    dr = MonthDateRange(tz)
-    month_time_entries = filter_time_entries(time_entries, dr)
-    cut_time_entries_out_of_range(month_time_entries, dr)
-    return WorkedTime(month_time_entries).summary()
-
-
-def stop_running_time_entry(time_entries, tz):
-    end = datetime.now(tz)
-    for t in time_entries:
-        if t.end_date is None:
-            t.end_date = datetime_str(end)
-
-
-def change_timezones(time_entries, tz):
-    for t in time_entries:
-        start_date = str_to_datetime(t.start_date)
-        end_date = str_to_datetime(t.end_date)
-
-        t.start_date = datetime_str(start_date.astimezone(tz))
-        t.end_date = datetime_str(end_date.astimezone(tz))
+    in_range = ((start <= starts) & (starts <= end)) | (
+        (start <= ends) & (ends <= end)
+    )
+    elapsed = np.minimum(ends, end) - np.maximum(starts, start)
+    return int(elapsed[in_range].sum()) / 10**6
 
 
 def summary(time_entries, time_offset):
-    offset_in_minutes = time_offset if time_offset else 300
+    offset_in_minutes = time_offset if time_offset else DEFAULT_TIME_OFFSET
     tz = timezone(timedelta(minutes=-offset_in_minutes))
-    stop_running_time_entry(time_entries, tz)
-    change_timezones(time_entries, tz)
+    now = datetime.now(tz)
+    starts, ends = time_entries_to_arrays(time_entries, now)
     return {
-        'day': worked_time_in_day(time_entries, tz),
-        'week': worked_time_in_week(time_entries, tz),
-        'month': worked_time_in_month(time_entries, tz),
+        'day': seconds_summary(
+            worked_seconds(starts, ends, DayDateRange(tz, now))
+        ),
+        'week': seconds_summary(
+            worked_seconds(starts, ends, WeekDateRange(tz, now))
+        ),
+        'month': seconds_summary(
+            worked_seconds(starts, ends, MonthDateRange(tz, now))
+        ),
     }